@@ -0,0 +1,17 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+# 
+# CONFIDENTIAL AND PROPRIETARY
+# 
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit 
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your 
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights 
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Benchmarks for the Perforce framework.  These are run from the command line, e.g.:
+
+    python -m benchmarks.submit_throughput --help
+
+and require Toolkit core (sgtk) and P4Python to be importable.
+"""
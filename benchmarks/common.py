@@ -0,0 +1,73 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+# 
+# CONFIDENTIAL AND PROPRIETARY
+# 
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit 
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your 
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights 
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Helpers shared by the benchmark scripts
+"""
+
+import imp
+import os
+import sys
+import time
+
+FRAMEWORK_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FRAMEWORK_PACKAGE = "tk_framework_perforce_bench"
+
+def import_framework_module(name):
+    """
+    Import a module from the framework's python folder without going through a
+    Toolkit engine, e.g. import_framework_module("util")
+
+    :param name:    The module name relative to the python folder
+    :returns:       The imported module
+    """
+    if FRAMEWORK_PACKAGE not in sys.modules:
+        imp.load_module(FRAMEWORK_PACKAGE, None, os.path.join(FRAMEWORK_ROOT, "python"),
+                        ("", "", imp.PKG_DIRECTORY))
+    full_name = "%s.%s" % (FRAMEWORK_PACKAGE, name)
+    __import__(full_name)
+    return sys.modules[full_name]
+
+class Timer(object):
+    """
+    Simple wall-clock timer for use in a with statement
+    """
+    def __init__(self):
+        self.start = None
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.time() - self.start
+        return False
+
+def format_bytes(num_bytes):
+    """
+    :returns:   A human readable string for the specified number of bytes
+    """
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(num_bytes) < 1024.0 or unit == "GB":
+            return "%.1f%s" % (num_bytes, unit)
+        num_bytes /= 1024.0
+
+def print_table(headers, rows):
+    """
+    Print a simple fixed-width table of results
+    """
+    widths = [len(h) for h in headers]
+    for row in rows:
+        widths = [max(w, len(str(c))) for w, c in zip(widths, row)]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    print("  ".join("-" * w for w in widths))
+    for row in rows:
+        print("  ".join(str(c).ljust(w) for c, w in zip(row, widths)))
@@ -0,0 +1,137 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Compare the memory retained by the results of fstat for a large listing when they are
+kept as dictionaries (the default) and as compact FileStatus records:
+
+    python -m benchmarks.file_status_memory --files 100000
+
+The fstat responses are synthesized and passed through marshal so that, like the output
+of 'p4 -G', every record holds its own copy of every string.  The size reported is the
+total size of all distinct objects reachable from the results, measured with
+sys.getsizeof, and the time is the time to build the results and to read the head
+revision of every file from them.
+"""
+
+import gc
+import marshal
+import optparse
+import sys
+
+from .common import import_framework_module, Timer, format_bytes, print_table
+
+_USERS = ["artist%03d" % ui for ui in range(20)]
+_TYPES = ["binary+l", "text", "binary", "text+k"]
+_ACTIONS = ["add", "edit", "integrate"]
+
+def _synthesize_response(num_files):
+    """
+    :returns:   The fstat response for num_files files in a typical project layout, with
+                files spread over directories of 50, as a list of marshalled records
+    """
+    chunks = []
+    for fi in range(num_files):
+        path = "project/assets/asset_%04d/publish/maya/file_%06d.v%03d.ma" % (fi / 50, fi, fi % 7)
+        record = {
+            "depotFile": "//depot/%s" % path,
+            "clientFile": "/mnt/projects/%s" % path,
+            "isMapped": "",
+            "headAction": _ACTIONS[fi % len(_ACTIONS)],
+            "headType": _TYPES[fi % len(_TYPES)],
+            "headTime": str(1434555433 + fi / 10),
+            "headRev": str(fi % 5 + 1),
+            "headChange": str(10000 + fi / 10),
+            "headModTime": str(1434555400 + fi / 10),
+            "haveRev": str(fi % 5 + 1),
+        }
+        if fi % 50 == 0:
+            record["otherOpen"] = ["%s@%s_ws" % (_USERS[fi % 20], _USERS[fi % 20])]
+            record["otherAction"] = ["edit"]
+            record["otherOpens"] = "1"
+        chunks.append(marshal.dumps(record))
+    return chunks
+
+def _parse_response(response):
+    """
+    :returns:   The list of records in the response
+    """
+    return [marshal.loads(chunk) for chunk in response]
+
+def _retained_size(root):
+    """
+    :returns:   The total size in bytes of all distinct objects reachable from root
+    """
+    seen = set()
+    total = 0
+    pending = [root]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(obj.iterkeys())
+            pending.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple)):
+            pending.extend(obj)
+        elif hasattr(type(obj), "__slots__"):
+            for slot in type(obj).__slots__:
+                value = getattr(obj, slot, None)
+                if value is not None:
+                    pending.append(value)
+    return total
+
+def run(util, num_files):
+    """
+    :returns:   List of (mode, retained bytes, build seconds, read seconds) tuples
+    """
+    response = _synthesize_response(num_files)
+    results = []
+    for mode, convert in [("dict", None), ("FileStatus", util.FileStatus)]:
+        gc.collect()
+        with Timer() as build_timer:
+            records = _parse_response(response)
+            if convert:
+                records = [convert(r) for r in records]
+            details = dict((r["depotFile"], r) for r in records)
+        del records
+
+        with Timer() as read_timer:
+            total = 0
+            for record in details.itervalues():
+                total += int(record["headRev"])
+
+        results.append((mode, _retained_size(details), build_timer.elapsed, read_timer.elapsed))
+        del details
+    return results
+
+def main():
+    parser = optparse.OptionParser(description="Compare the memory used by fstat results as dictionaries "
+                                               "and FileStatus records")
+    parser.add_option("--files", type="int", default=100000, help="Number of files in the listing")
+    options, _ = parser.parse_args()
+
+    util = import_framework_module("util")
+    results = run(util, options.files)
+
+    base_bytes = results[0][1]
+    rows = []
+    for mode, num_bytes, build_time, read_time in results:
+        rows.append([mode, format_bytes(num_bytes), "%.0f%%" % (100.0 * num_bytes / max(base_bytes, 1)),
+                     "%.0f" % (float(num_bytes) / max(options.files, 1)),
+                     "%.1fms" % (build_time * 1000.0), "%.1fms" % (read_time * 1000.0)])
+
+    print("fstat results for %d files" % options.files)
+    print_table(["records", "retained", "vs dict", "bytes/file", "build", "read headRev"], rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Measure the cost of initializing the framework in a batch (non-UI) Python process.
+
+Each scenario is run in a fresh Python process so that nothing is already imported:
+
+    init        what init_framework costs - P4Python and the framework's python package.
+                All other modules are imported on first access
+    p4python    importing P4Python on its own
+    connection  fw.connection on its own
+    util        fw.util on its own (this also imports parts of connection)
+    widgets     fw.widgets on its own (this imports Qt and all of the generated ui forms)
+    headless    connection & util - typical for a farm process
+    eager       connection, util & widgets - what init_framework used to import
+
+    python -m benchmarks.framework_init --runs 5
+"""
+
+import json
+import optparse
+import os
+import subprocess
+import sys
+import time
+
+from .common import FRAMEWORK_ROOT, print_table
+
+SCENARIOS = {
+    "init": ["loader"],
+    "p4python": [],
+    "connection": ["connection"],
+    "util": ["util"],
+    "widgets": ["widgets"],
+    "headless": ["connection", "util"],
+    "eager": ["connection", "util", "widgets"],
+}
+SCENARIO_ORDER = ["init", "p4python", "connection", "util", "widgets", "headless", "eager"]
+
+QT_MODULES = ["PySide", "PySide2", "PyQt4", "PyQt5"]
+
+
+def run_scenario(name):
+    """
+    Import the modules for a scenario in this process and print the result as json
+    """
+    start = time.time()
+    if name in ("init", "p4python"):
+        import P4
+    if name != "p4python":
+        from .common import import_framework_module
+        for module_name in SCENARIOS[name]:
+            import_framework_module(module_name)
+    elapsed = time.time() - start
+
+    qt_loaded = [m for m in QT_MODULES if m in sys.modules]
+    print(json.dumps({"elapsed": elapsed, "qt_loaded": qt_loaded}))
+
+
+def time_scenario(name, runs):
+    """
+    Run a scenario in a fresh Python process the specified number of times
+
+    :returns:   Tuple (list of timings, list of Qt modules that were imported)
+    """
+    timings = []
+    qt_loaded = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, "-m", "benchmarks.framework_init",
+                                          "--scenario", name], cwd=FRAMEWORK_ROOT)
+        result = json.loads(output.strip().splitlines()[-1])
+        timings.append(result["elapsed"])
+        qt_loaded = result["qt_loaded"]
+    return timings, qt_loaded
+
+
+def main():
+    parser = optparse.OptionParser(description="Measure framework init time in a batch Python process")
+    parser.add_option("--runs", type="int", default=5, help="Number of runs per scenario")
+    parser.add_option("--scenario", help=optparse.SUPPRESS_HELP)
+    options, _ = parser.parse_args()
+
+    if options.scenario:
+        run_scenario(options.scenario)
+        return
+
+    rows = []
+    for name in SCENARIO_ORDER:
+        timings, qt_loaded = time_scenario(name, options.runs)
+        rows.append([name, ", ".join(SCENARIOS[name]) or "-",
+                     "%.1fms" % (min(timings) * 1000.0),
+                     "%.1fms" % (sum(timings) * 1000.0 / len(timings)),
+                     ", ".join(qt_loaded) or "-"])
+
+    print_table(["scenario", "modules", "min", "mean", "qt imported"], rows)
+
+
+if __name__ == "__main__":
+    main()
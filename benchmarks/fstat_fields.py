@@ -0,0 +1,179 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Compare the size and parse time of fstat responses for all fields against each of the
+fstat field profiles (see util.FSTAT_FIELD_PROFILES) for a large listing:
+
+    python -m benchmarks.fstat_fields --files 20000
+    python -m benchmarks.fstat_fields --files 20000 --p4d p4d --p4 p4
+
+By default the responses are synthesized - every file record has the fields a typical
+fstat returns for a synced, submitted file.  With --p4d, the files are submitted to a
+local server and the responses are the real marshalled output of 'p4 -G fstat'.
+"""
+
+import marshal
+import optparse
+import os
+import subprocess
+import tempfile
+import time
+
+from .common import import_framework_module, Timer, format_bytes, print_table
+
+# the fields returned by fstat for a submitted file that is synced & opened by another user:
+_FULL_RECORD = {
+    "depotFile": "//depot/project/assets/character/hero/model/publish/maya/hero_model.v%03d.ma",
+    "clientFile": "/mnt/projects/project/assets/character/hero/model/publish/maya/hero_model.v%03d.ma",
+    "isMapped": "",
+    "headAction": "edit",
+    "headType": "binary+l",
+    "headTime": "1434555433",
+    "headRev": "3",
+    "headChange": "12345",
+    "headModTime": "1434555400",
+    "haveRev": "3",
+    "otherOpen": ["artist@artist_ws"],
+    "otherAction": ["edit"],
+    "otherChange": ["12346"],
+    "otherOpens": "1",
+    "otherLock": "",
+    "attr-shotgun_metadata": "{}",
+}
+
+def _synthesize_records(num_files):
+    """
+    :returns:   A list of full fstat records for num_files files
+    """
+    records = []
+    for fi in range(num_files):
+        record = dict(_FULL_RECORD)
+        record["depotFile"] = record["depotFile"] % fi
+        record["clientFile"] = record["clientFile"] % fi
+        records.append(record)
+    return records
+
+def _project(records, fields):
+    """
+    :returns:   The records containing only the specified fields (all if fields is None)
+    """
+    if fields is None:
+        return records
+    return [dict((k, v) for k, v in r.iteritems() if k in fields) for r in records]
+
+def _parse(data):
+    """
+    Parse a stream of marshalled records the same way 'p4 -G' output is parsed
+
+    :returns:   The number of records parsed
+    """
+    # marshal.load needs a real file in Python 2:
+    fh = tempfile.TemporaryFile()
+    try:
+        fh.write(data)
+        fh.seek(0)
+        count = 0
+        while True:
+            try:
+                marshal.load(fh)
+            except EOFError:
+                break
+            count += 1
+        return count
+    finally:
+        fh.close()
+
+def _time_parse(data):
+    """
+    :returns:   Tuple (seconds spent parsing, number of records)
+    """
+    start = time.time()
+    count = _parse(data)
+    return time.time() - start, count
+
+def run_synthetic(util, num_files):
+    """
+    :returns:   List of (profile, fields, bytes, parse seconds) tuples
+    """
+    records = _synthesize_records(num_files)
+    results = []
+    for profile in [None] + sorted(util.FSTAT_FIELD_PROFILES.keys()):
+        fields = None
+        if profile:
+            fields = util.expand_fstat_fields([profile, "headRev", "headAction"])
+        data = "".join(marshal.dumps(r) for r in _project(records, fields))
+        elapsed, _ = _time_parse(data)
+        results.append((profile or "all fields", len(fields) if fields else len(_FULL_RECORD),
+                        len(data), elapsed))
+    return results
+
+def run_p4d(util, num_files, p4d_exe, p4_exe):
+    """
+    :returns:   List of (profile, fields, bytes, parse seconds) tuples
+    """
+    from .p4d import LocalP4d
+
+    results = []
+    with LocalP4d(p4d_exe) as server:
+        p4 = server.connect()
+        client_root = p4.fetch_client(p4.client)._root
+
+        for fi in range(num_files):
+            path = os.path.join(client_root, "assets", "batch_%03d" % (fi / 1000), "file_%05d.ma" % fi)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "wb") as f:
+                f.write("file %d" % fi)
+        p4.run_add(os.path.join(client_root, "..."))
+        p4.run_submit("-d", "fstat benchmark files")
+
+        for profile in [None] + sorted(util.FSTAT_FIELD_PROFILES.keys()):
+            args = [p4_exe, "-G", "-p", server.port, "-u", p4.user, "-c", p4.client, "fstat"]
+            fields = None
+            if profile:
+                fields = util.expand_fstat_fields([profile, "headRev", "headAction"])
+                args += ["-T", ",".join(fields)]
+            args.append("//%s/..." % p4.client)
+            data = subprocess.check_output(args)
+            elapsed, _ = _time_parse(data)
+            results.append((profile or "all fields", len(fields) if fields else "-", len(data), elapsed))
+
+        p4.disconnect()
+    return results
+
+def main():
+    parser = optparse.OptionParser(description="Compare fstat response size & parse time per field profile")
+    parser.add_option("--files", type="int", default=20000, help="Number of files in the listing")
+    parser.add_option("--p4d", help="Run against a local server started with this p4d executable")
+    parser.add_option("--p4", default="p4", help="p4 executable used to capture marshalled output")
+    options, _ = parser.parse_args()
+
+    util = import_framework_module("util")
+    with Timer() as timer:
+        if options.p4d:
+            results = run_p4d(util, options.files, options.p4d, options.p4)
+        else:
+            results = run_synthetic(util, options.files)
+
+    base_bytes, base_time = results[0][2], results[0][3]
+    rows = []
+    for profile, num_fields, num_bytes, elapsed in results:
+        rows.append([profile, num_fields, format_bytes(num_bytes),
+                     "%.0f%%" % (100.0 * num_bytes / max(base_bytes, 1)),
+                     "%.1fms" % (elapsed * 1000.0),
+                     "%.0f%%" % (100.0 * elapsed / max(base_time, 1e-9))])
+
+    print("fstat of %d files (%s, %.1fs total)" % (options.files, "p4d" if options.p4d else "synthetic",
+                                                   timer.elapsed))
+    print_table(["profile", "fields", "response", "vs all", "parse", "vs all"], rows)
+
+if __name__ == "__main__":
+    main()
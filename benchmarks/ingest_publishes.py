@@ -0,0 +1,123 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Run publish ingestion (util.PublishIngester) locally, against a synthetic depot and an
+in-memory stand-in for Shotgun, using the framework's default load hooks:
+
+    python -m benchmarks.ingest_publishes --files 10000
+    python -m benchmarks.ingest_publishes --files 10000 --no-prefetch --latency 20 --sg-latency 50
+    python -m benchmarks.ingest_publishes --files 2000 --fail-first-batch
+
+Every change in the depot is ingested.  With --fail-first-batch the first Shotgun batch
+fails, so the first pass stops without advancing the counter and a second pass has to
+ingest everything without creating duplicate publishes.
+"""
+
+import optparse
+
+from .common import import_framework_module, Timer, print_table
+from .util_apis import BenchFramework, _hook_instance
+
+
+class IngestFramework(BenchFramework):
+    """
+    Bench framework that runs the default load hooks and maps Perforce users to users on
+    the stand-in Shotgun site
+    """
+    def __init__(self, p4, util, sg):
+        BenchFramework.__init__(self, p4, util)
+        self.shotgun = sg
+        self._load_publish_hook = _hook_instance(_HookContext(self), "load_publish_data.py")
+        self._load_review_hook = _hook_instance(_HookContext(self), "load_review_data.py")
+
+    def load_publish_data(self, depot_path, user, workspace, revision, p4=None):
+        return self._load_publish_hook.execute(depot_path, user, workspace, revision, p4)
+
+    def load_publish_review_data(self, depot_path, user, workspace, revision, p4=None):
+        return self._load_review_hook.execute(depot_path, user, workspace, revision, p4)
+
+    def get_shotgun_user(self, p4_user):
+        user = self.shotgun.find_one("HumanUser", [["login", "is", p4_user]])
+        if not user:
+            user = self.shotgun.add_entity("HumanUser", login=p4_user)
+        return {"type": "HumanUser", "id": user["id"]}
+
+
+class _HookContext(object):
+    """
+    The subset of the util_apis benchmark context needed to load a hook
+    """
+    def __init__(self, fw):
+        self.fw = fw
+
+def main():
+    parser = optparse.OptionParser(description="Ingest the publishes in a synthetic depot into a stand-in "
+                                               "Shotgun site")
+    parser.add_option("--files", type="int", default=10000, help="Number of files in the depot")
+    parser.add_option("--users", type="int", default=20, help="Number of users submitting changes")
+    parser.add_option("--latency", type="float", default=0.0, help="Perforce latency per round trip in ms")
+    parser.add_option("--sg-latency", type="float", default=0.0, help="Shotgun latency per request in ms")
+    parser.add_option("--changes-per-batch", type="int", default=50, help="Changes ingested together")
+    parser.add_option("--sg-batch-size", type="int", default=100, help="Requests per Shotgun batch")
+    parser.add_option("--no-prefetch", action="store_true",
+                      help="Run the load hooks for every file instead of prefetching the data")
+    parser.add_option("--fail-first-batch", action="store_true",
+                      help="Fail the first Shotgun batch to exercise the retry of a failed pass")
+    parser.add_option("--seed", type="int", default=1, help="Random seed used to generate the depot")
+    options, _ = parser.parse_args()
+
+    import sgtk
+    testing = import_framework_module("testing")
+    util = import_framework_module("util")
+
+    info = testing.generate_synthetic_depot(options.files, options.users, seed=options.seed)
+    p4 = info.connect(options.latency / 1000.0)
+    sg = testing.FakeShotgun(options.sg_latency / 1000.0)
+    project = sg.add_entity("Project", name="Synthetic")
+    fw = IngestFramework(p4, util, sg)
+    sgtk.platform.current_bundle = lambda: fw
+    util.set_metadata_backend(util.IndexedMetadataBackend(util.AttributeMetadataBackend(),
+                                                          util.MetadataIndex(":memory:")))
+
+    ingester = util.PublishIngester(fw, p4, sg, {"type": "Project", "id": project["id"]},
+                                    changes_per_batch=options.changes_per_batch,
+                                    sg_batch_size=options.sg_batch_size, prefetch=not options.no_prefetch)
+    if options.fail_first_batch:
+        sg.batch_error = testing.FakeShotgunError("Simulated failure")
+
+    rows = []
+    while True:
+        p4.reset_stats()
+        sg.round_trips = 0
+        error = ""
+        with Timer() as timer:
+            try:
+                pass_stats = ingester.run_once()
+            except testing.FakeShotgunError, e:
+                pass_stats = None
+                error = str(e)
+        stats = pass_stats or util.IngestStats()
+        rows.append([len(rows) + 1, "%.1fms" % (timer.elapsed * 1000.0), stats.changes, stats.publishes,
+                     stats.skipped, p4.round_trips, sg.round_trips, stats.sg_batches, ingester.get_last_change(),
+                     error])
+        if pass_stats is not None:
+            break
+
+    publishes = len(sg.entities.get("PublishedFile", {}))
+    print("%d files, %d changes, %s" % (options.files, len(info.depot.changes),
+                                        "no prefetch" if options.no_prefetch else "prefetch"))
+    print_table(["pass", "time", "changes", "publishes", "skipped", "p4 round trips", "sg round trips",
+                 "sg batches", "counter", "error"], rows)
+    print("%d PublishedFile entities registered for %d publishes ingested"
+          % (publishes, ingester.stats.publishes))
+
+if __name__ == "__main__":
+    main()
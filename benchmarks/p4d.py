@@ -0,0 +1,127 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+# 
+# CONFIDENTIAL AND PROPRIETARY
+# 
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit 
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your 
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights 
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Local p4d instance used as a stand-in for a production server by the benchmarks.
+This requires the 'p4d' executable to be available on the PATH (or specified
+explicitly).
+"""
+
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+from P4 import P4
+
+class LocalP4d(object):
+    """
+    Start a throw-away p4d server in a temporary directory listening on localhost
+    """
+
+    def __init__(self, p4d_exe="p4d", root=None):
+        """
+        Construction
+
+        :param p4d_exe:     The p4d executable to run
+        :param root:        The server root directory.  A temporary directory is
+                            created (and removed on stop) if this is None
+        """
+        self._p4d_exe = p4d_exe
+        self._own_root = root is None
+        self.root = root or tempfile.mkdtemp(prefix="tk_p4d_bench_")
+        self.port = None
+        self._process = None
+
+    def start(self):
+        """
+        Start the server and wait until it's accepting connections
+        """
+        server_root = os.path.join(self.root, "server")
+        if not os.path.exists(server_root):
+            os.makedirs(server_root)
+
+        self.port = "localhost:%d" % self.__find_free_port()
+        log_path = os.path.join(server_root, "log")
+        self._process = subprocess.Popen([self._p4d_exe, "-r", server_root, "-p", self.port,
+                                          "-L", log_path, "-J", "off"],
+                                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+        # wait for the server to start listening:
+        host, port = self.port.split(":")
+        for _ in range(100):
+            try:
+                socket.create_connection((host, int(port)), 0.1).close()
+                return
+            except socket.error:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError("Timed out waiting for p4d to start on %s" % self.port)
+
+    def stop(self):
+        """
+        Stop the server and remove the temporary root directory
+        """
+        if self._process:
+            self._process.terminate()
+            self._process.wait()
+            self._process = None
+        if self._own_root and os.path.exists(self.root):
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def connect(self, user="bench", client="bench_ws"):
+        """
+        Connect to the server, creating the user's workspace under the server root
+        if needed.  The first user to connect to a new server is a super user.
+
+        :returns:   A connected P4 instance with the workspace set
+        """
+        p4 = P4()
+        p4.exception_level = 1
+        p4.port = self.port
+        p4.user = user
+        p4.connect()
+
+        client_root = os.path.join(self.root, client)
+        if not os.path.exists(client_root):
+            os.makedirs(client_root)
+        client_spec = p4.fetch_client(client)
+        client_spec._root = client_root
+        client_spec._view = ["//depot/... //%s/..." % client]
+        p4.save_client(client_spec)
+        p4.client = client
+        return p4
+
+    def configure(self, p4, name, value):
+        """
+        Set a server configurable, e.g. net.parallel.max
+        """
+        p4.run_configure("set", "%s=%s" % (name, value))
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+        return False
+
+    def __find_free_port(self):
+        """
+        :returns:   A free TCP port on localhost
+        """
+        s = socket.socket()
+        try:
+            s.bind(("localhost", 0))
+            return s.getsockname()[1]
+        finally:
+            s.close()
@@ -0,0 +1,108 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Re-run a util function or one of the default hooks against a transcript of Perforce
+traffic recorded in production (see the p4_transcript_file setting) instead of a server:
+
+    python -m benchmarks.replay_transcript session.jsonl.gz --hook shared/filter_publishes.py \\
+        --input publishes.json
+    python -m benchmarks.replay_transcript session.jsonl.gz --util get_depot_file_details \\
+        --input args.json --latency 20
+
+For a hook, the input file contains the JSON list passed as the first argument to the
+hook's execute method.  For a util function it contains the list of arguments passed
+after the connection.  The time reported is the time spent in the framework - plus any
+latency added - so the effect of a change can be measured against the same session.
+Commands that the transcript couldn't answer are listed as they make the result suspect.
+
+A transcript of a synthetic session can be recorded with 'benchmarks.util_apis --record'.
+"""
+
+import json
+import optparse
+
+from .common import import_framework_module, Timer, print_table
+from .util_apis import BenchFramework, _hook_instance
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog TRANSCRIPT (--hook HOOK | --util FUNCTION) [options]",
+                                   description="Replay a recorded Perforce transcript through a util "
+                                               "function or hook")
+    parser.add_option("--hook", help="Path of the hook to run, relative to the framework's hooks directory")
+    parser.add_option("--util", help="Name of the util function to run")
+    parser.add_option("--input", help="JSON file containing the hook input or util function arguments")
+    parser.add_option("--repeat", type="int", default=1, help="Number of times to run")
+    parser.add_option("--latency", type="float", default=0.0, help="Latency per round trip in ms")
+    parser.add_option("--recorded-latency", action="store_true",
+                      help="Also add the time each command took when it was recorded")
+    parser.add_option("--strict", action="store_true",
+                      help="Fail if a command can't be answered from the transcript")
+    options, args = parser.parse_args()
+    if len(args) != 1 or bool(options.hook) == bool(options.util):
+        parser.error("A transcript and one of --hook or --util must be specified")
+
+    import sgtk
+    testing = import_framework_module("testing")
+    util = import_framework_module("util")
+    connection = import_framework_module("connection")
+
+    transcript = connection.read_transcript(args[0])
+    p4 = testing.ReplayP4(transcript, options.strict, options.latency / 1000.0, options.recorded_latency)
+    p4.exception_level = 1
+    p4.connect()
+    fw = BenchFramework(p4, util)
+    sgtk.platform.current_bundle = lambda: fw
+
+    input_data = []
+    if options.input:
+        with open(options.input) as fh:
+            input_data = json.load(fh)
+
+    if options.hook:
+        hook = _hook_instance(_HookContext(fw), options.hook)
+        run = lambda: hook.execute(input_data)
+    else:
+        function = getattr(util, options.util)
+        run = lambda: function(p4, *input_data)
+
+    rows = []
+    for ri in range(options.repeat):
+        # each run starts from the beginning of the transcript, with the framework's caches
+        # cleared so that every run does the same work:
+        p4.rewind()
+        p4.reset_stats()
+        util.clear_client_path_mappers()
+        util.get_checkout_state_cache().invalidate()
+        util.get_request_coalescer().invalidate()
+        util.set_metadata_backend(util.IndexedMetadataBackend(util.AttributeMetadataBackend(),
+                                                              util.MetadataIndex(":memory:")))
+        with Timer() as timer:
+            run()
+        commands = ", ".join("%s:%d" % (c, n) for c, n in sorted(p4.command_counts.items()))
+        rows.append([ri + 1, "%.1fms" % (timer.elapsed * 1000.0), p4.round_trips, len(p4.unmatched),
+                     commands])
+
+    print("%s: %d sessions, %d commands recorded" % (args[0], len(transcript[0]), len(transcript[1])))
+    print_table(["run", "time", "round trips", "unmatched", "commands"], rows)
+    for cmd in p4.unmatched:
+        print("unmatched: p4 %s" % " ".join(cmd)[:200])
+
+
+class _HookContext(object):
+    """
+    The subset of the util_apis benchmark context needed to load a hook
+    """
+    def __init__(self, fw):
+        self.fw = fw
+
+if __name__ == "__main__":
+    main()
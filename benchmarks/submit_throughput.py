@@ -0,0 +1,106 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+# 
+# CONFIDENTIAL AND PROPRIETARY
+# 
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit 
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your 
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights 
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Measure submit throughput against a local p4d at different parallel thread counts:
+
+    python -m benchmarks.submit_throughput --files 40 --size-mb 8 --threads 0,2,4,8
+
+Each run re-opens and rewrites every file so that the same amount of data is
+transferred for each thread count.
+"""
+
+import optparse
+import os
+
+from .common import import_framework_module, Timer, format_bytes, print_table
+from .p4d import LocalP4d
+
+def _write_files(root, num_files, file_size, seed):
+    """
+    Write num_files files of file_size bytes under root and return their paths
+    """
+    paths = []
+    block = os.urandom(min(file_size, 1024 * 1024))
+    for fi in range(num_files):
+        path = os.path.join(root, "layers", "layer_%04d.tif" % fi)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if os.path.exists(path):
+            os.chmod(path, 0o666)
+        with open(path, "wb") as f:
+            # make every file unique for this run so the server can't shortcut the transfer:
+            f.write(("%d-%d" % (seed, fi)).encode("ascii"))
+            remaining = file_size
+            while remaining > 0:
+                f.write(block[:remaining])
+                remaining -= len(block)
+        paths.append(path)
+    return paths
+
+def run(num_files, file_size, thread_counts, p4d_exe="p4d"):
+    """
+    Run the benchmark and return a list of (threads, seconds, bytes/second) tuples
+    """
+    util = import_framework_module("util")
+
+    results = []
+    with LocalP4d(p4d_exe) as server:
+        p4 = server.connect()
+        server.configure(p4, "net.parallel.max", max(thread_counts + [1]))
+        client_root = p4.fetch_client(p4.client)._root
+
+        # initial add so that every timed run is an edit of existing files:
+        paths = _write_files(client_root, num_files, file_size, 0)
+        p4.run_add(paths)
+        util.submit_change(p4, _default_to_numbered(util, p4, paths))
+
+        for run_index, threads in enumerate(thread_counts):
+            p4.run_edit(paths)
+            _write_files(client_root, num_files, file_size, run_index + 1)
+            change = _default_to_numbered(util, p4, paths)
+
+            with Timer() as timer:
+                util.submit_change(p4, change, parallel_threads=threads)
+            total = num_files * file_size
+            results.append((threads, timer.elapsed, total / max(timer.elapsed, 1e-6)))
+        p4.disconnect()
+    return results
+
+def _default_to_numbered(util, p4, paths):
+    """
+    Move the opened files into a new numbered change
+    """
+    builder = util.ChangeBuilder(p4, "submit benchmark")
+    for path in paths:
+        builder.add(path)
+    return builder.commit()
+
+def main():
+    parser = optparse.OptionParser(usage=__doc__)
+    parser.add_option("--files", type="int", default=40, help="number of files to submit")
+    parser.add_option("--size-mb", type="float", default=4.0, help="size of each file in MB")
+    parser.add_option("--threads", default="0,2,4,8", help="comma separated list of thread counts")
+    parser.add_option("--p4d", default="p4d", help="p4d executable to use")
+    options, _ = parser.parse_args()
+
+    thread_counts = [int(t) for t in options.threads.split(",")]
+    file_size = int(options.size_mb * 1024 * 1024)
+    results = run(options.files, file_size, thread_counts, options.p4d)
+
+    util = import_framework_module("util")
+    print("%d files, %s each (auto-tune would choose %d threads)\n" 
+          % (options.files, format_bytes(file_size),
+             util.get_parallel_submit_threads(options.files, options.files * file_size)))
+    print_table(["threads", "seconds", "throughput"],
+                [(t, "%.2f" % s, "%s/s" % format_bytes(bps)) for t, s, bps in results])
+
+if __name__ == "__main__":
+    main()
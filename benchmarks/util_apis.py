@@ -0,0 +1,367 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Measure the wall time, server round trips and peak memory of the public util functions
+and the default hooks against a synthetic depot served by the in-process fake server
+(see the framework's testing module):
+
+    python -m benchmarks.util_apis --files 100000 --sample 1000 --latency 2
+    python -m benchmarks.util_apis --files 10000 --only filter_publishes,filter_work_files
+
+Each scenario is run in a fresh Python process against a newly generated depot so that
+the peak memory reported is for that scenario alone.  Generating the depot isn't timed.
+Hooks that need a Shotgun connection (the store hooks) aren't included.
+
+With --record DIR, the Perforce traffic of each scenario is also written to a transcript
+in DIR that can be replayed with benchmarks.replay_transcript.  Times of recorded runs
+include writing the transcript.
+"""
+
+import imp
+import inspect
+import json
+import optparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+from .common import FRAMEWORK_ROOT, import_framework_module, Timer, format_bytes, print_table
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+
+class BenchFramework(object):
+    """
+    Stands in for the framework instance that the util functions and hooks look up
+    through sgtk.platform.current_bundle() and load_framework()
+    """
+    def __init__(self, p4, util):
+        self.util = util
+        self.connection = self
+        self.cache_location = tempfile.gettempdir()
+        self.sgtk = self
+        self.roots = {}
+        self._p4 = p4
+
+    def connect(self, *args, **kwargs):
+        return self._p4
+
+    def get_setting(self, name, default=None):
+        return {"server": self._p4.port, "server_aliases": [], "host": ""}.get(name, default)
+
+    def get_shotgun_user(self, p4_user):
+        return None
+
+    def template_from_path(self, path):
+        return True
+
+    def log_debug(self, msg):
+        pass
+
+    log_info = log_warning = log_error = log_debug
+
+
+class Context(object):
+    """
+    Everything a scenario needs - the generated depot, a connection and samples of paths
+    """
+    def __init__(self, info, p4, util, sample):
+        self.info = info
+        self.p4 = p4
+        self.util = util
+        self.fw = BenchFramework(p4, util)
+        self.local_paths = info.local_paths
+        self.depot_paths = info.depot_paths
+
+        step = max(len(info.local_paths) / max(sample, 1), 1)
+        self.sample_local = info.local_paths[::step][:sample]
+        self.sample_depot = info.depot_paths[::step][:sample]
+        # files that can be opened for edit - i.e. aren't opened by anyone else:
+        self.editable_local = [lp for lp, dp in zip(self.sample_local, self.sample_depot)
+                               if dp not in info.depot.opened]
+        changes = sorted(info.depot.changes)
+        self.sample_changes = [str(c) for c in changes[-sample:]]
+
+
+def _hook_instance(ctx, hook_path):
+    """
+    Load one of the framework's default hooks with the bench framework as its parent
+    """
+    import sgtk
+    module = imp.load_source("bench_hook_%s" % os.path.basename(hook_path)[:-3],
+                             os.path.join(FRAMEWORK_ROOT, "hooks", hook_path))
+    hook_cls = [c for _, c in inspect.getmembers(module, inspect.isclass)
+                if issubclass(c, sgtk.Hook) and c is not sgtk.Hook][0]
+    bench_cls = type("Bench%s" % hook_cls.__name__, (hook_cls,),
+                     {"load_framework": lambda self, name: self.parent})
+    return bench_cls(ctx.fw)
+
+def _open_for_edit(ctx, paths):
+    """
+    Open files for edit, ignoring any that can't be opened
+    """
+    for path in paths:
+        try:
+            ctx.util.open_file_for_edit(ctx.p4, path)
+        except Exception:
+            pass
+
+# -----------------------------------------------------------------------------------------
+# scenarios - each is a (setup, run) pair.  Only run is measured
+
+def _submit_change_setup(ctx):
+    _open_for_edit(ctx, ctx.editable_local[:100])
+    change = ctx.util.create_change(ctx.p4, "benchmark")
+    ctx.util.add_to_change(ctx.p4, change, ctx.editable_local[:100])
+    return change
+
+def _shelve_run(ctx, change):
+    ctx.util.shelve_change(ctx.p4, change)
+    ctx.util.submit_shelved_change(ctx.p4, change)
+
+def _change_builder_setup(ctx):
+    _open_for_edit(ctx, ctx.editable_local[:100])
+
+def _change_builder_run(ctx, _):
+    builder = ctx.util.ChangeBuilder(ctx.p4, "benchmark")
+    for path in ctx.editable_local[:100]:
+        builder.add(path)
+    builder.commit()
+
+def _create_submit_run(ctx, _):
+    change = ctx.util.create_change(ctx.p4, "benchmark")
+    ctx.util.add_to_change(ctx.p4, change, ctx.editable_local[:100])
+    ctx.util.submit_change(ctx.p4, change)
+
+def _sync_setup(ctx):
+    return [{"path": {"url": ctx.util.url_from_depot_path(dp)}, "version_number": 1}
+            for dp in ctx.sample_depot[:100]]
+
+def _sync_run(ctx, publishes):
+    for publish in publishes:
+        ctx.util.sync_published_file(ctx.p4, publish, latest=False)
+
+def _test_open_run(ctx, passes, prime=False):
+    if prime:
+        # as the pre-publish hooks do:
+        ctx.util.refresh_checkout_states(ctx.p4, ctx.sample_local[:100], stale_only=True)
+    for _ in range(passes):
+        for path in ctx.sample_local[:100]:
+            try:
+                ctx.util.open_file_for_edit(ctx.p4, path, test_only=True)
+            except Exception:
+                pass
+
+def _concurrent_details_run(ctx, _):
+    # several threads, each with its own connection, querying overlapping halves of the
+    # sample at the same time - the way several apps refreshing at once do:
+    import threading
+    half = len(ctx.sample_depot) / 2
+    path_sets = [ctx.sample_depot[:half], ctx.sample_depot[half / 2:half + half / 2],
+                 ctx.sample_depot[half:], ctx.sample_depot]
+    connections = [ctx.info.connect(ctx.p4.latency, ctx.p4.record_latency) for _ in path_sets]
+    for p4 in connections:
+        p4.max_results = ctx.p4.max_results
+    threads = [threading.Thread(target=ctx.util.get_depot_file_details, args=(p4, paths, "editability"))
+               for p4, paths in zip(connections, path_sets)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # report the commands run by all connections:
+    for p4 in connections:
+        ctx.p4.round_trips += p4.round_trips
+        for command, count in p4.command_counts.iteritems():
+            ctx.p4.command_counts[command] = ctx.p4.command_counts.get(command, 0) + count
+
+def _filter_publishes_setup(ctx):
+    return (_hook_instance(ctx, "shared/filter_publishes.py"),
+            [{"sg_publish": {"path": {"url": ctx.util.url_from_depot_path(dp)}}} for dp in ctx.sample_depot])
+
+def _filter_work_files_setup(ctx):
+    return (_hook_instance(ctx, "tk-multi-workfiles/filter_work_files.py"),
+            [{"work_file": {"path": lp}} for lp in ctx.sample_local])
+
+def _load_data_setup(hook_path):
+    def setup(ctx):
+        return (_hook_instance(ctx, hook_path),
+                [(dp, int(ctx.info.depot.head(dp).rev)) for dp in ctx.sample_depot[:100]])
+    return setup
+
+def _load_data_run(ctx, args):
+    hook, revisions = args
+    for depot_path, rev in revisions:
+        hook.execute(depot_path, None, ctx.p4.client, rev, ctx.p4)
+
+SCENARIOS = [
+    ("get_client_file_details", None, lambda c, _: c.util.get_client_file_details(c.p4, c.local_paths, "workfile")),
+    ("get_depot_file_details", None, lambda c, _: c.util.get_depot_file_details(c.p4, c.depot_paths, "editability")),
+    ("get_depot_file_details (4 threads)", None, _concurrent_details_run),
+    ("client_to_depot_paths", None, lambda c, _: c.util.client_to_depot_paths(c.p4, c.local_paths)),
+    ("depot_to_client_paths", None, lambda c, _: c.util.depot_to_client_paths(c.p4, c.depot_paths)),
+    ("find_changes_containing", None, lambda c, _: c.util.find_changes_containing(c.p4, c.sample_local)),
+    ("get_change_details", None, lambda c, _: c.util.get_change_details(c.p4, c.sample_changes)),
+    ("get_changes", None, lambda c, _: c.util.get_changes(c.p4, c.sample_changes)),
+    ("refresh_checkout_states", None, lambda c, _: c.util.refresh_checkout_states(c.p4, c.sample_local)),
+    ("open_file_for_edit (test x1)", None, lambda c, _: _test_open_run(c, 1)),
+    ("open_file_for_edit (test x3)", None, lambda c, _: _test_open_run(c, 3)),
+    ("open_file_for_edit (test x3 primed)", None, lambda c, _: _test_open_run(c, 3, prime=True)),
+    ("open_file_for_edit", None, lambda c, _: _open_for_edit(c, c.editable_local[:100])),
+    ("sync_published_file", _sync_setup, _sync_run),
+    ("create/add_to/submit_change", _change_builder_setup, _create_submit_run),
+    ("submit_change", _submit_change_setup, lambda c, change: c.util.submit_change(c.p4, change)),
+    ("ChangeBuilder.commit", _change_builder_setup, _change_builder_run),
+    ("shelve/submit_shelved_change", _submit_change_setup, _shelve_run),
+    ("filter_publishes", _filter_publishes_setup, lambda c, a: a[0].execute(a[1])),
+    ("filter_work_files", _filter_work_files_setup, lambda c, a: a[0].execute(a[1])),
+    ("load_publish_data", _load_data_setup("load_publish_data.py"), _load_data_run),
+    ("load_review_data", _load_data_setup("load_review_data.py"), _load_data_run),
+]
+
+def _peak_memory():
+    """
+    :returns:   The peak resident memory of this process in bytes or None if unknown
+    """
+    if not resource:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on OS X and kilobytes elsewhere:
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def _record_transcript(p4, path):
+    """
+    Write every command run through the fake connection to a transcript, the same as a
+    framework connection does when recording is enabled
+
+    :returns:   The TranscriptWriter, to be closed once the scenario has run
+    """
+    connection = import_framework_module("connection")
+    writer = connection.TranscriptWriter(path)
+    run = p4.run
+    def recording_run(command, *args):
+        flat_args = [command] + [str(a) for a in _flatten(args)]
+        with Timer() as timer:
+            try:
+                results = run(command, *args)
+            except Exception:
+                writer.record(p4, flat_args, None, timer.elapsed, True)
+                raise
+        writer.record(p4, flat_args, results, timer.elapsed)
+        return results
+    p4.run = recording_run
+    return writer
+
+def _flatten(args):
+    flat = []
+    for arg in args:
+        flat.extend(_flatten(arg) if isinstance(arg, (list, tuple)) else [arg])
+    return flat
+
+def run_scenario(name, options):
+    """
+    Run a single scenario in this process and print the result as json
+    """
+    import sgtk
+    testing = import_framework_module("testing")
+    util = import_framework_module("util")
+
+    info = testing.generate_synthetic_depot(options.files, options.users, seed=options.seed)
+    p4 = info.connect(options.latency / 1000.0, options.record_latency / 1000.0)
+    p4.max_results = options.max_results
+    ctx = Context(info, p4, util, options.sample)
+
+    # the util functions and hooks find the framework through the current bundle:
+    sgtk.platform.current_bundle = lambda: ctx.fw
+    # index metadata in memory so that every run starts with an empty index rather than
+    # one populated from a different synthetic depot:
+    util.set_metadata_backend(util.IndexedMetadataBackend(util.AttributeMetadataBackend(),
+                                                          util.MetadataIndex(":memory:")))
+
+    _, setup, run = [s for s in SCENARIOS if s[0] == name][0]
+    setup_result = setup(ctx) if setup else None
+    transcript = None
+    if options.record:
+        transcript = _record_transcript(p4, os.path.join(options.record, "%s.jsonl.gz"
+                                                         % re.sub("[^\w.-]+", "_", name)))
+
+    p4.reset_stats()
+    memory_before = _peak_memory()
+    with Timer() as timer:
+        run(ctx, setup_result)
+    memory_after = _peak_memory()
+    if transcript:
+        transcript.close()
+
+    print(json.dumps({"elapsed": timer.elapsed, "round_trips": p4.round_trips,
+                      "commands": p4.command_counts,
+                      "peak_memory": memory_after if memory_after is not None else None,
+                      "memory_growth": (memory_after - memory_before) if memory_after is not None else None}))
+
+def main():
+    parser = optparse.OptionParser(description="Benchmark the util functions & default hooks against a "
+                                               "synthetic depot")
+    parser.add_option("--files", type="int", default=10000, help="Number of files in the depot")
+    parser.add_option("--users", type="int", default=20, help="Number of users submitting changes")
+    parser.add_option("--sample", type="int", default=1000,
+                      help="Number of files/changes used by scenarios that query a subset")
+    parser.add_option("--latency", type="float", default=0.0, help="Latency per round trip in ms")
+    parser.add_option("--record-latency", type="float", default=0.0,
+                      help="Additional latency per record returned in ms")
+    parser.add_option("--seed", type="int", default=1, help="Random seed used to generate the depot")
+    parser.add_option("--max-results", type="int", default=0,
+                      help="MaxResults limit of the server, so that large queries have to be split")
+    parser.add_option("--only", help="Comma separated list of scenarios to run")
+    parser.add_option("--record", metavar="DIR", help="Record a transcript of each scenario in DIR")
+    parser.add_option("--scenario", help=optparse.SUPPRESS_HELP)
+    options, _ = parser.parse_args()
+
+    if options.scenario:
+        run_scenario(options.scenario, options)
+        return
+
+    names = [s[0] for s in SCENARIOS]
+    if options.only:
+        names = [n for n in names if n in options.only.split(",")]
+
+    rows = []
+    for name in names:
+        args = [sys.executable, "-m", "benchmarks.util_apis", "--scenario", name,
+                "--files", str(options.files), "--users", str(options.users),
+                "--sample", str(options.sample), "--latency", str(options.latency),
+                "--record-latency", str(options.record_latency), "--seed", str(options.seed),
+                "--max-results", str(options.max_results)]
+        if options.record:
+            args += ["--record", os.path.abspath(options.record)]
+        try:
+            output = subprocess.check_output(args, cwd=FRAMEWORK_ROOT, stderr=subprocess.STDOUT)
+            result = json.loads(output.strip().splitlines()[-1])
+        except (subprocess.CalledProcessError, ValueError), e:
+            error = getattr(e, "output", "") or str(e)
+            rows.append([name, "failed: %s" % error.strip().splitlines()[-1], "", "", "", ""])
+            continue
+        commands = ", ".join("%s:%d" % (c, n) for c, n in sorted(result["commands"].items()))
+        rows.append([name, "%.1fms" % (result["elapsed"] * 1000.0), result["round_trips"],
+                     format_bytes(result["peak_memory"]) if result["peak_memory"] is not None else "-",
+                     format_bytes(result["memory_growth"]) if result["memory_growth"] is not None else "-",
+                     commands])
+
+    print("%d files, %d users, sample of %d, %.1fms latency per round trip"
+          % (options.files, options.users, options.sample, options.latency))
+    print_table(["scenario", "time", "round trips", "peak memory", "growth", "commands"], rows)
+
+if __name__ == "__main__":
+    main()
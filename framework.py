@@ -16,9 +16,19 @@ import sgtk
 import platform
 import sys
 import os
+import json
+import tempfile
 
 class PerforceFramework(sgtk.platform.Framework):
 
+    # environment variable that can list additional directories to load P4Python from:
+    P4PYTHON_PATH_ENV_VAR = "TK_FRAMEWORK_PERFORCE_P4PYTHON_PATH"
+    # file used to cache the location P4Python was loaded from:
+    P4PYTHON_CACHE_FILE = "p4python_location.json"
+    # environment variable that enables hook profiling.  Set to '1' to time hook executions
+    # or to a directory to also dump a cProfile .pstats file for each execution:
+    PROFILE_HOOKS_ENV_VAR = "TK_FRAMEWORK_PERFORCE_PROFILE_HOOKS"
+
     ##########################################################################################
     # init and destroy
             
@@ -31,20 +41,104 @@ class PerforceFramework(sgtk.platform.Framework):
         # initialize p4python:
         self.__init_p4python()
         
-        # add modules to this instance so the interface is nicer for users
-        # allows fw.util type syntax.
-        self.connection = self.import_module("connection")
-        self.util = self.import_module("util")
-        self.widgets = self.import_module("widgets")
+        # the connection, util & widgets modules are exposed as properties so the interface 
+        # is nicer for users (allows fw.util type syntax) but they're only imported when 
+        # first used so that tools only pay for the modules they actually need.
+        self.__modules = {}
         
         self.__p4_to_sg_user_map = {}
         self.__sg_to_p4_user_map = {}
+
+        # hook profiling is opt-in and the profiler is only created if it's enabled:
+        self.__hook_profiler = self.__create_hook_profiler()
+    
+    def import_module(self, module_name):
+        """
+        Import a module from the framework's python folder.  Overridden so that modules that
+        aren't imported when the python package is loaded can still be imported.
+        """
+        loader = sgtk.platform.Framework.import_module(self, "loader")
+        loader.import_submodule(module_name)
+        return sgtk.platform.Framework.import_module(self, module_name)
+    
+    def __get_module(self, module_name):
+        """
+        Return the specified module, importing it if this is the first time it's used
+        """
+        module = self.__modules.get(module_name)
+        if module is None:
+            self.log_debug("%s: Importing module '%s'" % (self, module_name))
+            module = self.import_module(module_name)
+            self.__modules[module_name] = module
+        return module
+    
+    @property
+    def connection(self):
+        """
+        The connection module, imported on first access
+        """
+        return self.__get_module("connection")
+    
+    @connection.setter
+    def connection(self, module):
+        self.__modules["connection"] = module
+    
+    @property
+    def util(self):
+        """
+        The util module, imported on first access
+        """
+        return self.__get_module("util")
+    
+    @util.setter
+    def util(self, module):
+        self.__modules["util"] = module
+    
+    @property
+    def widgets(self):
+        """
+        The widgets module, imported on first access.  Note that this imports Qt
+        """
+        return self.__get_module("widgets")
+    
+    @widgets.setter
+    def widgets(self, module):
+        self.__modules["widgets"] = module
     
     def destroy_framework(self):
         """
         Destruction
         """
         self.log_debug("%s: Destroying..." % self)
+
+        # report any Perforce command metrics recorded by connections opened by the framework
+        # and close any transcripts being recorded:
+        connection = self.__modules.get("connection")
+        if connection:
+            try:
+                connection.flush_command_metrics(self)
+                connection.close_transcripts()
+            except Exception, e:
+                self.log_warning("%s: Failed to flush Perforce command metrics & transcripts: %s" % (self, e))
+
+        if self.__hook_profiler:
+            self.__hook_profiler.log_summary(self)
+
+    def execute_hook(self, key, **kwargs):
+        """
+        Execute a hook.  Overridden so that hook executions can be timed and profiled
+        """
+        if not self.__hook_profiler:
+            return sgtk.platform.Framework.execute_hook(self, key, **kwargs)
+        return self.__hook_profiler.execute(self, key, kwargs,
+                                            lambda: sgtk.platform.Framework.execute_hook(self, key, **kwargs))
+
+    @property
+    def hook_profiler(self):
+        """
+        The HookProfiler timing hook executions or None if hook profiling isn't enabled
+        """
+        return self.__hook_profiler
     
     # Username handling (via hooks)
     #
@@ -119,10 +213,36 @@ class PerforceFramework(sgtk.platform.Framework):
 
     # private methods
     #    
+    def __create_hook_profiler(self):
+        """
+        Create the hook profiler if hook profiling is enabled, either through the environment
+        or the profile_hooks setting
+        """
+        env_value = os.environ.get(self.PROFILE_HOOKS_ENV_VAR)
+        if not env_value and not self.get_setting("profile_hooks"):
+            return None
+
+        profile_dir = self.get_setting("hook_profile_dir") or None
+        if env_value and env_value != "1":
+            profile_dir = env_value
+        if profile_dir:
+            profile_dir = os.path.expanduser(os.path.expandvars(profile_dir))
+        # the profiler module is imported on its own as importing util here would import
+        # P4 and everything else util uses while the framework is being initialized:
+        hook_profiler = self.import_module("hook_profiler")
+        slow_threshold = self.get_setting("slow_hook_threshold")
+        if slow_threshold is None:
+            slow_threshold = hook_profiler.DEFAULT_SLOW_HOOK_THRESHOLD
+
+        self.log_debug("%s: Profiling hooks (slow threshold %ss, profiles written to %s)"
+                       % (self, slow_threshold, profile_dir or "-"))
+        return hook_profiler.HookProfiler(slow_threshold, profile_dir)
+
     def __init_p4python(self):
         """
         Make sure that p4python is available and if it's not then add it to the path if 
-        we have a version we can use.
+        we have a version we can use.  The directory that P4Python was successfully loaded
+        from is cached on disk so that subsequent sessions can load it directly.
         """
         try:
             from P4 import P4
@@ -141,8 +261,24 @@ class PerforceFramework(sgtk.platform.Framework):
         py_version_str = "%d%d" % (sys.version_info[0], sys.version_info[1])
 
         # platform/os string
-        os_str = {"darwin":"mac", "win32":"win64" if sys.maxsize > 2**32 else "win32", "linux2":"linux"}[sys.platform]
-        
+        if sys.platform.startswith("linux"):
+            os_str = "linux"
+        elif sys.platform == "win32":
+            os_str = "win64" if sys.maxsize > 2**32 else "win32"
+        elif sys.platform == "darwin":
+            os_str = "mac"
+        else:
+            self.log_error("Unable to load P4Python on unsupported platform '%s'!" % sys.platform)
+            return
+
+        # first, try the directory that worked last time - the cache is keyed on everything
+        # that determines which build of P4Python is compatible:
+        cache_key = "%s|%s|%s" % (py_version_str, platform.python_compiler(), os_str)
+        cached_path = self.__load_p4python_cache().get(cache_key)
+        if cached_path and self.__try_load_p4python(cached_path):
+            self.log_debug("P4Python successfully loaded from cached location '%s'!" % cached_path)
+            return
+
         # compiler string - currently windows specific
         compiler_strings = [""]
         preferred_compiler_str = ""
@@ -183,30 +319,30 @@ class PerforceFramework(sgtk.platform.Framework):
                 if v != vc_version:
                     compiler_strings.append("_vc%d" % v)
 
-        # attempt to import P4:
-        loaded_p4 = False
+        # build the list of candidate directories, starting with any specified in the 
+        # environment.  This allows e.g. Linux farm nodes to use a build of P4Python from
+        # a shared location without it having to be installed site-wide:
+        candidate_paths = []
+        env_paths = os.environ.get(PerforceFramework.P4PYTHON_PATH_ENV_VAR)
+        if env_paths:
+            candidate_paths.extend([p for p in env_paths.split(os.pathsep) if p])
+
         preferred_p4_path = ""
         for compiler_str in compiler_strings:
             p4python_dir = "p4python_py%s%s_%s" % (py_version_str, compiler_str, os_str)
             p4_path = os.path.join(self.disk_location, "resources", p4python_dir, "python")
             if compiler_str == preferred_compiler_str:
                 preferred_p4_path = p4_path
+            candidate_paths.append(p4_path)
 
-            # append it to the path:
-            if p4_path not in sys.path: 
-                sys.path.append(p4_path)
-            try:
-                # attempt to import P4
-                from P4 import P4
-            except:
-                # failed to load so lets remove it from the path!
-                if sys.path[-1] == p4_path:
-                    del sys.path[-1]
-            else:
-                loaded_p4 = True
+        # attempt to import P4:
+        loaded_p4_path = None
+        for p4_path in candidate_paths:
+            if p4_path != cached_path and self.__try_load_p4python(p4_path):
+                loaded_p4_path = p4_path
                 break
 
-        if not loaded_p4:
+        if not loaded_p4_path:
             if not os.path.exists(preferred_p4_path):
                 self.log_error("Unable to locate a compatible version of P4Python for Python v%d.%d%s. "
                                "Please contact https://www.autodesk.com/support/contact-support "
@@ -215,6 +351,83 @@ class PerforceFramework(sgtk.platform.Framework):
             else:            
                 self.log_error("Failed to load P4Python!")
         else:
-            self.log_debug("P4Python successfully loaded!")
-            
-  
\ No newline at end of file
+            self.log_debug("P4Python successfully loaded from '%s'!" % loaded_p4_path)
+            self.__save_p4python_cache(cache_key, loaded_p4_path)
+
+    def __try_load_p4python(self, p4_path):
+        """
+        Attempt to import P4Python from the specified directory
+
+        :param p4_path: The directory containing P4.py
+        :returns:       True if P4 was successfully imported, otherwise False
+        """
+        if not os.path.isdir(p4_path):
+            return False
+
+        # append it to the path:
+        added_to_path = False
+        if p4_path not in sys.path: 
+            sys.path.append(p4_path)
+            added_to_path = True
+        try:
+            # attempt to import P4
+            from P4 import P4
+        except:
+            # failed to load so lets remove it from the path!
+            if added_to_path and p4_path in sys.path:
+                sys.path.remove(p4_path)
+            # and make sure a partially imported module doesn't prevent other 
+            # versions from being tried:
+            sys.modules.pop("P4", None)
+            sys.modules.pop("P4API", None)
+            return False
+        return True
+
+    def __get_p4python_cache_path(self):
+        """
+        :returns:   The path of the file used to cache where P4Python was loaded from
+        """
+        cache_folder = getattr(self, "cache_location", None) or tempfile.gettempdir()
+        return os.path.join(cache_folder, PerforceFramework.P4PYTHON_CACHE_FILE)
+
+    def __load_p4python_cache(self):
+        """
+        :returns:   Dictionary of {cache_key:p4python_path} loaded from the cache file
+        """
+        try:
+            fh = open(self.__get_p4python_cache_path(), "rb")
+            try:
+                cache = json.load(fh)
+            finally:
+                fh.close()
+        except (IOError, OSError, ValueError):
+            return {}
+        return cache if isinstance(cache, dict) else {}
+
+    def __save_p4python_cache(self, cache_key, p4_path):
+        """
+        Record the directory P4Python was loaded from in the cache file.  Failing to write
+        the cache is never an error - P4Python will just be searched for again next time.
+        """
+        cache = self.__load_p4python_cache()
+        if cache.get(cache_key) == p4_path:
+            return
+        cache[cache_key] = p4_path
+
+        cache_path = self.__get_p4python_cache_path()
+        try:
+            cache_folder = os.path.dirname(cache_path)
+            if not os.path.exists(cache_folder):
+                os.makedirs(cache_folder)
+            # write to a temp file and rename so that other processes never see a partial file:
+            fd, tmp_path = tempfile.mkstemp(dir=cache_folder)
+            fh = os.fdopen(fd, "wb")
+            try:
+                json.dump(cache, fh)
+            finally:
+                fh.close()
+            if os.path.exists(cache_path):
+                os.remove(cache_path)
+            os.rename(tmp_path, cache_path)
+        except (IOError, OSError), e:
+            self.log_debug("Failed to cache P4Python location: %s" % e)
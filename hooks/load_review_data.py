@@ -70,13 +70,12 @@ class LoadReviewData(sgtk.Hook):
         # make sure we have a Perforce connection:
         p4 = p4 if p4 else p4_fw.connection.connect()
 
-        # get the attribute data from Perforce:        
-        p4_attr_name = "attr-%s" % LoadReviewData.REVIEW_ATTRIB_NAME
-        depot_revision_path = "%s#%d" % (depot_path, revision)
-        file_details = p4_fw.util.get_depot_file_details(p4, depot_revision_path, fields = [p4_attr_name])
+        # get the attribute data from the metadata backend - this only reaches Perforce
+        # if the data for the revision isn't already in the local index:
+        metadata_backend = p4_fw.util.get_metadata_backend()
+        sg_metadata_str = metadata_backend.load(p4, depot_path, revision, LoadReviewData.REVIEW_ATTRIB_NAME)
         
-        # find data and load yaml data:
-        sg_metadata_str = file_details[depot_revision_path].get(p4_attr_name)        
+        # load yaml data:
         sg_metadata = {}
         if sg_metadata_str:
             sg_metadata = yaml.load(sg_metadata_str)
@@ -73,7 +73,7 @@ class FilterPublishes(Hook):
             publish_path_pairs.append((publish, depot_path))
             
         # find local paths for these depot paths (using the current client spec)
-        p4_file_details = p4_fw.util.get_depot_file_details(p4, list(depot_paths))        
+        p4_file_details = p4_fw.util.get_depot_file_details(p4, list(depot_paths), fields="editability")        
         
         # filter out any publishes that aren't mapped to the client or
         # that don't exist within the current project data root(s):
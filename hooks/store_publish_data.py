@@ -79,13 +79,16 @@ class StorePublishData(sgtk.Hook):
         # format as yaml data:
         sg_metadata_str = yaml.dump(sg_metadata)
         
-        # set the 'shotgun_metadata' attribute on the file in Perforce:
+        # set the 'shotgun_metadata' attribute on the file in Perforce through the
+        # metadata backend (which also records it in the local index):
+        metadata_backend = p4_fw.util.get_metadata_backend()
         try:
-            # use '-p' to create a propogating attribute that will propogate with the file 
-            # when the file is opened for add, edit or delete.  This will ensure subsequent
+            # use a propogating attribute that will propogate with the file when the
+            # file is opened for add, edit or delete.  This will ensure subsequent
             # changes to the file retain this information unless it's modified by a future
             # publish
-            p4.run_attribute("-p", "-n", StorePublishData.PUBLISH_ATTRIB_NAME, "-v", sg_metadata_str, local_path)
+            metadata_backend.store(p4, local_path, StorePublishData.PUBLISH_ATTRIB_NAME, sg_metadata_str,
+                                   propagate=True)
         except P4Exception, e:
             raise TankError("Failed to store publish data in Perforce attribute for file '%s'" % local_path)
 
@@ -96,7 +99,7 @@ class StorePublishData(sgtk.Hook):
         # 2. Publish _without_ review
         # 3. Commit to Perforce
         try:
-            p4.run_attribute("-n", StorePublishData.REVIEW_ATTRIB_NAME, local_path)
+            metadata_backend.store(p4, local_path, StorePublishData.REVIEW_ATTRIB_NAME, None)
         except P4Exception, e:
             raise TankError("Failed to clear review data in Perforce attribute for file '%s'" % local_path)
 
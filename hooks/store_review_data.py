@@ -99,7 +99,8 @@ class StoreReviewData(sgtk.Hook):
 
         # update attribute for publish path:
         try:                
-            p4.run_attribute("-n", StoreReviewData.REVIEW_ATTRIB_NAME, "-v", sg_metadata_str, local_path)
+            p4_fw.util.get_metadata_backend().store(p4, local_path, StoreReviewData.REVIEW_ATTRIB_NAME,
+                                                    sg_metadata_str)
         except P4Exception, e:
             raise TankError("Failed to store review data in Perforce attribute for file '%s'" % local_path)
         
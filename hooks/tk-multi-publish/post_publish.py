@@ -52,13 +52,18 @@ class PostPublishHook(Hook):
         #
         # change = primary_task["item"].get("other_params", {}).get("p4_change")
         
-        # The default implementation doesn't need to do anything here!
-        return
-
-
-
-
-
-
+        # if the secondary publish hook started submitting or shelving the change then 
+        # wait for it to finish, reporting progress as we go:
+        submit_handle = primary_task["item"].get("other_params", {}).get("p4_submit_handle")
+        if not submit_handle:
+            return
         
+        progress_cb(0, "%s change %s" % ("Shelving" if submit_handle.shelve else "Submitting", 
+                                         submit_handle.change))
+        while not submit_handle.wait(0.1):
+            percent, msg = submit_handle.progress
+            progress_cb(percent, msg)
         
+        # this will raise a TankError if the submit failed:
+        submit_handle.result()
+        progress_cb(100)
@@ -78,6 +78,21 @@ class PrimaryPrePublishHook(Hook):
         else:
             raise TankError("Unable to perform pre-publish for unhandled engine %s" % engine_name)            
             
+    def _validate_p4_checkout(self, paths):
+        """
+        Check that the files can be checked-out/added in Perforce.  The cached checkout
+        states of the files are primed with a single query for any that aren't already
+        known, so the checks themselves don't need to query the server.
+        
+        :param paths:   List of local file paths to check
+        :raises:        TankError if any of the files can't be checked-out/added
+        """
+        p4_fw = self.load_framework(TK_FRAMEWORK_PERFORCE_NAME)
+        p4 = p4_fw.connection.connect()
+        p4_fw.util.refresh_checkout_states(p4, paths, stale_only=True)
+        for path in paths:
+            p4_fw.util.open_file_for_edit(p4, path, test_only=True)
+            
     def _do_3dsmax_pre_publish(self, task, work_template, progress_cb):
         """
         Do 3ds Max primary pre-publish/scene validation
@@ -103,9 +118,7 @@ class PrimaryPrePublishHook(Hook):
             raise TankError("File '%s' is not a valid work path, unable to publish!" % scene_file)
         
         # Do any additional validation of the scene/primary task:
-        p4_fw = self.load_framework(TK_FRAMEWORK_PERFORCE_NAME)
-        p4 = p4_fw.connection.connect()
-        p4_fw.util.open_file_for_edit(p4, scene_file, test_only=True)            
+        self._validate_p4_checkout([scene_file])
         
         progress_cb(100)
           
@@ -136,9 +149,7 @@ class PrimaryPrePublishHook(Hook):
             raise TankError("File '%s' is not a valid work path, unable to publish!" % scene_file)
         
         # Do any additional validation of the scene/primary task:
-        p4_fw = self.load_framework(TK_FRAMEWORK_PERFORCE_NAME)
-        p4 = p4_fw.connection.connect()
-        p4_fw.util.open_file_for_edit(p4, scene_file, test_only=True)            
+        self._validate_p4_checkout([scene_file])
         
         progress_cb(100)
           
@@ -170,9 +181,7 @@ class PrimaryPrePublishHook(Hook):
             raise TankError("File '%s' is not a valid work path, unable to publish!" % scene_file)
         
         # Do any additional validation of the scene/primary task:
-        p4_fw = self.load_framework(TK_FRAMEWORK_PERFORCE_NAME)
-        p4 = p4_fw.connection.connect()
-        p4_fw.util.open_file_for_edit(p4, scene_file, test_only=True)
+        self._validate_p4_checkout([scene_file])
         
         progress_cb(100)
           
@@ -205,9 +214,7 @@ class PrimaryPrePublishHook(Hook):
             raise TankError("File '%s' is not a valid work path, unable to publish!" % scene_file)
         
         # Do any additional validation of the scene/primary task:
-        p4_fw = self.load_framework(TK_FRAMEWORK_PERFORCE_NAME)
-        p4 = p4_fw.connection.connect()
-        p4_fw.util.open_file_for_edit(p4, scene_file, test_only=True)
+        self._validate_p4_checkout([scene_file])
         
         progress_cb(100)
           
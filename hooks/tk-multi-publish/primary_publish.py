@@ -130,7 +130,7 @@ class PublisherBase(object):
         
         # Ensure the file is checked out/added to depot:
         progress_cb(10.0, "Ensuring file is checked out...")
-        self.p4_fw.util.open_file_for_edit(p4, scene_path)        
+        depot_path = self.p4_fw.util.open_file_for_edit(p4, scene_path)
         
         # save the scene using the save_scene_fn passed in:
         progress_cb(30.0, "Saving the scene")
@@ -138,17 +138,18 @@ class PublisherBase(object):
         self._save()
 
         # now, because this is the primary publish, we can create a new
-        # changelist for all files being published:
+        # changelist for all files being published.  The scene file is
+        # included when the change is created:
         progress_cb(50.0, "Creating new Perforce changelist...")
-        new_change = self.p4_fw.util.create_change(p4, comment or "Shotgun publish")
+        change_builder = self.p4_fw.util.ChangeBuilder(p4, comment or "Shotgun publish")
+        change_builder.add(scene_path, depot_path)
+        new_change = change_builder.commit()
         
-        # store the change on the primary item 'other_params' so that it can be
-        # found by the following secondary publish hook:
-        task["item"].setdefault("other_params", dict())["p4_change"] = new_change
-        
-        # and add the file to this change:
-        progress_cb(60.0, "Adding scene file to change...")
-        self.p4_fw.util.add_to_change(p4, new_change, scene_path)
+        # store the change and the builder on the primary item 'other_params' so 
+        # that they can be found by the following secondary publish hook:
+        other_params = task["item"].setdefault("other_params", dict())
+        other_params["p4_change"] = new_change
+        other_params["p4_change_builder"] = change_builder
 
         # next, we want to save the publish metadata so that the sync daemon
         # can pick it up and add to the publish record:
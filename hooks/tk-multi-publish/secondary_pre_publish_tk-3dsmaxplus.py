@@ -83,7 +83,7 @@ class PrePublishHook(Hook):
             progress_cb(0, "Validating", task)
         
             # pre-publish item here, e.g.
-            if output["name"] == "p4_submit":
+            if output["name"] in ("p4_submit", "p4_shelve"):
                 # this is always valid!
                 pass
             else:
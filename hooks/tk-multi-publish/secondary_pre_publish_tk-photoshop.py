@@ -82,6 +82,24 @@ class PrePublishHook(Hook):
         p4_fw = self.load_framework(TK_FRAMEWORK_PERFORCE_NAME)
         p4 = p4_fw.connection.connect()
         
+        # prime the checkout states of all the layer export paths with a single query so
+        # that validating each layer doesn't need to query the server:
+        export_paths = []
+        for task in tasks:
+            if task["output"]["name"] == "export_layers":
+                try:
+                    export_paths.append(self.__get_export_path(doc, task["item"]["name"], work_template, 
+                                                               task["output"]["publish_template"]))
+                except TankError:
+                    # reported when the layer is validated
+                    pass
+        if export_paths:
+            try:
+                p4_fw.util.refresh_checkout_states(p4, export_paths, stale_only=True)
+            except TankError:
+                # each layer will query the server & report any errors when it's validated
+                pass
+        
         # validate tasks:
         for task in tasks:
             item = task["item"]
@@ -92,7 +110,7 @@ class PrePublishHook(Hook):
             progress_cb(0, "Validating", task)
 
             # pre-publish item here, e.g.
-            if output["name"] == "p4_submit":
+            if output["name"] in ("p4_submit", "p4_shelve"):
                 # this is always valid!
                 pass
             elif output["name"] == "export_layers":
@@ -122,7 +140,6 @@ class PrePublishHook(Hook):
         """
         errors = []
         
-        scene_file = doc.fullName.nativePath        
         layer = doc.artLayers.getByName(layer_name)
         
         # check layer actually exists!
@@ -130,15 +147,9 @@ class PrePublishHook(Hook):
             errors.append("Layer '%s' could not be found!" % layer_name)    
         
         # work out the export path for the layer:
-        layer_short_name = {"diffuse":"c", "normal":"n", "specular":"s"}.get(layer_name)
         export_path = None        
         try:
-            fields = work_template.get_fields(scene_file)
-            fields = dict(chain(fields.items(), self.parent.context.as_template_fields(publish_template).items()))
-            fields["TankType"] = "%s Texture" % layer_name.capitalize()
-            fields["layer_short_name"] = layer_short_name
-        
-            export_path = publish_template.apply_fields(fields).encode("utf8")
+            export_path = self.__get_export_path(doc, layer_name, work_template, publish_template)
         except TankError, e:
             errors.append("Failed to construct export path for layer '%s': %s" % (layer_name, e))
         
@@ -151,6 +162,20 @@ class PrePublishHook(Hook):
                
         return errors
         
+    def __get_export_path(self, doc, layer_name, work_template, publish_template):
+        """
+        Work out the path the specified layer will be exported to
+        """
+        scene_file = doc.fullName.nativePath
+        layer_short_name = {"diffuse":"c", "normal":"n", "specular":"s"}.get(layer_name)
+        
+        fields = work_template.get_fields(scene_file)
+        fields = dict(chain(fields.items(), self.parent.context.as_template_fields(publish_template).items()))
+        fields["TankType"] = "%s Texture" % layer_name.capitalize()
+        fields["layer_short_name"] = layer_short_name
+        
+        return publish_template.apply_fields(fields).encode("utf8")
+        
         
 
     
@@ -99,6 +99,11 @@ class PublishHook(Hook):
         # find the changelist containing the primary publish file that was 
         # created during the primary publish phase.
         primary_change = primary_task["item"].get("other_params", {}).get("p4_change")
+        if not primary_change:
+            # fall back to looking up the change the primary publish file is open in:
+            change = p4_fw.util.find_changes_containing(p4, [primary_publish_path]).get(primary_publish_path)
+            primary_change = change.change if change and change.change != "default" else None
+        change_builder = primary_task["item"].get("other_params", {}).get("p4_change_builder")
         
         results = []
         
@@ -108,13 +113,13 @@ class PublishHook(Hook):
         secondary_publish_files = []
         p4_submit_task = None
         
-        # publish all tasks except the "p4_submit" task:
+        # publish all tasks except the "p4_submit"/"p4_shelve" task:
         for task in tasks:
             item = task["item"]
             output = task["output"]
             errors = []
         
-            if output["name"] == "p4_submit":
+            if output["name"] in ("p4_submit", "p4_shelve"):
                 # we'll handle this later:
                 p4_submit_task = task
                 continue
@@ -126,9 +131,10 @@ class PublishHook(Hook):
             #if output["name"] == "...":
             #    # do the actual publish...
             #    ...
-            #    # add secondary publish file to the change:        
-            #    if primary_change != None:
-            #        p4_fw.util.add_to_change(p4, primary_change, secondary_publish_path)
+            #    # add secondary publish file to the change - all files are moved 
+            #    # into the change together once everything has been published:
+            #    if change_builder:
+            #        change_builder.add(secondary_publish_path)
             #
             #    # store additional metadata for the publish:
             #    publish_data = {"thumbnail_path":thumbnail_path,
@@ -153,6 +159,10 @@ class PublishHook(Hook):
              
             progress_cb(100)
             
+        # add all published files to the change in one go:
+        if change_builder and change_builder.pending_files:
+            change_builder.commit()
+            
         # now, if we need to, lets commit the change to perforce:
         if p4_submit_task:
             errors = []
@@ -162,8 +172,18 @@ class PublishHook(Hook):
             if primary_change is None:
                 errors.append("Failed to find the Perforce change containing the file '%s'" % primary_publish_path)
             else:
-                progress_cb(10, "Submitting change '%s'" % primary_change)
-                p4_fw.util.submit_change(p4, primary_change)
+                # submit/shelve on a worker thread so that the application isn't blocked 
+                # whilst the files are uploaded.  The post-publish hook waits for this to
+                # finish and reports any errors:
+                if p4_submit_task["output"]["name"] == "p4_shelve":
+                    # shelve the change rather than submitting it - a separate process can 
+                    # then submit the shelved change without transferring the files again:
+                    progress_cb(10, "Shelving change '%s'" % primary_change)
+                    submit_handle = p4_fw.util.shelve_change_async(p4, primary_change)
+                else:
+                    progress_cb(10, "Submitting change '%s'" % primary_change)
+                    submit_handle = p4_fw.util.submit_change_async(p4, primary_change)
+                primary_task["item"].setdefault("other_params", dict())["p4_submit_handle"] = submit_handle
                 
             # if there is anything to report then add to result
             if len(errors) > 0:
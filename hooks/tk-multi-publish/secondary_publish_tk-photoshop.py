@@ -104,9 +104,19 @@ class PublishHook(Hook):
         # find the changelist containing the primary publish file that was 
         # created during the primary publish phase.
         primary_change = primary_task["item"].get("other_params", {}).get("p4_change")
+        if not primary_change:
+            # fall back to looking up the change the primary publish file is open in:
+            change = p4_fw.util.find_changes_containing(p4, [primary_publish_path]).get(primary_publish_path)
+            primary_change = change.change if change and change.change != "default" else None
         if not primary_change:
             raise TankError("Failed to find the Perforce change in the secondary publish hook!")
         
+        # all secondary publish files are collected in the change builder and moved
+        # into the change together once everything has been published:
+        change_builder = primary_task["item"].get("other_params", {}).get("p4_change_builder")
+        if not change_builder:
+            change_builder = p4_fw.util.ChangeBuilder(p4, comment, primary_change)
+        
         results = []
         
         # we want to keep track of all files being published
@@ -115,13 +125,13 @@ class PublishHook(Hook):
         secondary_publish_files = []
         p4_submit_task = None
         
-        # publish all tasks except the "p4_submit" task:
+        # publish all tasks except the "p4_submit"/"p4_shelve" task:
         for task in tasks:
             item = task["item"]
             output = task["output"]
             errors = []
         
-            if output["name"] == "p4_submit":
+            if output["name"] in ("p4_submit", "p4_shelve"):
                 # we'll handle this later:
                 p4_submit_task = task
                 continue
@@ -139,7 +149,7 @@ class PublishHook(Hook):
                                                             comment,
                                                             p4,
                                                             p4_fw,
-                                                            primary_change,                                                            
+                                                            change_builder,
                                                             progress_cb)
                 if export_errors:
                     errors += export_errors
@@ -159,6 +169,10 @@ class PublishHook(Hook):
              
             progress_cb(100)
             
+        # add all published files to the change in one go:
+        if change_builder.pending_files:
+            change_builder.commit()
+            
         # now, if we need to, lets commit the change to perforce:
         if p4_submit_task:
             errors = []
@@ -168,8 +182,18 @@ class PublishHook(Hook):
             if primary_change is None:
                 errors.append("Failed to find the Perforce change containing the file '%s'" % primary_publish_path)
             else:
-                progress_cb(10, "Submitting change '%s'" % primary_change)
-                p4_fw.util.submit_change(p4, primary_change)
+                # submit/shelve on a worker thread so that the application isn't blocked 
+                # whilst the files are uploaded.  The post-publish hook waits for this to
+                # finish and reports any errors:
+                if p4_submit_task["output"]["name"] == "p4_shelve":
+                    # shelve the change rather than submitting it - a separate process can 
+                    # then submit the shelved change without transferring the files again:
+                    progress_cb(10, "Shelving change '%s'" % primary_change)
+                    submit_handle = p4_fw.util.shelve_change_async(p4, primary_change)
+                else:
+                    progress_cb(10, "Submitting change '%s'" % primary_change)
+                    submit_handle = p4_fw.util.submit_change_async(p4, primary_change)
+                primary_task["item"].setdefault("other_params", dict())["p4_submit_handle"] = submit_handle
                 
             # if there is anything to report then add to result
             if len(errors) > 0:
@@ -182,7 +206,7 @@ class PublishHook(Hook):
 
 
     def __publish_layer_as_tif(self, layer_name, work_template, publish_template, primary_publish_path, 
-                               sg_task, comment, p4, p4_fw, change, progress_cb):
+                               sg_task, comment, p4, p4_fw, change_builder, progress_cb):
         """
         Publish the specified layer
         """
@@ -215,11 +239,12 @@ class PublishHook(Hook):
         self.parent.ensure_folder_exists(export_folder)
 
         file_in_perforce = False
+        depot_path = None
         if os.path.exists(export_path):
             # check out the file if it's already in Perforce:
             progress_cb(15, "Checking out file from Perforce")
             try:
-                p4_fw.util.open_file_for_edit(p4, export_path)
+                depot_path = p4_fw.util.open_file_for_edit(p4, export_path)
             except TankError, e:
                 errors.append("%s" % e)
                 return errors
@@ -303,15 +328,16 @@ class PublishHook(Hook):
             # Note, if it looks like this is taking ages it's probably just because
             # the progress bar hasn't updated between this and storing the publish
             # data, which can take a bit of time
-            progress_cb(80, "Adding to Perforce change %s" % change)
+            progress_cb(80, "Adding to Perforce change %s" % change_builder.change)
             if not file_in_perforce:
                 try:
-                    p4_fw.util.open_file_for_edit(p4, export_path)
+                    depot_path = p4_fw.util.open_file_for_edit(p4, export_path)
                 except TankError, e:
                     errors.append("%s" % e)
                     return errors
     
-            p4_fw.util.add_to_change(p4, change, export_path)
+            # the file is moved into the change once all layers have been published:
+            change_builder.add(export_path, depot_path)
         
             # store additional metadata for the publish:
             progress_cb(85, "Storing publish data")
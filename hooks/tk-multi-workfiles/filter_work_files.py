@@ -81,7 +81,7 @@ class FilterWorkFiles(Hook):
             file_path_pairs.append((entry, local_path))
            
         # find perforce details for these files: 
-        p4_file_details = p4_fw.util.get_client_file_details(p4, list(local_paths))
+        p4_file_details = p4_fw.util.get_client_file_details(p4, list(local_paths), fields="workfile")
         
         # find the details about the specific revision of each file returned - this is
         # so that we have the modified by information.
@@ -98,7 +98,7 @@ class FilterWorkFiles(Hook):
             path_revision_to_path["%s#%s" % (path, have_rev)] = path
 
         if path_revision_to_path:
-            p4_file_revision_details = p4_fw.util.get_client_file_details(p4, path_revision_to_path.keys())
+            p4_file_revision_details = p4_fw.util.get_client_file_details(p4, path_revision_to_path.keys(), fields="workfile")
             
             # update any file details to use the revision specific details:
             for path_revision, details in p4_file_revision_details.iteritems():
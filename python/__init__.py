@@ -8,6 +8,7 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights 
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
-from . import connection
-from . import util
-from . import widgets
\ No newline at end of file
+# modules are imported on demand through the loader rather than here so that loading
+# the framework stays cheap - e.g. widgets requires Qt which headless processes don't
+# need.  See PerforceFramework.import_module()
+from . import loader
\ No newline at end of file
@@ -8,4 +8,10 @@
 # agreement to the Shotgun Pipeline Toolkit Source Code License. All rights 
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
-from .connection import connect, connect_with_dialog
\ No newline at end of file
+from .connection import connect, connect_headless, connect_with_dialog
+from .pool import ConnectionPool, get_connection_pool, clone_connection
+from .workspace_resolver import WorkspaceResolver
+from .capabilities import ServerCapabilities, get_server_capabilities, clear_server_capabilities
+from .instrumentation import (InstrumentedP4, CommandRecorder, get_command_recorder, get_command_stats,
+                              flush_command_metrics, is_instrumentation_enabled)
+from .transcript import TranscriptWriter, read_transcript, get_transcript_writer, close_transcripts
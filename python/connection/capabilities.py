@@ -0,0 +1,250 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Detection of the features supported by a Perforce server
+"""
+
+import os
+import re
+import tempfile
+import threading
+import time
+
+from P4 import P4Exception
+
+import sgtk
+
+from .json_cache import load_json_file, save_json_file
+
+
+class ServerCapabilities(object):
+    """
+    The features supported by a Perforce server, determined from the result of 'p4 info'.
+    If the server version can't be determined then no optional features are reported as
+    supported so callers always fall back to the command forms that work everywhere.
+    """
+
+    # features and the minimum server version (year, release) they are supported by:
+    PARALLEL_SYNC = "parallel_sync"
+    PARALLEL_SUBMIT = "parallel_submit"
+    PARALLEL_SHELVE = "parallel_shelve"
+    FSTAT_FILTER = "fstat_filter"
+    FSTAT_ALL_REVISIONS = "fstat_all_revisions"
+    FSTAT_HEX_ATTRIBUTES = "fstat_hex_attributes"
+    FSTAT_ATTRIBUTE_PATTERN = "fstat_attribute_pattern"
+    DESCRIBE_SHORT = "describe_short"
+    ATTRIBUTE_STDIN = "attribute_stdin"
+    CLIENTS_CASE_INSENSITIVE_FILTER = "clients_case_insensitive_filter"
+    SHELVE = "shelve"
+    SUBMIT_SHELVED = "submit_shelved"
+
+    _MIN_VERSIONS = {
+        PARALLEL_SYNC: (2014, 1),
+        PARALLEL_SUBMIT: (2015, 1),
+        PARALLEL_SHELVE: (2017, 1),
+        FSTAT_FILTER: (2005, 1),
+        FSTAT_ALL_REVISIONS: (2008, 2),
+        FSTAT_HEX_ATTRIBUTES: (2011, 1),
+        FSTAT_ATTRIBUTE_PATTERN: (2011, 1),
+        DESCRIBE_SHORT: (2001, 1),
+        ATTRIBUTE_STDIN: (2011, 1),
+        CLIENTS_CASE_INSENSITIVE_FILTER: (2008, 2),
+        SHELVE: (2009, 2),
+        SUBMIT_SHELVED: (2013, 1),
+    }
+
+    _VERSION_REGEX = re.compile(r"/(?P<year>[0-9]{4})\.(?P<release>[0-9]+)")
+
+    def __init__(self, info, timestamp=None):
+        """
+        Construction
+
+        :param info:        The dictionary returned by 'p4 info' (or loaded from the cache)
+        :param timestamp:   The time the info was retrieved from the server
+        """
+        self._info = dict(info or {})
+        self._timestamp = timestamp if timestamp is not None else time.time()
+
+        self._version = None
+        mo = ServerCapabilities._VERSION_REGEX.search(self._info.get("serverVersion", ""))
+        if mo:
+            self._version = (int(mo.group("year")), int(mo.group("release")))
+
+    @property
+    def info(self):
+        """
+        :returns:   The 'p4 info' fields the capabilities were determined from
+        """
+        return self._info
+
+    @property
+    def timestamp(self):
+        """
+        :returns:   The time the info was retrieved from the server
+        """
+        return self._timestamp
+
+    @property
+    def server_version(self):
+        """
+        :returns:   The server version as a tuple of (year, release), e.g. (2015, 1) or None
+                    if the version is unknown
+        """
+        return self._version
+
+    @property
+    def server_version_string(self):
+        """
+        :returns:   The full server version string, e.g. "P4D/LINUX26X86_64/2015.1/1028542 (2015/03/20)"
+        """
+        return self._info.get("serverVersion", "")
+
+    @property
+    def server_id(self):
+        """
+        :returns:   The server id if one has been set, otherwise an empty string
+        """
+        return self._info.get("serverID", "")
+
+    @property
+    def case_sensitive(self):
+        """
+        :returns:   True if the server treats file paths as case sensitive
+        """
+        return self._info.get("caseHandling", "sensitive") != "insensitive"
+
+    @property
+    def unicode(self):
+        """
+        :returns:   True if the server is running in unicode mode
+        """
+        return self._info.get("unicode", "") == "enabled"
+
+    def supports(self, feature):
+        """
+        :param feature: One of the feature constants defined on this class
+        :returns:       True if the server is known to support the feature
+        """
+        min_version = ServerCapabilities._MIN_VERSIONS.get(feature)
+        if not min_version or not self._version:
+            return False
+        return self._version >= min_version
+
+    def to_dict(self):
+        """
+        :returns:   A JSON-serializable dictionary that can be passed to from_dict()
+        """
+        return {"info": self._info, "timestamp": self._timestamp}
+
+    @staticmethod
+    def from_dict(data):
+        """
+        :param data:    A dictionary previously returned by to_dict()
+        :returns:       A new ServerCapabilities instance
+        """
+        return ServerCapabilities(data.get("info", {}), data.get("timestamp", 0))
+
+    def __repr__(self):
+        return "<ServerCapabilities %s>" % (self.server_version_string or "unknown")
+
+
+# the 'p4 info' fields that are cached - everything else is specific to the client/user:
+_CACHED_INFO_FIELDS = ["serverVersion", "serverAddress", "serverID", "serverServices",
+                       "caseHandling", "unicode", "serverLicense"]
+
+CAPABILITIES_CACHE_FILE = "server_capabilities.json"
+DEFAULT_CAPABILITIES_TTL = 24 * 60 * 60
+
+_g_capabilities = {}
+_g_capabilities_lock = threading.Lock()
+
+def get_server_capabilities(p4, ttl=DEFAULT_CAPABILITIES_TTL, refresh=False):
+    """
+    Get the capabilities of the server the connection is connected to.  These are only queried
+    using 'p4 info' once per server - the result is cached in memory and on disk for the
+    specified time.
+
+    :param p4:      An open Perforce connection
+    :param ttl:     The time in seconds after which the cached capabilities are re-queried
+    :param refresh: If True then the capabilities are always queried from the server
+    :returns:       A ServerCapabilities instance.  If the server can't be queried then the
+                    instance reports no optional features as supported
+    """
+    server = p4.port
+    now = time.time()
+
+    _g_capabilities_lock.acquire()
+    try:
+        capabilities = _g_capabilities.get(server)
+        if not refresh and capabilities and now - capabilities.timestamp <= ttl:
+            return capabilities
+
+        cache_path = _get_cache_path()
+        if not refresh:
+            cached = load_json_file(cache_path, {}).get(server)
+            if isinstance(cached, dict):
+                capabilities = ServerCapabilities.from_dict(cached)
+                if now - capabilities.timestamp <= ttl:
+                    _g_capabilities[server] = capabilities
+                    return capabilities
+    finally:
+        _g_capabilities_lock.release()
+
+    # query the server - this is done outside the lock so that a slow server
+    # doesn't block queries for other servers:
+    try:
+        p4_res = p4.run_info()
+    except P4Exception:
+        # don't cache anything so that the server is queried again next time:
+        return ServerCapabilities({}, now)
+    info = p4_res[0] if p4_res and isinstance(p4_res[0], dict) else {}
+    capabilities = ServerCapabilities(dict((k, info[k]) for k in _CACHED_INFO_FIELDS if k in info), now)
+
+    _g_capabilities_lock.acquire()
+    try:
+        _g_capabilities[server] = capabilities
+        cache = load_json_file(cache_path, {})
+        if not isinstance(cache, dict):
+            cache = {}
+        cache[server] = capabilities.to_dict()
+        save_json_file(cache_path, cache)
+    finally:
+        _g_capabilities_lock.release()
+
+    return capabilities
+
+def clear_server_capabilities(server=None):
+    """
+    Forget cached capabilities (in memory only), e.g. after a server has been upgraded.
+    The next call to get_server_capabilities() will re-read the disk cache.
+
+    :param server:  The server to forget the capabilities for or None for all servers
+    """
+    _g_capabilities_lock.acquire()
+    try:
+        if server is None:
+            _g_capabilities.clear()
+        else:
+            _g_capabilities.pop(server, None)
+    finally:
+        _g_capabilities_lock.release()
+
+def _get_cache_path():
+    """
+    :returns:   The path of the file used to cache server capabilities on disk
+    """
+    cache_folder = None
+    try:
+        cache_folder = getattr(sgtk.platform.current_bundle(), "cache_location", None)
+    except Exception:
+        # not running within a bundle
+        pass
+    return os.path.join(cache_folder or tempfile.gettempdir(), CAPABILITIES_CACHE_FILE)
@@ -16,14 +16,17 @@ import os
 import socket
 import re
 import threading
+import tempfile
 
 import sgtk
 from sgtk import TankError
-from sgtk.platform.qt import QtGui
 
-from P4 import P4, P4Exception
+from P4 import P4Exception
 
 from .user_settings import UserSettings
+from .capabilities import get_server_capabilities, ServerCapabilities
+from .workspace_resolver import WorkspaceResolver
+from .instrumentation import create_p4
 
 
 class SgtkP4Error(TankError):
@@ -50,6 +53,7 @@ class ConnectionHandler(object):
         """
         self._fw = fw
         self._p4 = None
+        self._workspace_resolver = None
 
     @property
     def connection(self):
@@ -76,15 +80,17 @@ class ConnectionHandler(object):
         server = self._fw.get_setting("server")
         host = self._fw.get_setting("host")
 
-        # create new P4 instance
-        p4 = P4()
+        # create new P4 instance - this records command metrics if instrumentation is enabled:
+        p4 = create_p4()
 
         # set exception level so we only get exceptions for
         # errors, not warnings
         p4.exception_level = 1
 
-        # load the server configuration:
-        p4.port = str(server)
+        # load the server configuration.  If no server is configured then the P4PORT set
+        # in the environment or P4CONFIG/P4ENVIRO files is used:
+        if server:
+            p4.port = str(server)
         if host:
             p4.host = str(host)
 
@@ -234,6 +240,7 @@ class ConnectionHandler(object):
                                      should be shown.
         """
         # show the trust dialog:
+        from sgtk.platform.qt import QtGui
         from ..widgets import TrustForm
         res, widget = self._fw.engine.show_modal("Perforce Fingerprint Required", self._fw, TrustForm,
                                                  self._p4.port, fingerprint, fingerprint_changed,
@@ -272,28 +279,44 @@ class ConnectionHandler(object):
         if not self._p4 or not self._p4.connected():
             raise TankError("Unable to retrieve list of workspaces without an open Perforce connection!")
 
-        # get all avaliable workspaces for the current user and this host machine:
-        all_workspaces = []
-        try:
-            all_workspaces = self._p4.run_clients("-u", user)
-        except P4Exception, e:
-            raise SgtkP4Error(self._p4.errors[0] if self._p4.errors else str(e))
+        # workspaces are queried a page at a time on a background thread using a separate
+        # connection so that the dialog opens immediately, even for users with thousands of
+        # workspaces:
+        from .pool import get_connection_pool
+        pool = get_connection_pool()
+        p4 = self._p4
+        def fetch_workspaces(pattern, max_results):
+            args = ["-u", user]
+            if max_results:
+                args += ["-m", str(max_results)]
+            query_p4 = pool.acquire(p4)
+            try:
+                if pattern:
+                    # -E (case-insensitive) isn't supported by older servers:
+                    case_insensitive = get_server_capabilities(query_p4).supports(
+                        ServerCapabilities.CLIENTS_CASE_INSENSITIVE_FILTER)
+                    args += ["-E" if case_insensitive else "-e", pattern]
+                try:
+                    return query_p4.run_clients(*args)
+                except P4Exception, e:
+                    raise SgtkP4Error(query_p4.errors[0] if query_p4.errors else str(e))
+            finally:
+                pool.release(query_p4)
 
         host = socket.gethostname()
         self._fw.log_debug("Current host '%s'" % host)
-        self._fw.log_debug("All workspaces: %s" % all_workspaces)
-        # Get all workspaces that are assigned for this user for this machine or
-        # that are accessible from any machine. Note: Host is always set, but can
-        # be an empty string. In that case, we will consider the host for that workspace
-        # to be the current host.
-        filtered_workspaces = [ws for ws in all_workspaces if (ws.get("Host") or host) == host]
 
-        # show the password entry dialog:
+        # show the workspace selection dialog:
         try:
+            from sgtk.platform.qt import QtGui
             from ..widgets import SelectWorkspaceForm
+            from ..widgets.workspace_model import WorkspaceModel
+            # only list workspaces that are assigned to this user for this machine or that
+            # are accessible from any machine:
+            workspace_model = WorkspaceModel(fetch_workspaces, host)
             res, widget = self._fw.engine.show_modal("Perforce Workspace", self._fw, SelectWorkspaceForm,
                                                      self._p4.port, user,
-                                                     filtered_workspaces, initial_ws, parent_widget)
+                                                     workspace_model, initial_ws, parent_widget)
             if res == QtGui.QDialog.Accepted:
                 return widget.workspace_name
 
@@ -372,8 +395,15 @@ class ConnectionHandler(object):
             except SgtkP4Error, e:
                 raise TankError("Perforce: Failed to login user '%s' - %s" % (user, e))
 
-            # finally, validate the workspace:
-            if workspace:
+            # if we don't know which workspace to use then try to find the best one for this machine
+            # without prompting the user:
+            if not workspace:
+                workspace = self._resolve_workspace(user)
+                if workspace:
+                    self._p4.client = str(workspace)
+                    self._save_current_workspace(workspace)
+            # otherwise, validate the workspace:
+            elif workspace:
                 try:
                     self._validate_workspace(workspace, user)
                     self._p4.client = str(workspace)
@@ -400,6 +430,78 @@ class ConnectionHandler(object):
         finally:
             _g_connection_lock.release()
 
+    def connect_headless(self, user=None, password=None, workspace=None):
+        """
+        Connect to Perforce without any UI, e.g. from a farm or daemon process.  Qt is never
+        imported.  Anything not specified is taken from the environment, including any P4CONFIG
+        and P4ENVIRO files, and existing tickets in P4TICKETS are used to log in.
+
+        :param user:        The Perforce user to connect as.  Defaults to P4USER if it's set or
+                            the user returned by the get-perforce-user hook otherwise
+        :param password:    The password to log in with if the user doesn't have a valid ticket.
+                            Defaults to P4PASSWD
+        :param workspace:   The workspace to use.  Defaults to the workspace previously used for
+                            the current project or P4CLIENT if the user owns it, otherwise the
+                            best workspace for this machine.  If set to '' then no workspace will
+                            be set for the connection
+        :returns:           A new connected P4 instance
+        :raises:            TankError if a connection can't be established without user input
+        """
+        server = self._fw.get_setting("server") or os.environ.get("P4PORT", "")
+
+        global _g_connection_lock
+        _g_connection_lock.acquire()
+        try:
+            try:
+                self.connect_to_server()
+            except SgtkP4Error, e:
+                raise TankError("Perforce: Failed to connect to perforce server '%s' - %s" % (server, e))
+            server = self._p4.port
+
+            try:
+                self._ensure_connection_is_trusted(allow_ui=False)
+            except SgtkP4Error, e:
+                raise TankError("Perforce: Connection to server '%s' is not trusted: %s" % (server, e))
+
+            if not user:
+                # P4USER explicitly set in the environment/config files takes precedence:
+                user = self._p4.env("P4USER")
+            if not user:
+                sg_user = sgtk.util.get_current_user(self._fw.sgtk)
+                if sg_user:
+                    user = self._fw.execute_hook("hook_get_perforce_user", sg_user=sg_user)
+            if user:
+                self._p4.user = str(user)
+            user = self._p4.user
+
+            try:
+                if self._login_required():
+                    if password:
+                        self._p4.password = str(password)
+                    self._do_login(allow_ui=False)
+            except SgtkP4Error, e:
+                raise TankError("Perforce: Failed to login user '%s' - %s" % (user, e))
+
+            if workspace is None:
+                # the workspace previously used for the project or P4CLIENT may belong to a
+                # different user or no longer exist:
+                workspace = self._get_current_workspace()
+                if workspace and not self._is_workspace_valid(workspace, user):
+                    workspace = None
+                workspace = workspace or self._resolve_workspace(user)
+                if workspace:
+                    self._p4.client = str(workspace)
+            elif workspace:
+                try:
+                    self._validate_workspace(workspace, user)
+                    self._p4.client = str(workspace)
+                except SgtkP4Error, e:
+                    raise TankError("Perforce: Workspace '%s' is not valid! - %s" % (workspace, e))
+
+            return self._p4
+        finally:
+            _g_connection_lock.release()
+
     def __has_ui(self):
         """
         Check if the engine has a ui
@@ -432,6 +534,7 @@ class ConnectionHandler(object):
         user = self._fw.execute_hook("hook_get_perforce_user", sg_user=sg_user)
 
         try:
+            from sgtk.platform.qt import QtGui
             from ..widgets import OpenConnectionForm
 
             # get initial user & workspace from settings:
@@ -495,6 +598,7 @@ class ConnectionHandler(object):
                     prompt_error_msg = "Log-in failed: %s" % error_msg
 
                 # prompt for a password in the main thread:
+                from sgtk.platform.qt import QtGui
                 from ..widgets import PasswordForm
                 res, password = self._fw.engine.execute_in_main_thread(self._prompt_for_password,
                                                                        prompt_error_msg,
@@ -551,6 +655,8 @@ class ConnectionHandler(object):
 
         :param widget: The OpenConnectionForm object.
         """
+        from sgtk.platform.qt import QtGui
+
         if not widget.workspace:
             return
 
@@ -577,6 +683,8 @@ class ConnectionHandler(object):
 
         :param widget: The OpenConnectionForm object.
         """
+        from sgtk.platform.qt import QtGui
+
         if not widget.user:
             sg_user = sgtk.util.get_current_user(self._fw.sgtk)
             msg = ("Unable to browse Perforce Workspaces without a corresponding "
@@ -631,12 +739,42 @@ class ConnectionHandler(object):
         if not workspace:
             # see if P4CLIENT is set in the environment:
             env_val = os.environ.get("P4CLIENT")
+            if not env_val and self._p4:
+                # or in a P4CONFIG/P4ENVIRO file:
+                env_val = self._p4.env("P4CLIENT")
             if env_val:
                 workspace = env_val
 
         self._fw.log_debug("Current workspace is '%s'" % workspace)
         return workspace
 
+    def _get_workspace_resolver(self):
+        """
+        :returns: The WorkspaceResolver used to find the best workspace for this machine.
+        """
+        if not self._workspace_resolver:
+            cache_folder = getattr(self._fw, "cache_location", None) or tempfile.gettempdir()
+            self._workspace_resolver = WorkspaceResolver(cache_folder, host=self._p4.host or None)
+        return self._workspace_resolver
+
+    def _resolve_workspace(self, user):
+        """
+        Find the best workspace for the user on this machine from the user's cached/queried
+        workspaces.  If the workspace found is no longer valid then the cached workspaces are
+        out of date so they're discarded.
+
+        :param user: The user to find a workspace for.
+        :returns: The name of the workspace or None if no suitable workspace was found.
+        """
+        resolver = self._get_workspace_resolver()
+        workspace = resolver.resolve(self._p4, user)
+        if workspace and not self._is_workspace_valid(workspace, user):
+            # e.g. the workspace has been deleted or given to another user since it was cached:
+            resolver.invalidate(self._p4.port, user)
+            workspace = None
+        self._fw.log_debug("Resolved workspace '%s' for user '%s'" % (workspace, user))
+        return workspace
+
     def _save_current_workspace(self, workspace):
         """
         Persists the current workspace name.
@@ -669,6 +807,21 @@ class ConnectionHandler(object):
         if user not in ws_users:
             raise TankError("Workspace '%s' is not owned by user '%s'" % (workspace, user))
 
+    def _is_workspace_valid(self, workspace, user):
+        """
+        Checks if the workspace exists and is usable by a user without raising.
+
+        :param workspace: Name of the workspace to validate.
+        :param user: User to check for ownership of the workspace.
+        :returns: True if the workspace is valid, otherwise False.
+        """
+        try:
+            self._validate_workspace(workspace, user)
+        except TankError, e:
+            self._fw.log_debug("Workspace '%s' can't be used by user '%s' - %s" % (workspace, user, e))
+            return False
+        return True
+
     def _login_required(self, min_timeout=300):
         """
         Determine if the specified user is required to log in.
@@ -734,6 +887,22 @@ def connect(allow_ui=True, user=None, password=None, workspace=None):
     return ConnectionHandler(fw).connect(allow_ui, user, password, workspace)
 
 
+def connect_headless(user=None, password=None, workspace=None):
+    """
+    Connect to Perforce without any UI and without importing Qt.  Existing tickets and any
+    P4CONFIG/P4ENVIRO settings are used for anything not specified.
+
+    :param user:        If specified, this will override the Perforce user
+    :param password:    If specified, this will be used to log in the Perforce user if they
+                        don't already have a valid ticket
+    :param workspace:   If specified, this will be used as the workspace for the Perforce user.  If
+                        set to '' then no workspace will be set for the new connection
+    :returns P4:        A new Perforce connection instance
+    """
+    fw = sgtk.platform.current_bundle()
+    return ConnectionHandler(fw).connect_headless(user, password, workspace)
+
+
 def connect_with_dialog():
     """
     Show the Perforce connection dialog
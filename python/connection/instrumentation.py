@@ -0,0 +1,374 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Instrumentation of the Perforce commands run by the framework, its hooks and the apps
+using it.  When enabled, every command run through a connection opened by the framework
+is timed and sized so that hot spots can be found in production.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+from P4 import P4
+
+import sgtk
+
+from .transcript import TRANSCRIPT_ENV_VAR, get_transcript_writer
+
+# environment variable that enables instrumentation.  Set to '1' to enable it or to the
+# path of a file to also append the statistics to as JSON lines:
+METRICS_ENV_VAR = "TK_FRAMEWORK_PERFORCE_METRICS"
+
+
+class CommandStats(object):
+    """
+    Aggregate statistics for a single Perforce command
+    """
+    def __init__(self, command):
+        self.command = command
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.total_args = 0
+        self.total_results = 0
+        self.total_bytes = 0
+        # caller -> [count, total time]:
+        self.callers = {}
+
+    def add(self, elapsed, num_args, num_results, num_bytes, caller, failed):
+        """
+        Add a single run of the command to the statistics
+        """
+        self.count += 1
+        self.errors += 1 if failed else 0
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self.total_args += num_args
+        self.total_results += num_results
+        self.total_bytes += num_bytes
+        caller_stats = self.callers.setdefault(caller, [0, 0.0])
+        caller_stats[0] += 1
+        caller_stats[1] += elapsed
+
+    def to_dict(self):
+        """
+        :returns:   A JSON-serializable dictionary of the statistics
+        """
+        return {"command": self.command, "count": self.count, "errors": self.errors,
+                "total_time": self.total_time, "max_time": self.max_time,
+                "mean_time": self.total_time / self.count if self.count else 0.0,
+                "total_args": self.total_args, "total_results": self.total_results,
+                "total_bytes": self.total_bytes,
+                "callers": dict((caller, {"count": count, "total_time": total_time})
+                                for caller, (count, total_time) in self.callers.iteritems())}
+
+
+class CommandRecorder(object):
+    """
+    Thread-safe collection of the statistics for all commands run through instrumented
+    connections
+    """
+
+    def __init__(self, metrics_file=None):
+        """
+        Construction
+
+        :param metrics_file:    Optional path of a file the statistics are appended to as
+                                JSON lines when they are flushed
+        """
+        self._metrics_file = metrics_file
+        self._stats = {}
+        self._started = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def metrics_file(self):
+        """
+        :returns:   The path of the JSON lines file statistics are flushed to or None
+        """
+        return self._metrics_file
+
+    def record(self, command, num_args, elapsed, results, caller, failed=False):
+        """
+        Record a single run of a command
+
+        :param command:     The command that was run
+        :param num_args:    The number of arguments passed to the command
+        :param elapsed:     The wall time the command took in seconds
+        :param results:     The list of results returned by the command
+        :param caller:      The function (and hook if any) that ran the command
+        :param failed:      True if the command raised an exception
+        """
+        num_results = len(results) if results else 0
+        num_bytes = _estimate_size(results) if results else 0
+        self._lock.acquire()
+        try:
+            stats = self._stats.get(command)
+            if not stats:
+                stats = CommandStats(command)
+                self._stats[command] = stats
+            stats.add(elapsed, num_args, num_results, num_bytes, caller, failed)
+        finally:
+            self._lock.release()
+
+    def get_stats(self):
+        """
+        :returns:   A dictionary of {command: statistics dictionary} for all commands
+                    recorded since the recorder was created or last flushed/reset
+        """
+        self._lock.acquire()
+        try:
+            return dict((command, stats.to_dict()) for command, stats in self._stats.iteritems())
+        finally:
+            self._lock.release()
+
+    def reset(self):
+        """
+        Forget all recorded statistics
+        """
+        self._lock.acquire()
+        try:
+            self._stats = {}
+            self._started = time.time()
+        finally:
+            self._lock.release()
+
+    def flush(self, fw=None):
+        """
+        Report the statistics recorded so far and reset them.  A summary of each command is
+        logged as debug, each command run is logged as a metric and, if a metrics file is
+        set, the statistics are appended to it as a single JSON line per command.
+
+        :param fw:  The framework to log through.  Defaults to the current bundle
+        """
+        self._lock.acquire()
+        try:
+            stats = [s.to_dict() for _, s in sorted(self._stats.iteritems())]
+            started = self._started
+            self._stats = {}
+            self._started = time.time()
+        finally:
+            self._lock.release()
+        if not stats:
+            return
+
+        if fw is None:
+            try:
+                fw = sgtk.platform.current_bundle()
+            except Exception:
+                # not running within a bundle
+                fw = None
+        for command_stats in stats:
+            if fw:
+                fw.log_debug("Perforce command '%(command)s': %(count)d calls, %(total_time).3fs total, "
+                             "%(max_time).3fs max, %(total_results)d results, ~%(total_bytes)d bytes"
+                             % command_stats)
+                try:
+                    fw.log_metric("Perforce command %s" % command_stats["command"], log_once=True)
+                except:
+                    # ignore all errors. ex: using a core that doesn't support metrics
+                    pass
+
+        if self._metrics_file:
+            now = time.time()
+            try:
+                with open(self._metrics_file, "a") as fh:
+                    for command_stats in stats:
+                        command_stats.update({"start": started, "end": now, "pid": os.getpid()})
+                        fh.write(json.dumps(command_stats) + "\n")
+            except (IOError, OSError), e:
+                if fw:
+                    fw.log_warning("Failed to write Perforce command metrics to '%s': %s"
+                                   % (self._metrics_file, e))
+
+
+class InstrumentedP4(P4):
+    """
+    P4 connection that records statistics for every command run through it and/or writes
+    every command to a transcript.  All P4 methods that run commands (run_*, fetch_*,
+    save_*, etc.) go through run() so that is the only method that needs to be instrumented.
+    """
+
+    def __init__(self, recorder=None, transcript=None, *args, **kwargs):
+        """
+        Construction
+
+        :param recorder:    The CommandRecorder to record statistics to.  If neither this or
+                            transcript are specified then this defaults to the recorder shared
+                            by the process
+        :param transcript:  Optional TranscriptWriter to write each command and its results to
+        """
+        P4.__init__(self, *args, **kwargs)
+        if recorder is None and transcript is None:
+            recorder = get_command_recorder()
+        self.__recorder = recorder
+        self.__transcript = transcript
+
+    def run(self, *args, **kwargs):
+        """
+        Run a command, recording its statistics and/or writing it to the transcript
+        """
+        flat_args = _flatten(args)
+        caller = _find_caller() if self.__recorder else None
+
+        results = None
+        failed = True
+        start = time.time()
+        try:
+            results = P4.run(self, *args, **kwargs)
+            failed = False
+            return results
+        finally:
+            elapsed = time.time() - start
+            command = flat_args[0] if flat_args else ""
+            if self.__recorder:
+                self.__recorder.record(command, len(flat_args) - 1, elapsed, results, caller, failed)
+            if self.__transcript:
+                self.__transcript.record(self, flat_args, results, elapsed, failed)
+
+
+def _flatten(args):
+    """
+    :returns:   The arguments flattened into a single list of strings
+    """
+    flat = []
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            flat.extend(_flatten(arg))
+        else:
+            flat.append(str(arg))
+    return flat
+
+def _estimate_size(results):
+    """
+    :returns:   The approximate size in bytes of the results returned by a command
+    """
+    size = 0
+    for item in results:
+        if isinstance(item, dict):
+            for key, value in item.iteritems():
+                size += len(key)
+                if isinstance(value, list):
+                    size += sum(len(v) for v in value if isinstance(v, basestring))
+                elif isinstance(value, basestring):
+                    size += len(value)
+        elif isinstance(item, basestring):
+            size += len(item)
+    return size
+
+# files that are skipped when looking for the caller of a command:
+_SKIP_FILES = [os.path.splitext(os.path.normcase(__file__))[0]]
+
+def _find_caller():
+    """
+    :returns:   A string identifying the function that ran the command and, if it was run
+                from within a hook, the hook, e.g. "filter_publishes:execute > files:get_depot_file_details"
+    """
+    frame = sys._getframe(2)
+    caller = None
+    hook = None
+    hooks_dir = "%shooks%s" % (os.sep, os.sep)
+    while frame:
+        path = os.path.normcase(frame.f_code.co_filename)
+        base = os.path.splitext(path)[0]
+        if base not in _SKIP_FILES and os.path.basename(base).lower() != "p4":
+            name = "%s:%s" % (os.path.basename(base), frame.f_code.co_name)
+            if caller is None:
+                caller = name
+            if hooks_dir in path:
+                hook = name
+                break
+        frame = frame.f_back
+    if hook and hook != caller:
+        return "%s > %s" % (hook, caller)
+    return caller or "<unknown>"
+
+
+_g_recorder = None
+_g_recorder_lock = threading.Lock()
+
+def get_command_recorder():
+    """
+    :returns:   The CommandRecorder shared by all instrumented connections in this process
+    """
+    global _g_recorder
+    _g_recorder_lock.acquire()
+    try:
+        if _g_recorder is None:
+            metrics_file = None
+            env_value = os.environ.get(METRICS_ENV_VAR, "")
+            if env_value and env_value != "1":
+                metrics_file = env_value
+            else:
+                metrics_file = _get_setting("p4_metrics_file") or None
+            _g_recorder = CommandRecorder(metrics_file)
+        return _g_recorder
+    finally:
+        _g_recorder_lock.release()
+
+def is_instrumentation_enabled():
+    """
+    :returns:   True if commands should be instrumented, either because the environment
+                variable is set or because the enable_p4_metrics setting is True
+    """
+    if os.environ.get(METRICS_ENV_VAR):
+        return True
+    return bool(_get_setting("enable_p4_metrics"))
+
+def create_p4():
+    """
+    Create a new, unconnected, P4 instance.  This is an InstrumentedP4 if instrumentation
+    or recording of a transcript is enabled, otherwise a plain P4
+
+    :returns:   A new P4 instance
+    """
+    recorder = get_command_recorder() if is_instrumentation_enabled() else None
+    transcript = None
+    transcript_path = os.environ.get(TRANSCRIPT_ENV_VAR) or _get_setting("p4_transcript_file")
+    if transcript_path:
+        transcript = get_transcript_writer(transcript_path)
+    if recorder or transcript:
+        return InstrumentedP4(recorder, transcript)
+    return P4()
+
+def get_command_stats():
+    """
+    :returns:   A dictionary of {command: statistics dictionary} for all commands recorded
+                since the statistics were last flushed.  This is empty if instrumentation
+                isn't enabled
+    """
+    if _g_recorder is None:
+        return {}
+    return _g_recorder.get_stats()
+
+def flush_command_metrics(fw=None):
+    """
+    Report and reset the statistics recorded so far (see CommandRecorder.flush()).  This does
+    nothing if no commands have been recorded
+
+    :param fw:  The framework to log through.  Defaults to the current bundle
+    """
+    if _g_recorder is not None:
+        _g_recorder.flush(fw)
+
+def _get_setting(name):
+    """
+    :returns:   The value of the framework setting or None if it can't be found
+    """
+    try:
+        return sgtk.platform.current_bundle().get_setting(name)
+    except Exception:
+        # not running within a bundle or an older configuration
+        return None
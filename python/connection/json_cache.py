@@ -0,0 +1,74 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Helpers for small JSON files used to cache data on disk between sessions
+"""
+
+import os
+import json
+import tempfile
+
+
+def load_json_file(path, default=None):
+    """
+    Load the contents of a JSON file.  Missing or corrupt files are treated as empty
+    as these files are only ever used as caches.
+
+    :param path:    The path of the file to load
+    :param default: The value to return if the file doesn't exist or can't be read
+    :returns:       The decoded contents of the file or the default value
+    """
+    if not path or not os.path.exists(path):
+        return default
+    try:
+        fh = open(path, "rb")
+        try:
+            return json.load(fh)
+        finally:
+            fh.close()
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def save_json_file(path, data):
+    """
+    Atomically write data to a JSON file.  The data is written to a temporary file in the
+    same directory which is then renamed over the original so that other processes never
+    see a partially written file.
+
+    :param path:    The path of the file to write
+    :param data:    The JSON-serializable data to write
+    :returns:       True if the file was written, otherwise False
+    """
+    folder = os.path.dirname(path)
+    try:
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+        fd, tmp_path = tempfile.mkstemp(prefix=".%s." % os.path.basename(path), dir=folder or None)
+        try:
+            fh = os.fdopen(fd, "wb")
+            try:
+                json.dump(data, fh, indent=1, sort_keys=True)
+            finally:
+                fh.close()
+
+            if os.name == "nt" and os.path.exists(path):
+                # rename doesn't replace existing files on Windows:
+                os.remove(path)
+            os.rename(tmp_path, path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    except (IOError, OSError):
+        return False
+    return True
@@ -0,0 +1,155 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Pool of Perforce connections that can be used from worker threads
+"""
+
+import threading
+
+from P4 import P4Exception
+
+from sgtk import TankError
+
+from .instrumentation import create_p4
+
+
+def clone_connection(p4):
+    """
+    Open a new connection to the same server, as the same user and using the same
+    workspace as an existing connection.  No UI is ever shown - the new connection
+    re-uses the existing ticket/password so the user must already be logged in.
+
+    :param p4:  The connected P4 instance to clone
+    :returns:   A new, connected P4 instance
+    :raises:    TankError if the new connection can't be opened
+    """
+    new_p4 = create_p4()
+    new_p4.exception_level = p4.exception_level
+    new_p4.port = p4.port
+    new_p4.user = p4.user
+    if p4.client:
+        new_p4.client = p4.client
+    if p4.host:
+        new_p4.host = p4.host
+    if p4.password:
+        new_p4.password = p4.password
+
+    try:
+        new_p4.connect()
+    except P4Exception, e:
+        raise TankError("Perforce: Failed to open a new connection to '%s' - %s"
+                        % (p4.port, new_p4.errors[0] if new_p4.errors else e))
+    return new_p4
+
+
+class ConnectionPool(object):
+    """
+    Thread-safe pool of idle Perforce connections keyed by (server, user, workspace).
+    P4 instances aren't thread-safe so any work done on a background thread should
+    use a connection acquired from the pool rather than the caller's connection.
+    """
+
+    def __init__(self, max_idle=4):
+        """
+        Construction
+
+        :param max_idle:    The maximum number of idle connections to keep for each
+                            server/user/workspace combination
+        """
+        self._max_idle = max_idle
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, p4):
+        """
+        Get a connection that matches the specified connection.  An idle connection
+        will be returned if one is available, otherwise a new one is opened.
+
+        :param p4:  The connection to match
+        :returns:   A connected P4 instance that should be returned to the pool
+                    using release() once it's no longer needed
+        """
+        key = self.__connection_key(p4)
+        while True:
+            self._lock.acquire()
+            try:
+                idle = self._idle.get(key)
+                pooled_p4 = idle.pop() if idle else None
+            finally:
+                self._lock.release()
+
+            if not pooled_p4:
+                break
+            if pooled_p4.connected():
+                return pooled_p4
+
+        return clone_connection(p4)
+
+    def release(self, p4):
+        """
+        Return a connection to the pool.  The connection is disconnected if there
+        are already enough idle connections.
+
+        :param p4:  The connection previously returned by acquire()
+        """
+        if not p4.connected():
+            return
+
+        key = self.__connection_key(p4)
+        self._lock.acquire()
+        try:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self._max_idle:
+                idle.append(p4)
+                return
+        finally:
+            self._lock.release()
+
+        p4.disconnect()
+
+    def clear(self):
+        """
+        Disconnect and remove all idle connections from the pool
+        """
+        self._lock.acquire()
+        try:
+            idle = self._idle
+            self._idle = {}
+        finally:
+            self._lock.release()
+
+        for connections in idle.values():
+            for p4 in connections:
+                if p4.connected():
+                    p4.disconnect()
+
+    def __connection_key(self, p4):
+        """
+        :returns:   The key used to find idle connections matching the specified connection
+        """
+        return (p4.port, p4.user, p4.client)
+
+
+_g_connection_pool = None
+_g_connection_pool_lock = threading.Lock()
+
+def get_connection_pool():
+    """
+    :returns:   The ConnectionPool shared by the whole framework
+    """
+    global _g_connection_pool
+    _g_connection_pool_lock.acquire()
+    try:
+        if _g_connection_pool is None:
+            _g_connection_pool = ConnectionPool()
+        return _g_connection_pool
+    finally:
+        _g_connection_pool_lock.release()
@@ -0,0 +1,231 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Transcripts of the Perforce commands run through a connection and the tagged output they
+returned.  A transcript is a gzipped file of JSON lines - a header line describing the
+connection followed by a line per command:
+
+    {"transcript": 1, "port": "ssl:perforce:1666", "user": "...", "client": "...", "created": ...}
+    {"cmd": ["fstat", "-T", "depotFile,headRev", "//depot/..."], "results": [...],
+     "errors": [], "warnings": [], "raised": false, "elapsed": 0.012, "client": "..."}
+
+Transcripts are recorded by connections opened by the framework when recording is enabled
+and can be replayed without a server using the testing module's ReplayP4.
+"""
+
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+
+# environment variable that enables recording - set to the path of the transcript file:
+TRANSCRIPT_ENV_VAR = "TK_FRAMEWORK_PERFORCE_TRANSCRIPT"
+
+# the version of the transcript format written:
+TRANSCRIPT_VERSION = 1
+
+# commands whose input is never recorded as it contains the user's password:
+_PRIVATE_INPUT_COMMANDS = ("login", "passwd")
+
+
+class TranscriptWriter(object):
+    """
+    Thread-safe writer that appends the commands run by any number of connections to a
+    single transcript file.  Each connection writes a header line the first time it runs a
+    command so that a transcript can contain several sessions.
+    """
+
+    def __init__(self, path):
+        """
+        Construction
+
+        :param path:    The path of the transcript file.  If it already exists then new
+                        commands are appended to it
+        """
+        self._path = path
+        self._fh = None
+        self._headers_written = set()
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        """
+        :returns:   The path of the transcript file
+        """
+        return self._path
+
+    def record(self, p4, args, results, elapsed, raised=False):
+        """
+        Append a single command to the transcript
+
+        :param p4:      The connection the command was run with
+        :param args:    The command and its arguments, flattened into a list of strings
+        :param results: The list of results returned by the command or None if it raised
+        :param elapsed: The wall time the command took in seconds
+        :param raised:  True if the command raised an exception
+        """
+        entry = {"cmd": args, "results": results or [],
+                 "errors": list(p4.errors or []), "warnings": list(p4.warnings or []),
+                 "raised": raised, "elapsed": elapsed, "client": p4.client, "user": p4.user}
+        if "-i" in args and p4.input is not None and args[0] not in _PRIVATE_INPUT_COMMANDS:
+            entry["input"] = p4.input
+        line = _dumps(entry)
+
+        self._lock.acquire()
+        try:
+            if self._fh is None:
+                directory = os.path.dirname(self._path)
+                if directory and not os.path.exists(directory):
+                    os.makedirs(directory)
+                self._fh = gzip.open(self._path, "ab")
+            if id(p4) not in self._headers_written:
+                self._fh.write(_dumps({"transcript": TRANSCRIPT_VERSION, "port": p4.port, "user": p4.user,
+                                       "client": p4.client, "created": time.time()}) + "\n")
+                self._headers_written.add(id(p4))
+            self._fh.write(line + "\n")
+            # flush so that the transcript of a session that doesn't exit cleanly is usable:
+            self._fh.flush()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """
+        Close the transcript file.  Recording more commands re-opens it
+        """
+        self._lock.acquire()
+        try:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+            self._headers_written = set()
+        finally:
+            self._lock.release()
+
+
+def read_transcript(path):
+    """
+    Read all commands from a transcript file
+
+    :param path:    The path of the transcript file
+    :returns:       A tuple of (headers, entries) where headers is the list of session header
+                    dictionaries and entries is the list of command dictionaries, in the order
+                    they were recorded
+    """
+    headers = []
+    entries = []
+    lines = _decompress(path).split("\n")
+    for li, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = _to_str(json.loads(line))
+        except ValueError:
+            if li == len(lines) - 1:
+                # the last line of a transcript that wasn't closed cleanly may be incomplete:
+                break
+            raise
+        if "transcript" in record:
+            if record["transcript"] > TRANSCRIPT_VERSION:
+                raise ValueError("Transcript '%s' was written by a newer version (%s) of the framework"
+                                 % (path, record["transcript"]))
+            headers.append(record)
+        else:
+            entries.append(record)
+    return headers, entries
+
+def _decompress(path):
+    """
+    :returns:   The decompressed contents of a transcript file.  A transcript contains a
+                gzip member for each time it was opened and the last member is truncated if
+                the process recording it didn't exit cleanly, so this reads everything that
+                can be read rather than failing like the gzip module does
+    """
+    with open(path, "rb") as fh:
+        data = fh.read()
+    chunks = []
+    while data:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            chunks.append(decompressor.decompress(data))
+        except zlib.error:
+            # corrupt data - keep everything read before it
+            break
+        data = decompressor.unused_data
+    return "".join(chunks)
+
+
+def _dumps(record):
+    """
+    :returns:   The record as a single line of JSON.  Perforce returns strings in whatever
+                encoding the server & files use so anything that isn't valid UTF-8 is
+                written as latin-1, which round-trips every byte
+    """
+    try:
+        return json.dumps(record, separators=(",", ":"), default=_to_json)
+    except UnicodeDecodeError:
+        record = dict(record, encoding="latin-1")
+        return json.dumps(record, separators=(",", ":"), default=_to_json, encoding="latin-1")
+
+def _to_json(value):
+    """
+    :returns:   A JSON-serializable version of a result object that isn't a dict or string,
+                e.g. the DepotFile objects returned by filelog
+    """
+    return getattr(value, "__dict__", None) or str(value)
+
+def _to_str(value, encoding=None):
+    """
+    Convert the unicode strings returned by json back to the byte strings returned by P4
+    """
+    if isinstance(value, dict):
+        encoding = encoding or value.get("encoding") or "utf-8"
+        return dict((_to_str(k, encoding), _to_str(v, encoding)) for k, v in value.iteritems())
+    if isinstance(value, list):
+        return [_to_str(v, encoding) for v in value]
+    if isinstance(value, unicode):
+        return value.encode(encoding or "utf-8")
+    return value
+
+
+_g_transcript_writers = {}
+_g_transcript_writers_lock = threading.Lock()
+
+def get_transcript_writer(path):
+    """
+    :param path:    The path of the transcript file
+    :returns:       The TranscriptWriter shared by all connections in this process recording
+                    to the file
+    """
+    path = os.path.abspath(os.path.expanduser(path))
+    _g_transcript_writers_lock.acquire()
+    try:
+        writer = _g_transcript_writers.get(path)
+        if writer is None:
+            writer = TranscriptWriter(path)
+            _g_transcript_writers[path] = writer
+        return writer
+    finally:
+        _g_transcript_writers_lock.release()
+
+def close_transcripts():
+    """
+    Close all transcript files currently being recorded to
+    """
+    _g_transcript_writers_lock.acquire()
+    try:
+        writers = _g_transcript_writers.values()
+    finally:
+        _g_transcript_writers_lock.release()
+    for writer in writers:
+        writer.close()
@@ -1,70 +1,223 @@
 # Copyright (c) 2013 Shotgun Software Inc.
-# 
+#
 # CONFIDENTIAL AND PROPRIETARY
-# 
-# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit 
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
 # Source Code License included in this distribution package. See LICENSE.
-# By accessing, using, copying or modifying this work you indicate your 
-# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights 
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 """
 Per-user setting management
 """
 
+import os
+import sys
+import threading
+
+from .json_cache import load_json_file, save_json_file
+
+
 class UserSettings(object):
     """
+    Per-project user settings.  Settings are kept in a settings store which by default
+    is a JSON file in the user's cache so that they can be read without Qt, e.g. from
+    farm processes.
     """
-    
+
     ORGANIZATION = "Shotgun Software"
     APPLICATION =  "tk-framework-perforce"
-    
-    def __init__(self, prefix=""):
-        
+
+    def __init__(self, prefix="", store=None):
+        """
+        Construction
+
+        :param prefix:  The group the settings are stored under
+        :param store:   The settings store to use.  Defaults to the store returned by
+                        get_settings_store()
+        """
         self._prefix = prefix
-        self._settings = None
-        
+        self._store = store
+
     def get_client(self, project_id):
         """
         """
-        if self._settings == None:
-            self._settings = self._load_settings()
-        
-        project_settings = self._settings.get(project_id)
+        project_settings = self._get_store().get(self._prefix, str(project_id))
         if project_settings:
             return project_settings.get("client")
-            
+
         return None
-    
+
     def set_client(self, project_id, client):
         """
         """
-        if self._settings == None:
-            self._settings = self._load_settings()
-        
-        project_settings = self._settings.setdefault(project_id, {})
-        project_settings["client"] = client
+        self._get_store().set(self._prefix, str(project_id), {"client":client})
+
+    def _get_store(self):
+        """
+        """
+        if self._store is None:
+            self._store = get_settings_store()
+        return self._store
+
+
+class JsonSettingsStore(object):
+    """
+    Settings store backed by a JSON file.  The file is loaded once per process and only
+    re-read if it has been modified by another process.  Writes are merged with the
+    current contents of the file and written atomically.
+    """
+
+    def __init__(self, path):
+        """
+        Construction
+
+        :param path:    The path of the JSON settings file
+        """
+        self._path = path
+        self._settings = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        """
+        :returns:   The path of the JSON settings file
+        """
+        return self._path
+
+    def get(self, group, key):
+        """
+        :param group:   The group the setting is stored under
+        :param key:     The key of the setting within the group
+        :returns:       The value of the setting or None if it isn't set
+        """
+        self._lock.acquire()
+        try:
+            return self._load().get(group, {}).get(key)
+        finally:
+            self._lock.release()
+
+    def set(self, group, key, value):
+        """
+        Set a setting, writing the settings file if the value has changed
+
+        :param group:   The group the setting is stored under
+        :param key:     The key of the setting within the group
+        :param value:   The JSON-serializable value of the setting
+        """
+        self._lock.acquire()
+        try:
+            settings = self._load()
+            if settings.get(group, {}).get(key) == value:
+                # nothing to do!
+                return
+            settings.setdefault(group, {})[key] = value
+            if save_json_file(self._path, settings):
+                self._mtime = self._get_mtime()
+        finally:
+            self._lock.release()
+
+    def _load(self):
+        """
+        :returns:   The settings, loading them from disk if they haven't been loaded yet or
+                    if the file has been modified since they were loaded
+        """
+        mtime = self._get_mtime()
+        if self._settings is None or mtime != self._mtime:
+            settings = load_json_file(self._path, None)
+            self._settings = settings if isinstance(settings, dict) else {}
+            self._mtime = mtime
+        if not self._settings.get(_LEGACY_MIGRATED_KEY):
+            self._migrate_legacy_settings()
+        return self._settings
+
+    def _migrate_legacy_settings(self):
+        """
+        Bring across any settings saved by older versions of the framework, if they can be
+        read in this process, and record that they have been migrated in the settings file.
+        Settings already in the file take precedence as they're more recent.
+        """
+        legacy_settings = _load_legacy_settings()
+        if legacy_settings is None:
+            # can't be read yet - try again the next time the settings are loaded:
+            return
+        for group, values in legacy_settings.iteritems():
+            group_settings = self._settings.setdefault(group, {})
+            for key, value in values.iteritems():
+                group_settings.setdefault(key, value)
+        self._settings[_LEGACY_MIGRATED_KEY] = True
+        if save_json_file(self._path, self._settings):
+            self._mtime = self._get_mtime()
 
-        self._save_settings(self._settings)
-        
-    def _load_settings(self):
+    def _get_mtime(self):
         """
+        :returns:   The modification time of the settings file or None if it doesn't exist
         """
+        try:
+            return os.path.getmtime(self._path)
+        except OSError:
+            return None
+
+
+def _get_settings_folder():
+    """
+    :returns:   The folder user settings are stored in
+    """
+    try:
+        from sgtk.util import LocalFileStorageManager
+        return LocalFileStorageManager.get_global_root(LocalFileStorageManager.PREFERENCES)
+    except (ImportError, AttributeError):
+        pass
+
+    # older versions of core - use the same locations as LocalFileStorageManager:
+    if sys.platform == "darwin":
+        return os.path.expanduser("~/Library/Preferences/Shotgun")
+    elif sys.platform == "win32":
+        return os.path.join(os.environ.get("APPDATA", os.path.expanduser("~")), "Shotgun", "Preferences")
+    else:
+        return os.path.expanduser("~/.shotgun/preferences")
+
+
+# Qt bindings that Toolkit may have loaded:
+_QT_MODULES = ["PySide", "PySide2", "PySide6", "PyQt4", "PyQt5"]
+
+# the key recording that settings saved by older versions have been migrated:
+_LEGACY_MIGRATED_KEY = "legacy_settings_migrated"
+
+def _load_legacy_settings():
+    """
+    Load settings saved by older versions of the framework through QSettings.  These can
+    only be loaded if Qt has already been imported in this process - headless & farm
+    processes mustn't import Qt just to look for old settings.  In that case the settings
+    are migrated by the first process using Qt that reads settings.
+
+    :returns:   Dictionary of {group:{project_id:{"client":client}}} or None if the
+                settings can't be loaded in this process
+    """
+    if not any(module in sys.modules for module in _QT_MODULES):
+        return None
+    try:
         from sgtk.platform.qt import QtCore
-        if not hasattr(QtCore, "QSettings"):
-            return {}        
-        
-        q_settings = QtCore.QSettings(UserSettings.ORGANIZATION, UserSettings.APPLICATION)
-        
-        settings = {}
-        array_sz = q_settings.beginReadArray(self._prefix)
-        
+    except Exception:
+        return None
+    if not hasattr(QtCore, "QSettings"):
+        return None
+
+    q_settings = QtCore.QSettings(UserSettings.ORGANIZATION, UserSettings.APPLICATION)
+
+    settings = {}
+    for group in q_settings.childGroups():
+        group = str(group)
+        array_sz = q_settings.beginReadArray(group)
+
         for ai in range(0, array_sz):
             q_settings.setArrayIndex(ai)
-            
+
             project_id = q_settings.value("project_id")
             client = q_settings.value("client")
-            
+
             # convert from QVariant object if itemData is returned as such
             if hasattr(QtCore, "QVariant"):
                 if isinstance(project_id, QtCore.QVariant):
@@ -72,29 +225,45 @@ class UserSettings(object):
                 if isinstance(client, QtCore.QVariant):
                     client = client.toPyObject()
 
-            project_id = int(project_id)
-            client = str(client)
+            try:
+                project_id = int(project_id)
+            except (TypeError, ValueError):
+                continue
+
+            settings.setdefault(group, {})[str(project_id)] = {"client":str(client)}
 
-            settings[project_id] = {"client":client}
-            
         q_settings.endArray()
-        
-        return settings
 
-    def _save_settings(self, settings):
-        """
-        """
-        from sgtk.platform.qt import QtCore
-        if not hasattr(QtCore, "QSettings"):
-            return
-                
-        q_settings = QtCore.QSettings(UserSettings.ORGANIZATION, UserSettings.APPLICATION)
-        
-        q_settings.beginWriteArray(self._prefix)
-        
-        for ai, (project_id, details) in enumerate(settings.iteritems()):
-            q_settings.setArrayIndex(ai)
-            q_settings.setValue("project_id", project_id)
-            q_settings.setValue("client", details.get("client", ""))
-            
-        q_settings.endArray()
\ No newline at end of file
+    return settings
+
+
+_g_settings_store = None
+_g_settings_store_lock = threading.Lock()
+
+def get_settings_store():
+    """
+    :returns:   The settings store shared by all UserSettings instances in this process
+    """
+    global _g_settings_store
+    _g_settings_store_lock.acquire()
+    try:
+        if _g_settings_store is None:
+            path = os.path.join(_get_settings_folder(), "tk-framework-perforce", "user_settings.json")
+            _g_settings_store = JsonSettingsStore(path)
+        return _g_settings_store
+    finally:
+        _g_settings_store_lock.release()
+
+def set_settings_store(store):
+    """
+    Replace the settings store used by UserSettings instances that weren't created with an
+    explicit store, e.g. to store settings in a different location.
+
+    :param store:   An object implementing get(group, key) and set(group, key, value)
+    """
+    global _g_settings_store
+    _g_settings_store_lock.acquire()
+    try:
+        _g_settings_store = store
+    finally:
+        _g_settings_store_lock.release()
@@ -0,0 +1,265 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Automatic selection of the workspace to use on the current machine
+"""
+
+import os
+import socket
+import threading
+import time
+
+from P4 import P4Exception
+
+from .json_cache import load_json_file, save_json_file
+from .capabilities import get_server_capabilities, ServerCapabilities
+from .pool import get_connection_pool
+
+# the client spec fields kept in the cache:
+_CACHED_CLIENT_FIELDS = ["client", "Owner", "Host", "Root", "AltRoots", "Update", "Access"]
+
+
+class WorkspaceResolver(object):
+    """
+    Chooses the best workspace for a user on the current machine without prompting.  The
+    list of the user's workspaces is cached on disk so that it doesn't have to be queried
+    from the server every time a connection is made.
+    """
+
+    CACHE_FILE_NAME = "workspaces.json"
+    DEFAULT_TTL = 60 * 60
+
+    def __init__(self, cache_folder, ttl=DEFAULT_TTL, host=None):
+        """
+        Construction
+
+        :param cache_folder:    The folder to store the workspace cache in
+        :param ttl:             The time in seconds after which cached workspaces are refreshed
+                                from the server
+        :param host:            The name of the current machine.  Defaults to the host name
+        """
+        self._cache_path = os.path.join(cache_folder, WorkspaceResolver.CACHE_FILE_NAME)
+        self._ttl = ttl
+        self._host = host or socket.gethostname()
+        self._lock = threading.Lock()
+        self._refreshing = set()
+
+    @property
+    def host(self):
+        """
+        :returns:   The name of the machine workspaces are resolved for
+        """
+        return self._host
+
+    def resolve(self, p4, user):
+        """
+        Find the best workspace for the user on this machine.  Cached workspaces are used if
+        available, refreshing them in the background if they're out of date.  Otherwise the
+        server is first asked for workspaces named after this machine and only if none of those
+        are usable are all of the user's workspaces listed.
+
+        :param p4:      A connected, logged-in P4 instance
+        :param user:    The user to find a workspace for
+        :returns:       The name of the best workspace or None if no usable workspace was found
+        """
+        entry = self._get_cache_entry(p4.port, user)
+        if entry is not None:
+            clients = entry.get("clients", [])
+            if time.time() - entry.get("timestamp", 0) > self._ttl or not entry.get("complete"):
+                self._refresh_in_background(p4, user)
+
+            workspace = self.find_best_workspace(clients)
+            if workspace:
+                return workspace
+
+            if entry.get("complete") and time.time() - entry.get("timestamp", 0) <= self._ttl:
+                # the cache is up to date so there's no point asking the server:
+                return None
+
+        # nothing usable in the cache.  Workspaces are frequently named after the machine they're
+        # used on so try those first to avoid listing every workspace the user owns:
+        clients = self._query_clients(p4, user, "*%s*" % self._host)
+        workspace = self.find_best_workspace(clients)
+        if workspace:
+            self._update_cache(p4.port, user, clients, complete=False)
+            self._refresh_in_background(p4, user)
+            return workspace
+
+        clients = self._query_clients(p4, user)
+        self._update_cache(p4.port, user, clients, complete=True)
+        return self.find_best_workspace(clients)
+
+    def refresh(self, p4, user):
+        """
+        Re-query all of the user's workspaces from the server and update the cache
+
+        :param p4:      A connected, logged-in P4 instance
+        :param user:    The user to query workspaces for
+        :returns:       The list of client dictionaries returned by the server
+        """
+        clients = self._query_clients(p4, user)
+        self._update_cache(p4.port, user, clients, complete=True)
+        return clients
+
+    def invalidate(self, server, user):
+        """
+        Remove cached workspaces for a user, e.g. after a workspace has been deleted
+
+        :param server:  The server the workspaces are on
+        :param user:    The user to remove cached workspaces for
+        """
+        self._lock.acquire()
+        try:
+            cache = load_json_file(self._cache_path, {})
+            if cache.pop(self._cache_key(server, user), None) is not None:
+                save_json_file(self._cache_path, cache)
+        finally:
+            self._lock.release()
+
+    def find_best_workspace(self, clients):
+        """
+        Choose the best workspace for this machine from a list of clients.  Workspaces bound to a
+        different host or whose root doesn't exist locally are never chosen.  Workspaces bound to
+        this host are preferred over unbound ones and then the most recently used/updated wins.
+
+        :param clients: List of client dictionaries as returned by 'p4 clients'
+        :returns:       The name of the best workspace or None if none are usable
+        """
+        host = self._host.lower()
+        best = None
+        best_score = None
+        for client in clients or []:
+            name = (client.get("client") or "").strip()
+            if not name:
+                continue
+
+            client_host = (client.get("Host") or "").strip().lower()
+            if client_host and client_host != host:
+                continue
+
+            roots = [client.get("Root")] + (client.get("AltRoots") or [])
+            if not [r for r in roots if r and os.path.isdir(r)]:
+                continue
+
+            score = (bool(client_host), _to_int(client.get("Access")), _to_int(client.get("Update")))
+            if best_score is None or score > best_score:
+                best = name
+                best_score = score
+        return best
+
+    def _query_clients(self, p4, user, pattern=None):
+        """
+        :returns:   The list of the user's clients, optionally filtered by a case-insensitive
+                    name pattern
+        """
+        args = ["-u", user]
+        if pattern:
+            # -E (case-insensitive) isn't supported by older servers:
+            case_insensitive = get_server_capabilities(p4).supports(
+                ServerCapabilities.CLIENTS_CASE_INSENSITIVE_FILTER)
+            args += ["-E" if case_insensitive else "-e", pattern]
+        try:
+            return p4.run_clients(*args)
+        except P4Exception:
+            return []
+
+    def _refresh_in_background(self, p4, user):
+        """
+        Refresh the cached workspaces for the user on a worker thread using a pooled connection
+        """
+        key = self._cache_key(p4.port, user)
+        self._lock.acquire()
+        try:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        finally:
+            self._lock.release()
+
+        # acquire the connection on the calling thread as the P4 instance being cloned
+        # mustn't be used from the worker thread:
+        pool = get_connection_pool()
+        try:
+            refresh_p4 = pool.acquire(p4)
+        except Exception:
+            self._lock.acquire()
+            try:
+                self._refreshing.discard(key)
+            finally:
+                self._lock.release()
+            return
+
+        def _do_refresh():
+            try:
+                self.refresh(refresh_p4, user)
+            finally:
+                pool.release(refresh_p4)
+                self._lock.acquire()
+                try:
+                    self._refreshing.discard(key)
+                finally:
+                    self._lock.release()
+
+        worker = threading.Thread(target=_do_refresh, name="Perforce workspace refresh")
+        worker.daemon = True
+        worker.start()
+
+    def _get_cache_entry(self, server, user):
+        """
+        :returns:   The cached entry for the server & user or None if there isn't one
+        """
+        self._lock.acquire()
+        try:
+            cache = load_json_file(self._cache_path, {})
+        finally:
+            self._lock.release()
+        entry = cache.get(self._cache_key(server, user)) if isinstance(cache, dict) else None
+        return entry if isinstance(entry, dict) else None
+
+    def _update_cache(self, server, user, clients, complete):
+        """
+        Store the clients for the server & user in the cache.  Partial results are merged with
+        any previously cached clients.
+        """
+        clients = [dict((f, c[f]) for f in _CACHED_CLIENT_FIELDS if f in c) for c in clients or []]
+        key = self._cache_key(server, user)
+
+        self._lock.acquire()
+        try:
+            cache = load_json_file(self._cache_path, {})
+            if not isinstance(cache, dict):
+                cache = {}
+
+            previous = cache.get(key)
+            if not complete and isinstance(previous, dict):
+                names = set(c.get("client") for c in clients)
+                clients += [c for c in previous.get("clients", []) if c.get("client") not in names]
+
+            cache[key] = {"timestamp": time.time(), "complete": complete, "clients": clients}
+            save_json_file(self._cache_path, cache)
+        finally:
+            self._lock.release()
+
+    def _cache_key(self, server, user):
+        """
+        :returns:   The key used to store workspaces for the server & user in the cache
+        """
+        return "%s|%s|%s" % (server, user, self._host)
+
+
+def _to_int(value):
+    """
+    :returns:   The value converted to an int or 0 if it can't be converted
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
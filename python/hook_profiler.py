@@ -0,0 +1,187 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Timing & profiling of the hooks executed by the framework
+"""
+
+import cProfile
+import os
+import re
+import threading
+import time
+
+# the default time in seconds above which a hook execution is logged as slow:
+DEFAULT_SLOW_HOOK_THRESHOLD = 1.0
+
+# the maximum length of a single argument value in the summary logged for slow hooks:
+_MAX_VALUE_LENGTH = 80
+
+
+class HookProfiler(object):
+    """
+    Times every hook executed through it, logs the ones that are slower than a threshold
+    and optionally runs each execution under cProfile, dumping the statistics to a .pstats
+    file that can be loaded with the pstats module or a viewer such as snakeviz.
+    """
+
+    def __init__(self, slow_threshold=DEFAULT_SLOW_HOOK_THRESHOLD, profile_dir=None):
+        """
+        Construction
+
+        :param slow_threshold:  The time in seconds above which a hook execution is logged
+                                as slow
+        :param profile_dir:     Optional directory to dump a .pstats file to for each hook
+                                execution.  If not specified then hooks aren't profiled
+        """
+        self._slow_threshold = slow_threshold
+        self._profile_dir = profile_dir
+        self._stats = {}
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def slow_threshold(self):
+        """
+        :returns:   The time in seconds above which a hook execution is logged as slow
+        """
+        return self._slow_threshold
+
+    @property
+    def profile_dir(self):
+        """
+        :returns:   The directory .pstats files are dumped to or None if hooks aren't profiled
+        """
+        return self._profile_dir
+
+    def execute(self, fw, hook_name, kwargs, execute_fn):
+        """
+        Execute a hook, timing and (optionally) profiling it
+
+        :param fw:          The framework executing the hook, used for logging
+        :param hook_name:   The name of the hook setting, e.g. 'hook_load_publish_data'
+        :param kwargs:      The arguments passed to the hook
+        :param execute_fn:  Callable taking no arguments that executes the hook
+        :returns:           The result of the hook
+        """
+        # cProfile can only profile one thing at a time in a thread so when a hook executes
+        # another hook, only the outermost execution is profiled:
+        depth = getattr(self._local, "depth", 0)
+        profiler = cProfile.Profile() if self._profile_dir and depth == 0 else None
+
+        self._local.depth = depth + 1
+        start = time.time()
+        try:
+            if profiler:
+                return profiler.runcall(execute_fn)
+            return execute_fn()
+        finally:
+            elapsed = time.time() - start
+            self._local.depth = depth
+            self._record(hook_name, elapsed)
+
+            fw.log_debug("%s: Hook '%s' took %.3fs" % (fw, hook_name, elapsed))
+            if elapsed >= self._slow_threshold:
+                fw.log_warning("%s: Slow hook '%s' took %.3fs (threshold %.3fs) - %s"
+                               % (fw, hook_name, elapsed, self._slow_threshold, summarize_args(kwargs)))
+            if profiler:
+                self._dump_profile(fw, hook_name, profiler)
+
+    def get_stats(self):
+        """
+        :returns:   A dictionary of {hook name: {"count", "total_time", "max_time", "slow"}}
+                    for all hooks executed so far
+        """
+        self._lock.acquire()
+        try:
+            return dict((name, dict(stats)) for name, stats in self._stats.iteritems())
+        finally:
+            self._lock.release()
+
+    def log_summary(self, fw):
+        """
+        Log a summary of the time taken by each hook executed so far
+
+        :param fw:  The framework to log through
+        """
+        for name, stats in sorted(self.get_stats().iteritems()):
+            fw.log_debug("%s: Hook '%s' executed %d times, %.3fs total, %.3fs max, %d slow"
+                         % (fw, name, stats["count"], stats["total_time"], stats["max_time"], stats["slow"]))
+
+    def _record(self, hook_name, elapsed):
+        """
+        Add a single execution of a hook to the statistics
+        """
+        self._lock.acquire()
+        try:
+            stats = self._stats.setdefault(hook_name, {"count": 0, "total_time": 0.0, "max_time": 0.0, "slow": 0})
+            stats["count"] += 1
+            stats["total_time"] += elapsed
+            stats["max_time"] = max(stats["max_time"], elapsed)
+            if elapsed >= self._slow_threshold:
+                stats["slow"] += 1
+        finally:
+            self._lock.release()
+
+    def _dump_profile(self, fw, hook_name, profiler):
+        """
+        Dump the statistics for a single hook execution to a new .pstats file
+        """
+        self._lock.acquire()
+        try:
+            self._sequence += 1
+            sequence = self._sequence
+        finally:
+            self._lock.release()
+
+        file_name = "%s_%s_%d_%04d.pstats" % (re.sub(r"[^\w.-]+", "_", hook_name),
+                                              time.strftime("%Y%m%d-%H%M%S"), os.getpid(), sequence)
+        path = os.path.join(self._profile_dir, file_name)
+        try:
+            if not os.path.exists(self._profile_dir):
+                os.makedirs(self._profile_dir)
+            profiler.dump_stats(path)
+        except (IOError, OSError), e:
+            fw.log_warning("%s: Failed to write hook profile '%s': %s" % (fw, path, e))
+        else:
+            fw.log_debug("%s: Profile of hook '%s' written to '%s'" % (fw, hook_name, path))
+
+
+def summarize_args(kwargs):
+    """
+    Summarize the arguments passed to a hook for logging.  Long values are truncated and
+    only the size and first item of lists & dictionaries are included.
+
+    :param kwargs:  The dictionary of arguments passed to the hook
+    :returns:       A single line summary of the arguments
+    """
+    return ", ".join("%s=%s" % (name, _summarize_value(value)) for name, value in sorted(kwargs.iteritems()))
+
+def _summarize_value(value):
+    """
+    :returns:   A short string representation of a single argument value
+    """
+    if isinstance(value, (list, tuple, set)):
+        items = list(value)
+        if not items:
+            return "%s()" % type(value).__name__
+        return "%s(%d: %s%s)" % (type(value).__name__, len(items), _summarize_value(items[0]),
+                                 ", ..." if len(items) > 1 else "")
+    if isinstance(value, dict):
+        # Shotgun entity dictionaries are best summarized by their type & id:
+        if "type" in value and "id" in value:
+            return "%s %s" % (value["type"], value["id"])
+        return "dict(%d keys)" % len(value)
+    if value is None or isinstance(value, (basestring, int, long, float, bool)):
+        text = repr(value)
+        return text if len(text) <= _MAX_VALUE_LENGTH else text[:_MAX_VALUE_LENGTH - 3] + "..."
+    # anything else, e.g. a P4 connection, is summarized by its type:
+    return "<%s>" % type(value).__name__
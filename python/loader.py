@@ -0,0 +1,32 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+On-demand import of the framework's modules
+"""
+
+import sys
+
+_PACKAGE_NAME = __name__.rpartition(".")[0]
+
+
+def import_submodule(name):
+    """
+    Import one of the framework's modules that isn't imported when the framework's python
+    package is loaded.  Core's Bundle.import_module() only finds modules that have already
+    been imported so this must be used first for modules that are imported on demand.
+
+    :param name:    The name of the module relative to the python folder, e.g. "widgets"
+    :returns:       The imported module
+    """
+    full_name = "%s.%s" % (_PACKAGE_NAME, name) if _PACKAGE_NAME else name
+    if full_name not in sys.modules:
+        __import__(full_name)
+    return sys.modules[full_name]
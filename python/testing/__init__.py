@@ -0,0 +1,14 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+# 
+# CONFIDENTIAL AND PROPRIETARY
+# 
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit 
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your 
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights 
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+from .fake_p4 import FakeP4, FakeDepot, FakeSpec, FileRevision, OpenedFile
+from .synthetic_depot import generate_synthetic_depot, SyntheticDepotInfo
+from .replay_p4 import ReplayP4
+from .fake_shotgun import FakeShotgun, FakeShotgunError
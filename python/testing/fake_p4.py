@@ -0,0 +1,1345 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+In-process stand-in for a Perforce server and the P4 connection object.  This implements
+the subset of commands and behaviour the framework relies on, entirely in Python, so that
+the framework can be exercised and benchmarked without a server.  Local files are never
+read or written - the have list & opened state are tracked in memory only.
+"""
+
+import binascii
+import bisect
+import copy
+import fnmatch
+import itertools
+import os
+import threading
+import time
+from collections import namedtuple
+
+from P4 import P4Exception, Map as P4Map # Prefix P4 for consistency
+
+# a single submitted revision of a file:
+FileRevision = namedtuple("FileRevision", ["rev", "change", "action", "type", "time", "size", "digest"])
+
+# actions that leave a file deleted at a revision:
+DELETE_ACTIONS = ("delete", "move/delete", "purge", "archive")
+
+
+class OpenedFile(object):
+    """
+    A file opened in a workspace
+    """
+    def __init__(self, depot_path, client, user, action, change="default", file_type="binary", work_rev=1):
+        self.depot_path = depot_path
+        self.client = client
+        self.user = user
+        self.action = action
+        self.change = change
+        self.type = file_type
+        self.work_rev = work_rev
+        self.attributes = {}
+
+
+class FakeChange(object):
+    """
+    A pending, shelved or submitted change
+    """
+    def __init__(self, change, user, client, description, status="pending", change_time=None):
+        self.change = change
+        self.user = user
+        self.client = client
+        self.description = description
+        self.status = status
+        self.time = int(change_time if change_time is not None else time.time())
+        # list of (depot path, rev) for submitted changes:
+        self.revisions = []
+        # depot path -> OpenedFile for files shelved in the change:
+        self.shelved = {}
+
+
+class FakeSpec(dict):
+    """
+    Spec dictionary that also supports the attribute access provided by P4Python
+    specs, e.g. client_spec._root for client_spec["Root"]
+    """
+    def __getattr__(self, name):
+        if not name.startswith("_"):
+            raise AttributeError(name)
+        key = self.__find_key(name[1:])
+        if key is None:
+            raise AttributeError(name)
+        return self[key]
+
+    def __setattr__(self, name, value):
+        if not name.startswith("_"):
+            raise AttributeError(name)
+        self[self.__find_key(name[1:]) or name[1:].capitalize()] = value
+
+    def __find_key(self, field):
+        field = field.lower()
+        for key in self.keys():
+            if key.lower() == field:
+                return key
+        return None
+
+
+class FakeDepot(object):
+    """
+    The state of a fake Perforce server - files & revisions, changes, users, workspaces,
+    have lists and opened files.  Any number of FakeP4 connections can share the same
+    depot, e.g. a connection pool or connections for several users.
+    """
+
+    def __init__(self, server_version="2015.1", case_sensitive=True, server_id="", unicode=False):
+        """
+        Construction
+
+        :param server_version:  The version reported by 'p4 info', e.g. "2015.1"
+        :param case_sensitive:  Whether the server reports itself as case-sensitive
+        :param server_id:       The server id reported by 'p4 info'
+        :param unicode:         Whether the server reports itself as running in unicode mode
+        """
+        self.server_version = server_version
+        self.case_sensitive = case_sensitive
+        self.server_id = server_id
+        self.unicode = unicode
+
+        # depot path -> list of FileRevision, oldest first:
+        self.files = {}
+        # (depot path, rev) -> {attribute name: value}:
+        self.attributes = {}
+        # change id (int) -> FakeChange:
+        self.changes = {}
+        # user name -> user record:
+        self.users = {}
+        # client name -> client spec:
+        self.clients = {}
+        # client name -> {depot path: have rev}:
+        self.have = {}
+        # depot path -> {client name: OpenedFile}:
+        self.opened = {}
+        # counter names -> values:
+        self.counters = {}
+
+        self.next_change = 1
+        self.lock = threading.RLock()
+        self._sorted_paths = None
+
+    def add_user(self, user, full_name=None, email=None):
+        """
+        Add a user to the server
+        """
+        with self.lock:
+            self.users[user] = {"User": user, "FullName": full_name or user,
+                                "Email": email or "%s@example.com" % user,
+                                "Update": str(int(time.time())), "Access": str(int(time.time()))}
+
+    def add_client(self, client, user, root, view=None, host="", alt_roots=None):
+        """
+        Add a workspace to the server
+
+        :param client:      The name of the workspace
+        :param user:        The owner of the workspace
+        :param root:        The local root of the workspace
+        :param view:        List of view lines.  Defaults to mapping the whole depot
+        :param host:        Optional host the workspace is restricted to
+        :param alt_roots:   Optional list of alternate roots
+        :returns:           The client spec
+        """
+        spec = FakeSpec({"Client": client, "Owner": user, "Host": host, "Root": root,
+                         "Options": "noallwrite noclobber nocompress unlocked nomodtime normdir",
+                         "SubmitOptions": "submitunchanged", "LineEnd": "local",
+                         "Description": "Created by %s.\n" % user,
+                         "View": list(view or ["//depot/... //%s/..." % client]),
+                         "Update": str(int(time.time())), "Access": str(int(time.time()))})
+        if alt_roots:
+            spec["AltRoots"] = list(alt_roots)
+        with self.lock:
+            self.clients[client] = spec
+            self.have.setdefault(client, {})
+        return spec
+
+    def submit(self, user, client, description, files, change_time=None):
+        """
+        Submit new revisions directly, without opening the files in a workspace.  This is
+        used to populate the depot.
+
+        :param user:        The user submitting the change
+        :param client:      The workspace the change is submitted from
+        :param description: The change description
+        :param files:       List of (depot path, action, type, size, attributes) tuples where
+                            attributes is a dictionary or None
+        :param change_time: The time of the change
+        :returns:           The id of the submitted change
+        """
+        with self.lock:
+            change = self.new_change(user, client, description, "submitted", change_time)
+            for depot_path, action, file_type, size, attributes in files:
+                revisions = self.files.setdefault(depot_path, [])
+                rev = len(revisions) + 1
+                revisions.append(FileRevision(rev, change.change, action, file_type, change.time, size,
+                                              "%032X" % abs(hash((depot_path, rev)))))
+                if attributes:
+                    self.attributes[(depot_path, rev)] = dict(attributes)
+                change.revisions.append((depot_path, rev))
+                if rev == 1:
+                    self._sorted_paths = None
+            return change.change
+
+    def new_change(self, user, client, description, status="pending", change_time=None):
+        """
+        :returns:   A new FakeChange with the next change id
+        """
+        with self.lock:
+            change = FakeChange(self.next_change, user, client, description, status, change_time)
+            self.changes[change.change] = change
+            self.next_change += 1
+            return change
+
+    def head(self, depot_path):
+        """
+        :returns:   The head FileRevision of the file or None if it isn't in the depot
+        """
+        revisions = self.files.get(depot_path)
+        return revisions[-1] if revisions else None
+
+    def revision(self, depot_path, rev_spec=None, have_rev=None):
+        """
+        :param depot_path:  The depot path of the file
+        :param rev_spec:    Revision specifier, e.g. "#3", "#head", "#have", "@123", "@=123"
+                            or None for the head revision
+        :param have_rev:    The revision in the have list, used for "#have"
+        :returns:           The FileRevision for the revision specifier or None
+        """
+        revisions = self.files.get(depot_path)
+        if not revisions:
+            return None
+        if not rev_spec or rev_spec == "#head":
+            return revisions[-1]
+        if rev_spec == "#have":
+            return revisions[have_rev - 1] if have_rev else None
+        if rev_spec == "#none" or rev_spec == "#0":
+            return None
+        if rev_spec.startswith("#"):
+            rev = int(rev_spec[1:])
+            return revisions[min(rev, len(revisions)) - 1] if rev > 0 else None
+        if rev_spec.startswith("@="):
+            change = int(rev_spec[2:])
+            for revision in revisions:
+                if revision.change == change:
+                    return revision
+            return None
+        if rev_spec.startswith("@"):
+            change = int(rev_spec[1:])
+            found = None
+            for revision in revisions:
+                if revision.change > change:
+                    break
+                found = revision
+            return found
+        return None
+
+    def sorted_paths(self):
+        """
+        :returns:   A sorted list of all depot paths with at least one revision
+        """
+        with self.lock:
+            if self._sorted_paths is None:
+                self._sorted_paths = sorted(self.files.keys())
+            return self._sorted_paths
+
+    def find_paths(self, prefix):
+        """
+        :returns:   All depot paths, including files only opened for add, that start
+                    with the prefix
+        """
+        paths = self.sorted_paths()
+        if not self.case_sensitive:
+            prefix = prefix.lower()
+            found = [path for path in paths if path.lower().startswith(prefix)]
+            found.extend(path for path in self.opened if path.lower().startswith(prefix) and path not in self.files)
+            return found
+
+        start = bisect.bisect_left(paths, prefix)
+        found = []
+        for path in paths[start:]:
+            if not path.startswith(prefix):
+                break
+            found.append(path)
+        found.extend(path for path in self.opened if path.startswith(prefix) and path not in self.files)
+        return found
+
+    def stored_path(self, depot_path):
+        """
+        :returns:   The depot path in the case it is stored with.  This only differs from
+                    the path passed in if the server isn't case-sensitive
+        """
+        if self.case_sensitive or depot_path in self.files or depot_path in self.opened:
+            return depot_path
+        lower_path = depot_path.lower()
+        for path in itertools.chain(self.files, self.opened):
+            if path.lower() == lower_path:
+                return path
+        return depot_path
+
+
+class ClientView(object):
+    """
+    Maps paths through a workspace's root & view the way the server does, using P4.Map
+    directly.  This is kept independent of util.ClientPathMapper so that the fake server
+    can be used to check the framework's own mapping.  On servers that aren't
+    case-sensitive paths are matched by lower-casing them & the view, so translated
+    client & local paths are returned in lower case.
+    """
+
+    def __init__(self, spec, case_sensitive=True):
+        """
+        Construction
+
+        :param spec:            The client spec of the workspace
+        :param case_sensitive:  Whether the server is case-sensitive
+        """
+        self._case_sensitive = case_sensitive
+        self._client_prefix = self._fold("//%s/" % spec["Client"])
+        self._roots = []
+        for root in [spec.get("Root")] + list(spec.get("AltRoots") or []):
+            if root and root.lower() != "null":
+                self._roots.append(root.replace("\\", "/").rstrip("/"))
+        self._view = P4Map([self._fold(line) for line in spec.get("View", [])])
+        self._reverse_view = self._view.reverse()
+
+    def local_to_depot_path(self, local_path):
+        """
+        :returns:   The depot path the local path maps to or None
+        """
+        local_path = local_path.replace("\\", "/")
+        for root in self._roots:
+            if self._fold(local_path).startswith(self._fold(root) + "/"):
+                return self.client_to_depot_path(self._client_prefix + local_path[len(root) + 1:])
+        return None
+
+    def client_to_depot_path(self, client_path):
+        """
+        :returns:   The depot path the client syntax path maps to or None
+        """
+        return self._reverse_view.translate(self._fold(client_path))
+
+    def depot_to_client_path(self, depot_path):
+        """
+        :returns:   The client syntax path the depot path maps to or None
+        """
+        client_path = self._view.translate(self._fold(depot_path))
+        if not client_path or not client_path.startswith(self._client_prefix):
+            return None
+        return client_path
+
+    def depot_to_local_path(self, depot_path):
+        """
+        :returns:   The local path, under the workspace root, the depot path maps to or None
+        """
+        client_path = self.depot_to_client_path(depot_path)
+        if not client_path or not self._roots:
+            return None
+        return os.path.join(self._roots[0], *client_path[len(self._client_prefix):].split("/"))
+
+    def is_depot_path_mapped(self, depot_path):
+        """
+        :returns:   True if the depot path is mapped by the view
+        """
+        return self.depot_to_client_path(depot_path) is not None
+
+    def _fold(self, path):
+        """
+        :returns:   The path in the case it is matched in
+        """
+        return path if self._case_sensitive else path.lower()
+
+
+class FakeP4(object):
+    """
+    Pure-Python stand-in for a P4.P4 connection backed by a FakeDepot.  Commands are run
+    through run() or run_<command>() and specs through fetch_<spec>()/save_<spec>(), the
+    same as P4Python.  Every command counts as a round trip to the server and can be
+    given an artificial latency to simulate a remote server.
+    """
+
+    # the commands that are implemented, mapped to their handlers:
+    COMMANDS = ["add", "attribute", "change", "changes", "client", "clients", "configure", "counter",
+                "describe", "dirs", "edit", "files", "fstat", "have", "info", "login", "logout", "opened", "reopen",
+                "revert", "review", "shelve", "submit", "sync", "trust", "users", "where"]
+
+    def __init__(self, depot, latency=0.0, record_latency=0.0, command_latency=None):
+        """
+        Construction
+
+        :param depot:           The FakeDepot the connection is to
+        :param latency:         The time in seconds added to every command (round trip)
+        :param record_latency:  The time in seconds added for every record a command returns
+        :param command_latency: Optional dictionary of {command: latency} overriding the
+                                latency for specific commands
+        """
+        self.depot = depot
+        self.latency = latency
+        self.record_latency = record_latency
+        self.command_latency = dict(command_latency or {})
+        # the MaxResults limit of the user's group - commands returning more results than
+        # this fail the same as on a real server.  0 is unlimited:
+        self.max_results = 0
+
+        self.port = "fake:1666"
+        self.user = ""
+        self.client = ""
+        self.password = ""
+        self.host = ""
+        self.charset = "none"
+        self.cwd = ""
+        self.prog = "tk-framework-perforce"
+        self.exception_level = 2
+        self.api_level = 0
+        self.tagged = 1
+        self.progress = None
+        self.input = None
+
+        self.errors = []
+        self.warnings = []
+        self.messages = []
+
+        self.environment = {}
+        self.round_trips = 0
+        self.command_counts = {}
+
+        self._connected = False
+        self._mappers = {}
+
+    # ------------------------------------------------------------------------------------
+    # connection
+
+    def connect(self):
+        self._connected = True
+        return self
+
+    def disconnect(self):
+        self._connected = False
+
+    def connected(self):
+        return self._connected
+
+    def is_connected(self):
+        return self._connected
+
+    def env(self, var):
+        return self.environment.get(var)
+
+    def set_env(self, var, value):
+        self.environment[var] = value
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.disconnect()
+        return False
+
+    def reset_stats(self):
+        """
+        Reset the round trip and per-command counts
+        """
+        self.round_trips = 0
+        self.command_counts = {}
+
+    # ------------------------------------------------------------------------------------
+    # running commands
+
+    def run(self, command, *args):
+        """
+        Run a command, returning the list of (tagged) results the same as P4.run()
+
+        :raises:    P4Exception if the command reports errors (or warnings when the
+                    exception level is 2)
+        """
+        if not self._connected:
+            raise P4Exception("[P4.run()] not connected.")
+
+        self.errors = []
+        self.warnings = []
+        self.messages = []
+        args = _flatten(args)
+
+        self.round_trips += 1
+        self.command_counts[command] = self.command_counts.get(command, 0) + 1
+
+        handler = getattr(self, "_cmd_%s" % command, None) if command in FakeP4.COMMANDS else None
+        if not handler:
+            self.errors.append("Unknown command.  Try 'p4 help' for info.")
+            results = []
+        else:
+            with self.depot.lock:
+                results = handler(args)
+            self.input = None
+            if self.max_results and len(results) > self.max_results:
+                self.errors.append("Request too large (over %d); see 'p4 help maxresults'." % self.max_results)
+                results = []
+
+        latency = self.command_latency.get(command, self.latency) + self.record_latency * len(results)
+        if latency > 0:
+            time.sleep(latency)
+
+        if self.errors and self.exception_level >= 1:
+            raise P4Exception("[P4#run] Errors during command execution( \"p4 %s\" )\n\n\t[Error]: %s"
+                              % (" ".join([command] + args), self.errors))
+        if self.warnings and self.exception_level >= 2:
+            raise P4Exception("[P4#run] Warnings during command execution( \"p4 %s\" )\n\n\t[Warning]: %s"
+                              % (" ".join([command] + args), self.warnings))
+        return results
+
+    def __getattr__(self, name):
+        if name.startswith("run_"):
+            command = name[4:]
+            return lambda *args: self.run(command, *args)
+        if name.startswith("fetch_"):
+            spec_type = name[6:]
+            return lambda *args: self.run(spec_type, "-o", *args)[0]
+        if name.startswith("save_"):
+            spec_type = name[5:]
+            def save(spec, *args):
+                self.input = spec
+                return self.run(spec_type, "-i", *args)
+            return save
+        if name.startswith("delete_"):
+            spec_type = name[7:]
+            return lambda *args: self.run(spec_type, "-d", *args)
+        raise AttributeError(name)
+
+    # ------------------------------------------------------------------------------------
+    # path resolution
+
+    def _mapper(self, client=None):
+        """
+        :returns:   A ClientView for the workspace or None if it doesn't exist
+        """
+        client = client or self.client
+        spec = self.depot.clients.get(client)
+        if not spec:
+            return None
+        mapper_spec = self._mappers.get(client)
+        if not mapper_spec or mapper_spec[0] is not spec:
+            mapper_spec = (spec, ClientView(spec, self.depot.case_sensitive))
+            self._mappers[client] = mapper_spec
+        return mapper_spec[1]
+
+    def _resolve(self, path, must_map=True, must_exist=True):
+        """
+        Resolve a file argument to the depot paths it refers to
+
+        :param path:        A local, client or depot path, optionally with a trailing '...'
+                            or '/*' wildcard and/or a revision specifier
+        :param must_map:    If True then only files mapped in the workspace are returned
+        :param must_exist:  If True then only files in the depot or opened are returned
+        :returns:           List of (depot path, revision specifier) tuples.  Warnings are
+                            added for paths that don't resolve to anything
+        """
+        path, rev_spec = _split_revision(path)
+        mapper = self._mapper()
+
+        depot_path = None
+        if path.startswith("//"):
+            if mapper and path.startswith("//%s/" % self.client):
+                depot_path = mapper.client_to_depot_path(path)
+            else:
+                depot_path = path
+        elif mapper:
+            depot_path = mapper.local_to_depot_path(path)
+
+        if not depot_path:
+            self.warnings.append("%s - file(s) not in client view." % path)
+            return []
+
+        if depot_path.endswith("..."):
+            depot_paths = self.depot.find_paths(depot_path[:-3])
+        elif depot_path.endswith("/*"):
+            prefix = depot_path[:-1]
+            depot_paths = [p for p in self.depot.find_paths(prefix) if "/" not in p[len(prefix):]]
+        else:
+            depot_paths = [self.depot.stored_path(depot_path)]
+
+        if must_map and mapper:
+            depot_paths = [p for p in depot_paths if mapper.is_depot_path_mapped(p)]
+            if not depot_paths:
+                self.warnings.append("%s - file(s) not in client view." % path)
+                return []
+        if must_exist:
+            depot_paths = [p for p in depot_paths if p in self.depot.files or p in self.depot.opened]
+            if not depot_paths:
+                self.warnings.append("%s - no such file(s)." % path)
+                return []
+        return [(p, rev_spec) for p in depot_paths]
+
+    def _local_path(self, depot_path, client=None):
+        """
+        :returns:   The local path of the depot file in the workspace or None
+        """
+        mapper = self._mapper(client)
+        return mapper.depot_to_local_path(depot_path) if mapper else None
+
+    def _client_path(self, depot_path, client=None):
+        """
+        :returns:   The client syntax path of the depot file in the workspace or None
+        """
+        mapper = self._mapper(client)
+        return mapper.depot_to_client_path(depot_path) if mapper else None
+
+    def _our_opened(self, depot_path):
+        """
+        :returns:   The OpenedFile for the file in the current workspace or None
+        """
+        return self.depot.opened.get(depot_path, {}).get(self.client)
+
+    def _change_id(self, change):
+        """
+        :returns:   The change id as an int or "default"
+        """
+        return "default" if str(change) == "default" else int(change)
+
+    # ------------------------------------------------------------------------------------
+    # commands
+
+    def _cmd_info(self, args):
+        spec = self.depot.clients.get(self.client, {})
+        info = {"userName": self.user, "clientName": self.client or "*unknown*",
+                "clientHost": self.host, "clientRoot": spec.get("Root", ""),
+                "serverAddress": self.port, "serverRoot": "/fake/p4root",
+                "serverDate": time.strftime("%Y/%m/%d %H:%M:%S"),
+                "serverVersion": "P4D/FAKE/%s/1 (2015/01/01)" % self.depot.server_version,
+                "serverLicense": "none", "serverServices": "standard",
+                "caseHandling": "sensitive" if self.depot.case_sensitive else "insensitive"}
+        if self.depot.server_id:
+            info["serverID"] = self.depot.server_id
+        if self.depot.unicode:
+            info["unicode"] = "enabled"
+        return [info]
+
+    def _cmd_login(self, args):
+        if "-s" in args:
+            return [{"User": self.user, "TicketExpiration": "43200"}]
+        return ["User %s logged in." % self.user]
+
+    def _cmd_logout(self, args):
+        return ["User %s logged out." % self.user]
+
+    def _cmd_trust(self, args):
+        return []
+
+    def _cmd_configure(self, args):
+        return []
+
+    def _cmd_users(self, args):
+        opts, names = _parse_args(args, ["-m"])
+        users = [self.depot.users[u] for u in sorted(self.depot.users) if not names or u in names]
+        if "-m" in opts:
+            users = users[:int(opts["-m"])]
+        return [dict(u) for u in users]
+
+    def _cmd_counter(self, args):
+        opts, names = _parse_args(args, [])
+        if not names:
+            self.errors.append("Missing/wrong number of arguments.")
+            return []
+        name = names[0]
+        if "-d" in opts:
+            self.depot.counters.pop(name, None)
+            return [{"counter": name, "value": "0"}]
+        if len(names) > 1:
+            self.depot.counters[name] = str(names[1])
+        return [{"counter": name, "value": self.depot.counters.get(name, "0")}]
+
+    def _cmd_client(self, args):
+        opts, names = _parse_args(args, ["-t"])
+        if "-i" in opts:
+            spec = FakeSpec(self.input or {})
+            name = spec.get("Client")
+            if not name:
+                self.errors.append("Error in client specification.  Missing required field 'Client'.")
+                return []
+            self.depot.add_client(name, spec.get("Owner", self.user), spec.get("Root", ""), spec.get("View"),
+                                  spec.get("Host", ""), spec.get("AltRoots"))
+            self.depot.clients[name].update(dict((k, v) for k, v in spec.iteritems() if k != "Update"))
+            return ["Client %s saved." % name]
+        if "-d" in opts:
+            name = names[0] if names else self.client
+            self.depot.clients.pop(name, None)
+            self.depot.have.pop(name, None)
+            return ["Client %s deleted." % name]
+
+        name = names[0] if names else self.client
+        spec = self.depot.clients.get(name)
+        if spec:
+            return [FakeSpec(copy.deepcopy(dict(spec)))]
+        return [FakeSpec({"Client": name, "Owner": self.user, "Host": self.host, "Root": self.cwd or "/",
+                          "Options": "noallwrite noclobber nocompress unlocked nomodtime normdir",
+                          "SubmitOptions": "submitunchanged", "LineEnd": "local",
+                          "Description": "Created by %s.\n" % self.user,
+                          "View": ["//depot/... //%s/..." % name]})]
+
+    def _cmd_clients(self, args):
+        opts, _ = _parse_args(args, ["-u", "-e", "-E", "-m"])
+        results = []
+        for name in sorted(self.depot.clients):
+            spec = self.depot.clients[name]
+            if "-u" in opts and spec.get("Owner") != opts["-u"]:
+                continue
+            if "-e" in opts and not fnmatch.fnmatchcase(name, opts["-e"]):
+                continue
+            if "-E" in opts and not fnmatch.fnmatch(name.lower(), opts["-E"].lower()):
+                continue
+            results.append({"client": name, "Owner": spec.get("Owner", ""), "Host": spec.get("Host", ""),
+                            "Root": spec.get("Root", ""), "Options": spec.get("Options", ""),
+                            "Description": spec.get("Description", ""),
+                            "Update": spec.get("Update", "0"), "Access": spec.get("Access", "0")})
+            if "-m" in opts and len(results) >= int(opts["-m"]):
+                break
+        return results
+
+    def _cmd_fstat(self, args):
+        opts, paths = _parse_args(args, ["-T", "-F", "-e", "-m", "-A"])
+        fields = [f.strip() for f in opts["-T"].replace(",", " ").split()] if "-T" in opts else None
+        filters = _parse_filter(opts.get("-F", ""))
+        include_attributes = any(flag.startswith("-O") and "a" in flag[2:] for flag in opts)
+        hex_attributes = any(flag.startswith("-O") and "e" in flag[2:] for flag in opts)
+        attribute_pattern = opts.get("-A")
+        opened_only = any(flag.startswith("-R") and "o" in flag[2:] for flag in opts)
+        change_filter = opts.get("-e")
+        max_results = int(opts["-m"]) if "-m" in opts else None
+
+        results = []
+        for path in paths:
+            for depot_path, rev_spec in self._resolve(path, must_map=False):
+                opened = self._our_opened(depot_path)
+                if opened_only and not opened:
+                    continue
+                if change_filter and (not opened or str(opened.change) != str(change_filter)):
+                    continue
+                record = self._fstat_record(depot_path, rev_spec, include_attributes)
+                if record is None or not _matches_filter(record, filters):
+                    continue
+                if include_attributes and (attribute_pattern or hex_attributes):
+                    record = _filter_attributes(record, attribute_pattern, hex_attributes)
+                if fields is not None:
+                    record = dict((k, v) for k, v in record.iteritems() if k in fields)
+                    if not record:
+                        continue
+                results.append(record)
+                if max_results and len(results) >= max_results:
+                    return results
+        return results
+
+    def _fstat_record(self, depot_path, rev_spec, include_attributes):
+        """
+        :returns:   The full fstat record for the file at the revision
+        """
+        record = {"depotFile": depot_path}
+        local_path = self._local_path(depot_path)
+        if local_path:
+            record["clientFile"] = local_path
+            record["isMapped"] = ""
+
+        have_rev = self.depot.have.get(self.client, {}).get(depot_path)
+        revision = self.depot.revision(depot_path, rev_spec, have_rev)
+        if revision:
+            record.update({"headAction": revision.action, "headType": revision.type,
+                           "headTime": str(revision.time), "headRev": str(revision.rev),
+                           "headChange": str(revision.change), "headModTime": str(revision.time)})
+            if revision.action not in DELETE_ACTIONS:
+                record["fileSize"] = str(revision.size)
+                record["digest"] = revision.digest
+            if include_attributes:
+                for name, value in self.depot.attributes.get((depot_path, revision.rev), {}).iteritems():
+                    record["attr-%s" % name] = value
+        elif rev_spec and depot_path in self.depot.files:
+            # the revision requested doesn't exist:
+            return None
+        if have_rev:
+            record["haveRev"] = str(have_rev)
+
+        others = []
+        for client, opened in sorted(self.depot.opened.get(depot_path, {}).iteritems()):
+            if client == self.client:
+                record["action"] = opened.action
+                record["change"] = str(opened.change)
+                record["type"] = opened.type
+                record["actionOwner"] = opened.user
+                record["workRev"] = str(opened.work_rev)
+                if include_attributes:
+                    for name, value in opened.attributes.iteritems():
+                        record["openattr-%s" % name] = value
+            else:
+                others.append(opened)
+        if others:
+            record["otherOpen"] = ["%s@%s" % (o.user, o.client) for o in others]
+            record["otherAction"] = [o.action for o in others]
+            record["otherChange"] = [str(o.change) for o in others]
+            record["otherOpens"] = str(len(others))
+        if not revision and "action" not in record and not others:
+            return None
+        return record
+
+    def _cmd_sync(self, args):
+        opts, paths = _parse_args(args, [])
+        preview = "-n" in opts
+        have = self.depot.have.setdefault(self.client, {})
+
+        results = []
+        for path in paths or ["//%s/..." % self.client]:
+            for depot_path, rev_spec in self._resolve(path):
+                revision = self.depot.revision(depot_path, rev_spec, have.get(depot_path))
+                target = revision.rev if revision and revision.action not in DELETE_ACTIONS else None
+                current = have.get(depot_path)
+                if target == current and "-f" not in opts:
+                    self.warnings.append("%s - file(s) up-to-date." % path)
+                    continue
+                action = "deleted" if target is None else ("added" if current is None else "updated")
+                if not preview:
+                    if target is None:
+                        have.pop(depot_path, None)
+                    else:
+                        have[depot_path] = target
+                record = {"depotFile": depot_path, "clientFile": self._local_path(depot_path),
+                          "rev": str(revision.rev if revision else 0), "action": action}
+                if revision and target is not None:
+                    record["fileSize"] = str(revision.size)
+                results.append(record)
+        return results
+
+    def _cmd_have(self, args):
+        _, paths = _parse_args(args, [])
+        have = self.depot.have.get(self.client, {})
+        if not paths:
+            depot_paths = sorted(have)
+        else:
+            depot_paths = [p for path in paths for p, _ in self._resolve(path) if p in have]
+        return [{"depotFile": p, "clientFile": self._client_path(p), "path": self._local_path(p),
+                 "haveRev": str(have[p])} for p in depot_paths]
+
+    def _cmd_dirs(self, args):
+        # only depot paths of the form //depot/dir/* are supported:
+        _, paths = _parse_args(args, [])
+        results = []
+        for path in paths:
+            path, _ = _split_revision(path)
+            if not path.startswith("//") or not path.endswith("/*"):
+                self.errors.append("%s - dirs only supports depot paths ending in '/*'." % path)
+                continue
+            prefix = path[:-1]
+            dirs = set()
+            for depot_path in self.depot.find_paths(prefix):
+                remainder = depot_path[len(prefix):]
+                if "/" in remainder:
+                    dirs.add(prefix + remainder.split("/", 1)[0])
+            if not dirs:
+                self.warnings.append("%s - no such file(s)." % path)
+            results.extend({"dir": d} for d in sorted(dirs))
+        return results
+
+    def _cmd_files(self, args):
+        _, paths = _parse_args(args, ["-m"])
+        results = []
+        for path in paths:
+            found = False
+            for depot_path, rev_spec in self._resolve(path, must_map=False):
+                revision = self.depot.revision(depot_path, rev_spec)
+                if revision:
+                    found = True
+                    results.append({"depotFile": depot_path, "rev": str(revision.rev),
+                                    "change": str(revision.change), "action": revision.action,
+                                    "type": revision.type, "time": str(revision.time)})
+            if not found:
+                self.warnings.append("%s - no such file(s)." % path)
+        return results
+
+    def _cmd_where(self, args):
+        _, paths = _parse_args(args, [])
+        results = []
+        for path in paths:
+            for depot_path, _ in self._resolve(path, must_exist=False):
+                results.append({"depotFile": depot_path, "clientFile": self._client_path(depot_path),
+                                "path": self._local_path(depot_path)})
+        return results
+
+    def _cmd_edit(self, args):
+        opts, paths = _parse_args(args, ["-c", "-t"])
+        change = self._change_id(opts.get("-c", "default"))
+        have = self.depot.have.get(self.client, {})
+
+        results = []
+        for path in paths:
+            for depot_path, _ in self._resolve(path):
+                head = self.depot.head(depot_path)
+                if self._our_opened(depot_path):
+                    self.warnings.append("%s - currently opened for %s"
+                                         % (path, self._our_opened(depot_path).action))
+                    continue
+                if not head or head.action in DELETE_ACTIONS or depot_path not in have:
+                    self.errors.append("%s - file(s) not on client." % path)
+                    continue
+                opened = OpenedFile(depot_path, self.client, self.user, "edit", change,
+                                    opts.get("-t", head.type), have[depot_path])
+                self.depot.opened.setdefault(depot_path, {})[self.client] = opened
+                results.append(self._opened_record(opened))
+        return results
+
+    def _cmd_add(self, args):
+        opts, paths = _parse_args(args, ["-c", "-t"])
+        change = self._change_id(opts.get("-c", "default"))
+
+        results = []
+        for path in paths:
+            for depot_path, _ in self._resolve(path, must_exist=False):
+                head = self.depot.head(depot_path)
+                if self._our_opened(depot_path):
+                    self.warnings.append("%s - currently opened for %s"
+                                         % (path, self._our_opened(depot_path).action))
+                    continue
+                if head and head.action not in DELETE_ACTIONS:
+                    self.warnings.append("%s - can't add existing file" % path)
+                    continue
+                opened = OpenedFile(depot_path, self.client, self.user, "add", change,
+                                    opts.get("-t", "binary"), head.rev + 1 if head else 1)
+                self.depot.opened.setdefault(depot_path, {})[self.client] = opened
+                results.append(self._opened_record(opened))
+        return results
+
+    def _cmd_revert(self, args):
+        opts, paths = _parse_args(args, ["-c"])
+        change = opts.get("-c")
+
+        results = []
+        for path in paths:
+            for depot_path, _ in self._resolve(path):
+                opened = self._our_opened(depot_path)
+                if not opened or (change and str(opened.change) != str(change)):
+                    continue
+                del self.depot.opened[depot_path][self.client]
+                if not self.depot.opened[depot_path]:
+                    del self.depot.opened[depot_path]
+                record = self._opened_record(opened)
+                record["oldAction"] = opened.action
+                record["action"] = "abandoned" if opened.action == "add" else "reverted"
+                results.append(record)
+        if not results and paths:
+            self.warnings.append("%s - file(s) not opened on this client." % paths[0])
+        return results
+
+    def _cmd_reopen(self, args):
+        opts, paths = _parse_args(args, ["-c", "-t"])
+        results = []
+        for path in paths:
+            for depot_path, _ in self._resolve(path):
+                opened = self._our_opened(depot_path)
+                if not opened:
+                    self.warnings.append("%s - file(s) not opened on this client." % path)
+                    continue
+                if "-c" in opts:
+                    opened.change = self._change_id(opts["-c"])
+                if "-t" in opts:
+                    opened.type = opts["-t"]
+                results.append(self._opened_record(opened))
+        return results
+
+    def _cmd_opened(self, args):
+        opts, paths = _parse_args(args, ["-c", "-C", "-u", "-m"])
+        client = opts.get("-C", None if "-a" in opts else self.client)
+        if paths:
+            depot_paths = [p for path in paths for p, _ in self._resolve(path, must_map=False)]
+        else:
+            depot_paths = sorted(self.depot.opened)
+
+        results = []
+        for depot_path in depot_paths:
+            for opened_client, opened in sorted(self.depot.opened.get(depot_path, {}).iteritems()):
+                if client and opened_client != client:
+                    continue
+                if "-u" in opts and opened.user != opts["-u"]:
+                    continue
+                if "-c" in opts and str(opened.change) != str(opts["-c"]):
+                    continue
+                results.append(self._opened_record(opened, client_syntax=True))
+                if "-m" in opts and len(results) >= int(opts["-m"]):
+                    return results
+        return results
+
+    def _opened_record(self, opened, client_syntax=False):
+        """
+        :returns:   The tagged record for an opened file
+        """
+        client_file = (self._client_path(opened.depot_path, opened.client) if client_syntax
+                       else self._local_path(opened.depot_path, opened.client))
+        return {"depotFile": opened.depot_path, "clientFile": client_file, "workRev": str(opened.work_rev),
+                "rev": str(opened.work_rev), "haveRev": str(opened.work_rev - 1 if opened.action == "add"
+                                                             else opened.work_rev),
+                "action": opened.action, "change": str(opened.change), "type": opened.type,
+                "user": opened.user, "client": opened.client}
+
+    def _cmd_attribute(self, args):
+        opts, paths = _parse_args(args, ["-n", "-v"])
+        name = opts.get("-n")
+        if not name:
+            self.errors.append("Missing/wrong number of arguments.")
+            return []
+        value = opts.get("-v")
+
+        results = []
+        for path in paths:
+            for depot_path, rev_spec in self._resolve(path):
+                opened = self._our_opened(depot_path)
+                if "-f" in opts:
+                    head = self.depot.revision(depot_path, rev_spec)
+                    if not head:
+                        self.warnings.append("%s - no such file(s)." % path)
+                        continue
+                    attributes = self.depot.attributes.setdefault((depot_path, head.rev), {})
+                elif opened:
+                    attributes = opened.attributes
+                else:
+                    self.errors.append("%s - file(s) not opened on this client." % path)
+                    continue
+                if value is None:
+                    attributes.pop(name, None)
+                else:
+                    attributes[name] = value
+                results.append({"depotFile": depot_path, "attr": name, "status": "set" if value is not None
+                                else "cleared"})
+        return results
+
+    def _cmd_change(self, args):
+        opts, names = _parse_args(args, ["-t"])
+        if "-i" in opts:
+            spec = dict(self.input or {})
+            change_id = str(spec.get("Change", "new"))
+            files = spec.get("Files") or []
+            if change_id == "new":
+                change = self.depot.new_change(spec.get("User") or self.user, spec.get("Client") or self.client,
+                                               spec.get("Description", ""))
+            else:
+                change = self.depot.changes.get(int(change_id))
+                if not change:
+                    self.errors.append("Change %s unknown." % change_id)
+                    return []
+                change.description = spec.get("Description", change.description)
+            moved = 0
+            for depot_path in files:
+                opened = self._our_opened(depot_path)
+                if opened:
+                    opened.change = change.change
+                    moved += 1
+            if change_id == "new":
+                if moved:
+                    return ["Change %d created with %d open file(s)." % (change.change, moved)]
+                return ["Change %d created." % change.change]
+            return ["Change %d updated." % change.change]
+        if "-d" in opts:
+            change = self.depot.changes.get(int(names[0])) if names else None
+            if not change or change.status != "pending":
+                self.errors.append("Change %s unknown." % (names[0] if names else ""))
+                return []
+            del self.depot.changes[change.change]
+            return ["Change %d deleted." % change.change]
+
+        if names:
+            change = self.depot.changes.get(int(names[0]))
+            if not change:
+                self.errors.append("Change %s unknown." % names[0])
+                return []
+            files = [p for p, _ in change.revisions] or [o.depot_path for o in self._opened_in(change.change)]
+            return [FakeSpec({"Change": str(change.change), "Client": change.client, "User": change.user,
+                              "Status": change.status, "Description": change.description,
+                              "Date": time.strftime("%Y/%m/%d %H:%M:%S", time.localtime(change.time)),
+                              "Files": files})]
+        return [FakeSpec({"Change": "new", "Client": self.client, "User": self.user, "Status": "new",
+                          "Description": "<enter description here>\n",
+                          "Files": [o.depot_path for o in self._opened_in("default")]})]
+
+    def _opened_in(self, change, client=None):
+        """
+        :returns:   List of OpenedFile for the files opened in the change in the workspace
+        """
+        client = client or self.client
+        opened_files = []
+        for depot_path in sorted(self.depot.opened):
+            opened = self.depot.opened[depot_path].get(client)
+            if opened and str(opened.change) == str(change):
+                opened_files.append(opened)
+        return opened_files
+
+    def _cmd_changes(self, args):
+        opts, paths = _parse_args(args, ["-s", "-u", "-c", "-m", "-e"])
+        min_change = int(opts["-e"]) if "-e" in opts else 0
+        depot_prefixes = None
+        if paths:
+            depot_prefixes = []
+            for path in paths:
+                path, _ = _split_revision(path)
+                depot_prefixes.append(path[:-3] if path.endswith("...") else path)
+
+        results = []
+        for change_id in sorted(self.depot.changes, reverse=True):
+            change = self.depot.changes[change_id]
+            if change_id < min_change:
+                break
+            if "-s" in opts and change.status != opts["-s"]:
+                continue
+            if "-u" in opts and change.user != opts["-u"]:
+                continue
+            if "-c" in opts and change.client != opts["-c"]:
+                continue
+            if depot_prefixes is not None and not any(p.startswith(prefix) for p, _ in change.revisions
+                                                      for prefix in depot_prefixes):
+                continue
+            desc = change.description if "-l" in opts or "-L" in opts else change.description[:31]
+            results.append({"change": str(change_id), "time": str(change.time), "user": change.user,
+                            "client": change.client, "desc": desc, "status": change.status,
+                            "changeType": "public"})
+            if "-m" in opts and len(results) >= int(opts["-m"]):
+                break
+        return results
+
+    def _cmd_review(self, args):
+        opts, _ = _parse_args(args, ["-c", "-t"])
+        start = 0
+        if "-t" in opts:
+            start = int(self.depot.counters.get(opts["-t"], "0")) + 1
+        elif "-c" in opts:
+            start = int(opts["-c"])
+        results = []
+        for change_id in sorted(self.depot.changes):
+            change = self.depot.changes[change_id]
+            if change_id < start or change.status != "submitted":
+                continue
+            user = self.depot.users.get(change.user, {})
+            results.append({"change": str(change_id), "user": change.user, "email": user.get("Email", ""),
+                            "name": user.get("FullName", change.user)})
+        return results
+
+    def _cmd_describe(self, args):
+        opts, changes = _parse_args(args, [])
+        shelved = "-S" in opts
+
+        results = []
+        for change_id in changes:
+            try:
+                change = self.depot.changes.get(int(change_id))
+            except ValueError:
+                change = None
+            if not change:
+                self.errors.append("%s - no such changelist." % change_id)
+                continue
+            record = {"change": str(change.change), "user": change.user, "client": change.client,
+                      "time": str(change.time), "desc": change.description, "status": change.status,
+                      "changeType": "public"}
+            files = []
+            if shelved:
+                for depot_path in sorted(change.shelved):
+                    opened = change.shelved[depot_path]
+                    files.append((depot_path, opened.work_rev, opened.action, opened.type, None))
+            elif change.status == "submitted":
+                for depot_path, rev in change.revisions:
+                    revision = self.depot.files[depot_path][rev - 1]
+                    files.append((depot_path, rev, revision.action, revision.type, revision))
+            else:
+                for opened in self._opened_in(change.change, change.client):
+                    files.append((opened.depot_path, opened.work_rev, opened.action, opened.type, None))
+            if files:
+                record["depotFile"] = [f[0] for f in files]
+                record["rev"] = [str(f[1]) for f in files]
+                record["action"] = [f[2] for f in files]
+                record["type"] = [f[3] for f in files]
+                if all(f[4] for f in files):
+                    record["fileSize"] = [str(f[4].size) for f in files]
+                    record["digest"] = [f[4].digest for f in files]
+            if shelved:
+                record["shelved"] = ""
+            results.append(record)
+        return results
+
+    def _cmd_shelve(self, args):
+        opts, _ = _parse_args(args, ["-c"])
+        change = self.depot.changes.get(int(opts.get("-c", 0)))
+        if not change:
+            self.errors.append("Change %s unknown." % opts.get("-c"))
+            return []
+        if "-d" in opts:
+            change.shelved = {}
+            return ["Shelved change %d deleted." % change.change]
+
+        opened_files = self._opened_in(change.change)
+        if not opened_files:
+            self.errors.append("No files to shelve.")
+            return []
+        results = [{"change": str(change.change)}]
+        for opened in opened_files:
+            shelved = copy.copy(opened)
+            shelved.attributes = dict(opened.attributes)
+            change.shelved[opened.depot_path] = shelved
+            results.append({"depotFile": opened.depot_path, "rev": str(opened.work_rev), "action": opened.action})
+        return results
+
+    def _cmd_submit(self, args):
+        opts, _ = _parse_args(args, ["-c", "-e", "-d"])
+        if "-e" in opts:
+            change = self.depot.changes.get(int(opts["-e"]))
+            if not change or not change.shelved:
+                self.errors.append("No shelved files in change to submit.")
+                return []
+            to_submit = [change.shelved[p] for p in sorted(change.shelved)]
+            change.shelved = {}
+        else:
+            if "-c" in opts:
+                change = self.depot.changes.get(int(opts["-c"]))
+                if not change:
+                    self.errors.append("Change %s unknown." % opts["-c"])
+                    return []
+                to_submit = self._opened_in(change.change)
+            else:
+                to_submit = self._opened_in("default")
+                change = self.depot.new_change(self.user, self.client, opts.get("-d", ""))
+            if not to_submit:
+                self.errors.append("No files to submit.")
+                return []
+
+        # renumber the change if any changes were created after it:
+        if change.change != self.depot.next_change - 1:
+            del self.depot.changes[change.change]
+            change.change = self.depot.next_change
+            self.depot.changes[change.change] = change
+            self.depot.next_change += 1
+
+        change.status = "submitted"
+        change.time = int(time.time())
+        results = [{"change": str(change.change), "openFiles": str(len(to_submit)), "locked": str(len(to_submit))}]
+        have = self.depot.have.setdefault(change.client, {})
+        for opened in to_submit:
+            revisions = self.depot.files.setdefault(opened.depot_path, [])
+            rev = len(revisions) + 1
+            action = opened.action
+            revisions.append(FileRevision(rev, change.change, action, opened.type, change.time, 0,
+                                          "%032X" % abs(hash((opened.depot_path, rev)))))
+            if opened.attributes:
+                self.depot.attributes[(opened.depot_path, rev)] = dict(opened.attributes)
+            change.revisions.append((opened.depot_path, rev))
+            have[opened.depot_path] = rev
+            clients = self.depot.opened.get(opened.depot_path, {})
+            if clients.get(opened.client) is opened:
+                del clients[opened.client]
+                if not clients:
+                    del self.depot.opened[opened.depot_path]
+            results.append({"depotFile": opened.depot_path, "rev": str(rev), "action": action})
+        self.depot._sorted_paths = None
+        results.append({"submittedChange": str(change.change)})
+        return results
+
+
+def _flatten(args):
+    """
+    :returns:   The arguments flattened into a single list of strings
+    """
+    flat = []
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            flat.extend(_flatten(arg))
+        else:
+            flat.append(str(arg))
+    return flat
+
+def _filter_attributes(record, pattern, hex_encode):
+    """
+    Apply the fstat -A & -Oe flags to the attributes in a record
+
+    :param record:      The fstat record
+    :param pattern:     Only attributes whose names match this pattern are kept or None to
+                        keep all attributes
+    :param hex_encode:  If True then attribute values are hex encoded
+    :returns:           The filtered record
+    """
+    filtered = {}
+    for field, value in record.iteritems():
+        if field.startswith(("attr-", "attrProp-", "openattr-", "openattrProp-")):
+            if pattern and not fnmatch.fnmatchcase(field.split("-", 1)[1], pattern):
+                continue
+            if hex_encode:
+                value = binascii.hexlify(value).upper()
+        filtered[field] = value
+    return filtered
+
+def _parse_args(args, value_flags):
+    """
+    Split command arguments into flags and file/name arguments
+
+    :param args:        The flattened list of arguments
+    :param value_flags: The flags that take a value
+    :returns:           Tuple (dictionary of flag -> value or True, list of other arguments)
+    """
+    opts = {}
+    others = []
+    ai = 0
+    while ai < len(args):
+        arg = args[ai]
+        if arg.startswith("--"):
+            opts[arg.split("=")[0]] = arg.split("=", 1)[1] if "=" in arg else True
+        elif arg.startswith("-") and len(arg) > 1:
+            if arg in value_flags and ai + 1 < len(args):
+                opts[arg] = args[ai + 1]
+                ai += 1
+            elif arg[:2] in value_flags and len(arg) > 2:
+                opts[arg[:2]] = arg[2:]
+            else:
+                opts[arg] = True
+        else:
+            others.append(arg)
+        ai += 1
+    return opts, others
+
+def _split_revision(path):
+    """
+    :returns:   Tuple (path, revision specifier or None)
+    """
+    sep = path.rfind("/")
+    for marker in ("#", "@"):
+        pos = path.find(marker, sep + 1)
+        if pos != -1:
+            return path[:pos], path[pos:]
+    return path, None
+
+def _parse_filter(filter_str):
+    """
+    Parse a simple fstat -F filter expression: space separated terms of the form
+    [^]field=value that must all match.  '*' in a value matches anything.
+
+    :returns:   List of (negated, field, value) tuples
+    """
+    terms = []
+    for term in filter_str.split():
+        negated = term.startswith("^")
+        field, _, value = term.lstrip("^").partition("=")
+        terms.append((negated, field, value))
+    return terms
+
+def _matches_filter(record, terms):
+    """
+    :returns:   True if the fstat record matches all of the filter terms
+    """
+    for negated, field, value in terms:
+        record_value = record.get(field)
+        if isinstance(record_value, list):
+            matched = any(fnmatch.fnmatchcase(v, value) for v in record_value)
+        else:
+            matched = record_value is not None and fnmatch.fnmatchcase(record_value, value)
+        if matched == negated:
+            return False
+    return True
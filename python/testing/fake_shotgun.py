@@ -0,0 +1,235 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+In-process stand-in for the subset of the Shotgun API used when registering publishes,
+so that publish ingestion can be exercised without a Shotgun site.  Entities are kept
+in memory and uploads are only recorded.
+"""
+
+import copy
+import os
+import threading
+import time
+
+
+class FakeShotgunError(Exception):
+    """
+    Raised for requests the fake site rejects
+    """
+
+
+class FakeShotgun(object):
+    """
+    Implements find, find_one, create, update, delete, batch, upload & upload_thumbnail
+    against an in-memory store of entities.  Filters support the 'is', 'is_not' & 'in'
+    relations on top level fields - multi-entity fields match if any of their entities
+    match.  Uploads set the uploaded field of the entity.  Each call counts as one round trip and can be given
+    an artificial latency to simulate a remote site.
+    """
+
+    def __init__(self, latency=0.0):
+        """
+        Construction
+
+        :param latency: The time in seconds added to every call (round trip)
+        """
+        self.latency = latency
+        # entity type -> {id: entity dictionary}:
+        self.entities = {}
+        # list of (entity type, id, path, field name) for every upload:
+        self.uploads = []
+        # if set, the next call to batch() raises this exception without making any
+        # changes, e.g. to test that failed registrations are retried:
+        self.batch_error = None
+
+        self.round_trips = 0
+        self.call_counts = {}
+        self._next_id = 1
+        self._lock = threading.RLock()
+
+    def add_entity(self, entity_type, **fields):
+        """
+        Add an entity directly, without counting a round trip.  This is used to populate
+        the site.
+
+        :returns:   The entity dictionary ({"type", "id"} plus the fields)
+        """
+        with self._lock:
+            return self._create(entity_type, fields, None)
+
+    def find(self, entity_type, filters, fields=None, order=None, limit=0):
+        self._call("find")
+        with self._lock:
+            results = []
+            for entity_id in sorted(self.entities.get(entity_type, {})):
+                entity = self.entities[entity_type][entity_id]
+                if all(_matches(entity, f) for f in filters or []):
+                    results.append(_project(entity, fields))
+                    if limit and len(results) >= limit:
+                        break
+            return results
+
+    def find_one(self, entity_type, filters, fields=None, order=None):
+        results = self.find(entity_type, filters, fields, order, limit=1)
+        return results[0] if results else None
+
+    def create(self, entity_type, data, return_fields=None):
+        self._call("create")
+        with self._lock:
+            return self._create(entity_type, data, return_fields)
+
+    def update(self, entity_type, entity_id, data):
+        self._call("update")
+        with self._lock:
+            return self._update(entity_type, entity_id, data)
+
+    def delete(self, entity_type, entity_id):
+        self._call("delete")
+        with self._lock:
+            return self.entities.get(entity_type, {}).pop(entity_id, None) is not None
+
+    def batch(self, requests):
+        """
+        Run a list of create, update & delete requests in a single round trip.  As with a
+        real site, either all requests succeed or none are applied.
+        """
+        self._call("batch")
+        with self._lock:
+            if self.batch_error is not None:
+                error, self.batch_error = self.batch_error, None
+                raise error
+            snapshot = copy.deepcopy((self.entities, self._next_id))
+            try:
+                results = []
+                for request in requests:
+                    request_type = request.get("request_type")
+                    entity_type = request.get("entity_type")
+                    if request_type == "create":
+                        results.append(self._create(entity_type, request.get("data", {}),
+                                                    request.get("return_fields")))
+                    elif request_type == "update":
+                        results.append(self._update(entity_type, request["entity_id"], request.get("data", {})))
+                    elif request_type == "delete":
+                        results.append(self.entities.get(entity_type, {}).pop(request["entity_id"], None)
+                                       is not None)
+                    else:
+                        raise FakeShotgunError("Unknown batch request type '%s'" % request_type)
+                return results
+            except Exception:
+                self.entities, self._next_id = snapshot
+                raise
+
+    def upload(self, entity_type, entity_id, path, field_name=None, display_name=None, tag_list=None):
+        self._call("upload")
+        with self._lock:
+            self.uploads.append((entity_type, entity_id, path, field_name))
+            attachment_id = self._next_attachment_id()
+            self._set_uploaded(entity_type, entity_id, field_name,
+                               {"type": "Attachment", "id": attachment_id, "name": os.path.basename(path)})
+            return attachment_id
+
+    def upload_thumbnail(self, entity_type, entity_id, path, **kwargs):
+        self._call("upload_thumbnail")
+        with self._lock:
+            self.uploads.append((entity_type, entity_id, path, "image"))
+            attachment_id = self._next_attachment_id()
+            self._set_uploaded(entity_type, entity_id, "image", "https://fake.shotgun/thumbnail/%d" % attachment_id)
+            return attachment_id
+
+    def _call(self, name):
+        """
+        Count a call and wait for the latency
+        """
+        with self._lock:
+            self.round_trips += 1
+            self.call_counts[name] = self.call_counts.get(name, 0) + 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def _create(self, entity_type, data, return_fields):
+        """
+        :returns:   The newly created entity
+        """
+        entity_id = self._next_id
+        self._next_id += 1
+        entity = copy.deepcopy(dict(data))
+        entity.update({"type": entity_type, "id": entity_id})
+        self.entities.setdefault(entity_type, {})[entity_id] = entity
+        return _project(entity, list(data.keys()) + list(return_fields or []))
+
+    def _update(self, entity_type, entity_id, data):
+        """
+        :returns:   The updated entity
+        """
+        entity = self.entities.get(entity_type, {}).get(entity_id)
+        if entity is None:
+            raise FakeShotgunError("%s %s does not exist" % (entity_type, entity_id))
+        entity.update(copy.deepcopy(dict(data)))
+        return _project(entity, data.keys())
+
+    def _set_uploaded(self, entity_type, entity_id, field_name, value):
+        """
+        Set the field an upload was made to on the entity, if it exists
+        """
+        entity = self.entities.get(entity_type, {}).get(entity_id)
+        if entity is not None and field_name:
+            entity[field_name] = value
+
+    def _next_attachment_id(self):
+        """
+        :returns:   A new id for an uploaded attachment
+        """
+        attachment_id = self._next_id
+        self._next_id += 1
+        return attachment_id
+
+
+def _project(entity, fields):
+    """
+    :returns:   A copy of the entity containing the type, id & requested fields
+    """
+    result = {"type": entity["type"], "id": entity["id"]}
+    for field in fields or []:
+        result[field] = copy.deepcopy(entity.get(field))
+    return result
+
+def _matches(entity, sg_filter):
+    """
+    :returns:   True if the entity matches a single [field, relation, value(s)] filter
+    """
+    field, relation = sg_filter[0], sg_filter[1]
+    values = sg_filter[2:]
+    if len(values) == 1 and isinstance(values[0], list) and relation == "in":
+        values = values[0]
+    actual = entity.get(field)
+    if isinstance(actual, list) and relation in ("is", "in"):
+        # multi-entity fields match if any entity matches:
+        return any(_matches({field: item}, sg_filter) for item in actual)
+    actual = _comparable(actual)
+    if relation == "is":
+        return actual == _comparable(values[0])
+    if relation == "is_not":
+        return actual != _comparable(values[0])
+    if relation == "in":
+        return actual in [_comparable(v) for v in values]
+    raise FakeShotgunError("Unsupported filter relation '%s'" % relation)
+
+def _comparable(value):
+    """
+    :returns:   The value in a form that can be compared - entities are compared by type &
+                id and urls by the url
+    """
+    if isinstance(value, dict):
+        if "type" in value and "id" in value:
+            return (value["type"], value["id"])
+        if "url" in value:
+            return value["url"]
+    return value
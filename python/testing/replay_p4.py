@@ -0,0 +1,297 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Stand-in for the P4 connection object that answers commands from a transcript recorded
+by a connection opened by the framework (see the connection module's transcript support),
+so that code that was slow against a production server can be re-run without the server.
+"""
+
+import re
+import time
+
+from P4 import P4Exception
+
+from ..connection.transcript import read_transcript
+from ..util.path_mapping import normalize_local_path
+from .fake_p4 import FakeSpec, _flatten
+
+# commands whose results can be answered per file when the exact command wasn't recorded,
+# e.g. because a change batches the files differently, together with the fields of each
+# result that identify the file:
+FILE_COMMANDS = {"fstat": ("depotFile", "clientFile"), "where": ("depotFile", "clientFile", "path"),
+                 "have": ("depotFile", "clientFile", "path"), "files": ("depotFile",),
+                 "opened": ("depotFile", "clientFile")}
+
+_REVISION_RE = re.compile("[#@][^/]*$")
+_WINDOWS_PATH_RE = re.compile("^[A-Za-z]:[\\\\/]")
+
+
+class ReplayP4(object):
+    """
+    P4 look-alike that returns the results recorded in a transcript.  Each time a command
+    is run, the next recording of the exact same command and arguments is returned.  Once
+    all recordings have been used, the last one is returned again.
+
+    Commands that weren't recorded exactly are answered per file for commands that take
+    file arguments (see FILE_COMMANDS) when every file was queried, with the same options,
+    somewhere in the transcript.  Anything else is unmatched - it raises a P4Exception in
+    strict mode and otherwise returns no results.
+    """
+
+    def __init__(self, transcript, strict=False, latency=0.0, recorded_latency=False):
+        """
+        Construction
+
+        :param transcript:          The path of the transcript to replay or a (headers, entries)
+                                    tuple as returned by read_transcript()
+        :param strict:              If True then running a command that can't be answered from
+                                    the transcript raises a P4Exception
+        :param latency:             The time in seconds added to every command (round trip)
+        :param recorded_latency:    If True then each command also takes the time it took when
+                                    it was recorded
+        """
+        headers, entries = read_transcript(transcript) if isinstance(transcript, basestring) else transcript
+        header = headers[0] if headers else {}
+
+        self.strict = strict
+        self.latency = latency
+        self.recorded_latency = recorded_latency
+
+        self.port = header.get("port", "replay:1666")
+        self.user = header.get("user", "")
+        self.client = header.get("client", "")
+        self.password = ""
+        self.host = ""
+        self.charset = "none"
+        self.cwd = ""
+        self.prog = "tk-framework-perforce"
+        self.exception_level = 2
+        self.api_level = 0
+        self.tagged = 1
+        self.progress = None
+        self.input = None
+
+        self.errors = []
+        self.warnings = []
+        self.messages = []
+
+        self.round_trips = 0
+        self.command_counts = {}
+        self.unmatched = []
+
+        self._connected = False
+        self._recordings = {}
+        self._file_results = {}
+        for entry in entries:
+            self._recordings.setdefault(tuple(entry["cmd"]), []).append(entry)
+            self._index_file_results(entry)
+        self._next = {}
+
+    # ------------------------------------------------------------------------------------
+    # connection
+
+    def connect(self):
+        self._connected = True
+        return self
+
+    def disconnect(self):
+        self._connected = False
+
+    def connected(self):
+        return self._connected
+
+    def is_connected(self):
+        return self._connected
+
+    def env(self, var):
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.disconnect()
+        return False
+
+    def reset_stats(self):
+        """
+        Reset the round trip and per-command counts and the list of unmatched commands
+        """
+        self.round_trips = 0
+        self.command_counts = {}
+        self.unmatched = []
+
+    def rewind(self):
+        """
+        Start returning recordings from the beginning of the transcript again
+        """
+        self._next = {}
+
+    # ------------------------------------------------------------------------------------
+    # running commands
+
+    def run(self, command, *args):
+        """
+        Run a command, returning the recorded results the same as P4.run()
+
+        :raises:    P4Exception if the recorded command reported errors (or warnings when
+                    the exception level is 2) or if the command can't be answered in strict
+                    mode
+        """
+        if not self._connected:
+            raise P4Exception("[P4.run()] not connected.")
+
+        cmd = [command] + _flatten(args)
+        self.errors = []
+        self.warnings = []
+        self.messages = []
+        self.round_trips += 1
+        self.command_counts[command] = self.command_counts.get(command, 0) + 1
+
+        entry = self._next_recording(tuple(cmd))
+        if entry is None:
+            entry = self._answer_per_file(cmd)
+        if entry is None:
+            self.unmatched.append(cmd)
+            if self.strict:
+                raise P4Exception("[ReplayP4] No recording of 'p4 %s' in the transcript" % " ".join(cmd))
+            return []
+
+        latency = self.latency + (entry.get("elapsed", 0.0) if self.recorded_latency else 0.0)
+        if latency > 0:
+            time.sleep(latency)
+
+        self.errors = list(entry.get("errors", []))
+        self.warnings = list(entry.get("warnings", []))
+        results = entry.get("results", [])
+        if "-o" in cmd:
+            results = [FakeSpec(r) if isinstance(r, dict) else r for r in results]
+        else:
+            results = [dict(r) if isinstance(r, dict) else r for r in results]
+
+        if self.errors and self.exception_level >= 1:
+            raise P4Exception("[P4#run] Errors during command execution( \"p4 %s\" )\n\n\t[Error]: %s"
+                              % (" ".join(cmd), self.errors))
+        if self.warnings and self.exception_level >= 2:
+            raise P4Exception("[P4#run] Warnings during command execution( \"p4 %s\" )\n\n\t[Warning]: %s"
+                              % (" ".join(cmd), self.warnings))
+        if entry.get("raised") and not self.errors and not self.warnings:
+            # the command failed for a reason other than errors reported by the server,
+            # e.g. the connection was dropped:
+            raise P4Exception("[P4#run] Recorded failure of 'p4 %s'" % " ".join(cmd))
+        return results
+
+    def __getattr__(self, name):
+        if name.startswith("run_"):
+            command = name[4:]
+            return lambda *args: self.run(command, *args)
+        if name.startswith("fetch_"):
+            spec_type = name[6:]
+            return lambda *args: self.run(spec_type, "-o", *args)[0]
+        if name.startswith("save_"):
+            spec_type = name[5:]
+            # the spec saved is ignored - the recorded result is returned regardless:
+            return lambda spec, *args: self.run(spec_type, "-i", *args)
+        if name.startswith("delete_"):
+            spec_type = name[7:]
+            return lambda *args: self.run(spec_type, "-d", *args)
+        raise AttributeError(name)
+
+    # ------------------------------------------------------------------------------------
+    # matching commands to recordings
+
+    def _next_recording(self, key):
+        """
+        :returns:   The next recording of the exact command or None if it wasn't recorded
+        """
+        recordings = self._recordings.get(key)
+        if not recordings:
+            return None
+        index = self._next.get(key, 0)
+        self._next[key] = index + 1
+        return recordings[min(index, len(recordings) - 1)]
+
+    def _index_file_results(self, entry):
+        """
+        Index the results of a recorded command that takes file arguments by file so that
+        commands for different combinations of the same files can be answered
+        """
+        cmd = entry["cmd"]
+        fields = FILE_COMMANDS.get(cmd[0])
+        if not fields or entry.get("errors"):
+            return
+        options, files = _split_file_args(cmd[1:])
+        if not files:
+            return
+        index = self._file_results.setdefault((cmd[0], options), ({}, set()))
+        found, queried = index
+        queried.update(_file_key(f) for f in files)
+        for result in entry.get("results", []):
+            if not isinstance(result, dict):
+                continue
+            for field in fields:
+                if result.get(field):
+                    # later recordings reflect the most recent state of the file:
+                    found[_file_key(result[field])] = result
+
+    def _answer_per_file(self, cmd):
+        """
+        :returns:   A recording assembled from the per-file results of other recordings or
+                    None if any of the files in the command weren't queried in the transcript
+        """
+        if cmd[0] not in FILE_COMMANDS:
+            return None
+        options, files = _split_file_args(cmd[1:])
+        index = self._file_results.get((cmd[0], options))
+        if not files or not index:
+            return None
+        found, queried = index
+
+        results = []
+        seen = set()
+        missing = []
+        for path in files:
+            key = _file_key(path)
+            if key not in queried:
+                return None
+            result = found.get(key)
+            if result is None:
+                missing.append(path)
+            elif id(result) not in seen:
+                seen.add(id(result))
+                results.append(result)
+        warnings = ["%s - no such file(s)." % path for path in missing]
+        return {"cmd": cmd, "results": results, "errors": [], "warnings": warnings}
+
+
+def _is_file_arg(arg):
+    """
+    :returns:   True if the argument looks like a depot or absolute local path
+    """
+    return arg.startswith("//") or arg.startswith("/") or bool(_WINDOWS_PATH_RE.match(arg))
+
+def _split_file_args(args):
+    """
+    :returns:   A tuple of (options, files) where options is a tuple of the arguments that
+                aren't file paths
+    """
+    options = tuple(a for a in args if not _is_file_arg(a))
+    files = [a for a in args if _is_file_arg(a)]
+    return options, files
+
+def _file_key(path):
+    """
+    :returns:   The key a file path is indexed by - normalized and without a revision
+    """
+    path = _REVISION_RE.sub("", path)
+    if path.startswith("//"):
+        return path
+    return normalize_local_path(path)
@@ -0,0 +1,148 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Generation of synthetic depots with a production-like shape - many files laid out like
+a Toolkit project, multiple revisions per file submitted by many users across many
+changes, files opened by other users and publish metadata stored in attributes.
+"""
+
+import os
+import random
+import time
+
+from .fake_p4 import FakeDepot, FakeP4, OpenedFile
+
+# the project layout files are generated in:
+_ASSET_TYPES = ["character", "prop", "environment", "vehicle"]
+_STEPS = [("model", "ma"), ("rig", "ma"), ("texture", "psd"), ("lookdev", "ma"), ("fx", "hip")]
+_SEQUENCES = 20
+
+# the publish metadata stored on published revisions:
+_PUBLISH_METADATA = "{name: %s, published_file_type: Maya Scene, comment: Synthetic publish}"
+
+
+class SyntheticDepotInfo(object):
+    """
+    Summary of a generated depot, with the details benchmarks need to drive it
+    """
+    def __init__(self, depot, users, workspace, workspace_root, depot_paths, local_paths):
+        self.depot = depot
+        self.users = users
+        self.workspace = workspace
+        self.workspace_root = workspace_root
+        self.depot_paths = depot_paths
+        self.local_paths = local_paths
+
+    @property
+    def user(self):
+        """
+        :returns:   The user that owns the workspace
+        """
+        return self.users[0]
+
+    def connect(self, latency=0.0, record_latency=0.0, command_latency=None):
+        """
+        :returns:   A connected FakeP4 for the workspace user & workspace.  The exception
+                    level is 1, the same as connections opened by the framework
+        """
+        p4 = FakeP4(self.depot, latency, record_latency, command_latency)
+        p4.user = self.user
+        p4.client = self.workspace
+        p4.exception_level = 1
+        return p4.connect()
+
+
+def generate_synthetic_depot(num_files=10000, num_users=20, files_per_change=10, max_revisions=5,
+                             opened_by_others=0.02, out_of_date=0.05, publish_attributes=0.5,
+                             workspace_root="/projects/synthetic", seed=1, server_version="2015.1"):
+    """
+    Generate a depot of files under //depot/synthetic/... with a workspace for the first
+    user mapping the whole depot.  The workspace has all files synced, apart from a
+    fraction of files that are one revision out of date.
+
+    :param num_files:           The number of files in the depot
+    :param num_users:           The number of users submitting changes
+    :param files_per_change:    The number of files submitted in each change
+    :param max_revisions:       Each file has between 1 and this many revisions
+    :param opened_by_others:    The fraction of files opened for edit by other users
+    :param out_of_date:         The fraction of files in the workspace that aren't synced
+                                to the head revision
+    :param publish_attributes:  The fraction of head revisions with publish metadata
+    :param workspace_root:      The local root of the generated workspace.  Nothing is
+                                written to this location
+    :param seed:                The random seed, so that the same depot is generated each time
+    :param server_version:      The version the fake server reports, e.g. "2015.1"
+    :returns:                   A SyntheticDepotInfo
+    """
+    rnd = random.Random(seed)
+    depot = FakeDepot(server_version=server_version)
+
+    users = ["artist%03d" % ui for ui in range(num_users)]
+    for user in users:
+        depot.add_user(user, "Artist %s" % user[6:])
+    for user in users[1:]:
+        depot.add_client("%s_ws" % user, user, "/home/%s/synthetic" % user)
+    workspace = "%s_ws" % users[0]
+    depot.add_client(workspace, users[0], workspace_root)
+
+    # files laid out like the publish area of a Toolkit project:
+    depot_paths = []
+    for fi in range(num_files):
+        step, ext = _STEPS[fi % len(_STEPS)]
+        asset_index = fi / (len(_STEPS) * 4)
+        asset_type = _ASSET_TYPES[asset_index % len(_ASSET_TYPES)]
+        depot_paths.append("//depot/synthetic/seq%02d/%s/asset%05d/%s/publish/asset%05d_%s.v%03d.%s"
+                           % (asset_index % _SEQUENCES, asset_type, asset_index, step, asset_index, step,
+                              fi % 4 + 1, ext))
+
+    # submit the initial revision of every file followed by randomly chosen edits.  Changes
+    # are spread evenly over the last year:
+    revisions = [1 + rnd.randrange(max(max_revisions, 1)) for _ in depot_paths]
+    edits = [fi for fi, num_revs in enumerate(revisions) for _ in range(num_revs - 1)]
+    rnd.shuffle(edits)
+    num_changes = (num_files + len(edits) + files_per_change - 1) / files_per_change
+    change_time = int(time.time()) - 365 * 24 * 60 * 60
+    time_step = max(365 * 24 * 60 * 60 / max(num_changes, 1), 1)
+
+    pending = [(fi, "add") for fi in range(num_files)] + [(fi, "edit") for fi in edits]
+    head_revs = [0] * num_files
+    for ci in range(0, len(pending), files_per_change):
+        user = users[rnd.randrange(num_users)]
+        files = []
+        for fi, action in pending[ci:ci + files_per_change]:
+            head_revs[fi] += 1
+            attributes = None
+            if head_revs[fi] == revisions[fi] and rnd.random() < publish_attributes:
+                attributes = {"shotgun_metadata": _PUBLISH_METADATA % os.path.basename(depot_paths[fi])}
+            files.append((depot_paths[fi], action, "binary+l", 1024 + rnd.randrange(64 * 1024 * 1024),
+                          attributes))
+        depot.submit(user, "%s_ws" % user, "Synthetic change %d" % (ci / files_per_change + 1), files,
+                     change_time)
+        change_time += time_step
+
+    # sync the workspace, leaving some files out of date:
+    have = depot.have[workspace]
+    for fi, depot_path in enumerate(depot_paths):
+        head_rev = revisions[fi]
+        if head_rev > 1 and rnd.random() < out_of_date:
+            head_rev -= 1
+        have[depot_path] = head_rev
+
+    # open some files for edit by other users:
+    if num_users > 1:
+        for fi in rnd.sample(range(num_files), int(num_files * opened_by_others)):
+            user = users[1 + rnd.randrange(num_users - 1)]
+            depot.have["%s_ws" % user][depot_paths[fi]] = revisions[fi]
+            depot.opened.setdefault(depot_paths[fi], {})["%s_ws" % user] = OpenedFile(
+                depot_paths[fi], "%s_ws" % user, user, "edit", "default", "binary+l", revisions[fi])
+
+    local_paths = [os.path.join(workspace_root, *p[len("//depot/"):].split("/")) for p in depot_paths]
+    return SyntheticDepotInfo(depot, users, workspace, workspace_root, depot_paths, local_paths)
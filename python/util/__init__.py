@@ -9,6 +9,19 @@
 # not expressly granted therein are reserved by Shotgun Software Inc.
 
 from .files import get_client_file_details, get_depot_file_details, sync_published_file, open_file_for_edit
-from .files import client_to_depot_paths, depot_to_client_paths
+from .files import client_to_depot_paths, depot_to_client_paths, expand_fstat_fields, FSTAT_FIELD_PROFILES
+from .files import refresh_checkout_states
+from .path_mapping import ClientPathMapper, get_client_path_mapper, clear_client_path_mappers
+from .checkout_state import CheckoutStateCache, get_checkout_state_cache
+from .file_status import FileStatus
+from .coalescing import RequestCoalescer, get_request_coalescer
+from .limits import run_with_limit_splitting, is_server_limit_error, get_limit_split_stats, reset_limit_split_stats
 from .change import create_change, add_to_change, find_change_containing, submit_change, get_change_details
+from .change import find_changes_containing, get_changes, Change, ChangeBuilder
+from .change import get_parallel_submit_threads, PARALLEL_AUTO, shelve_change, submit_shelved_change
+from .submit import submit_change_async, shelve_change_async, SubmitHandle
 from .url import url_from_depot_path, depot_path_from_url
+from .metadata import MetadataBackend, AttributeMetadataBackend, IndexedMetadataBackend, MetadataIndex
+from .metadata import get_metadata_backend, set_metadata_backend
+from .ingest import PublishIngester, IngestStats, DEFAULT_INGEST_COUNTER
+from ..hook_profiler import HookProfiler, DEFAULT_SLOW_HOOK_THRESHOLD, summarize_args
@@ -11,40 +11,52 @@
 """
 Common utilities for working with Perforce changes
 """
+import os
+import re
+
 from P4 import P4Exception
 
+import sgtk
 from sgtk import TankError
 
+from ..connection.capabilities import get_server_capabilities, ServerCapabilities
+from .checkout_state import get_checkout_state_cache
+from .coalescing import get_request_coalescer
+from .limits import run_with_limit_splitting
+from .metadata import get_metadata_backend
+from .path_mapping import normalize_local_path
+
+# regex to extract the change id (and optionally the number of files that were
+# moved into it) from the result of saving a new change, e.g.:
+#   "Change 25 created."
+#   "Change 25 created with 3 open file(s)."
+NEW_CHANGE_REGEX = re.compile("^Change (?P<change>[0-9]+) created(?: with (?P<num_files>[0-9]+) open file)?")
+
+# parallel submit tuning - see get_parallel_submit_threads()
+PARALLEL_AUTO = "auto"
+MAX_PARALLEL_SUBMIT_THREADS = 8
+PARALLEL_SUBMIT_MIN_FILES = 4
+PARALLEL_SUBMIT_MIN_BYTES = 16 * 1024 * 1024
+PARALLEL_SUBMIT_BYTES_PER_THREAD = 8 * 1024 * 1024
+
+# errors returned when the --parallel option isn't recognised or parallel transfers
+# haven't been enabled on the server, e.g.:
+#   "Invalid option: --parallel=threads=4."
+#   "Parallel file transfer must be enabled using net.parallel.max"
+PARALLEL_UNSUPPORTED_REGEXES = [
+    re.compile("(?:invalid|unknown) (?:option|flag)[^\\n]*--parallel"),
+    re.compile("parallel file transfer must be enabled"),
+    re.compile("net\\.parallel\\.max[^\\n]*(?:not (?:set|enabled)|must be|is disabled)"),
+]
+
+# servers that have rejected a parallel submit - we don't try again for these
+_g_parallel_submit_unsupported = set()
+
 def create_change(p4, description):
     """
     Helper method to create a new change
     """
-    
-    # create a new changelist:
-    new_change = None
-    try:
-        # fetch a new change, update the description, and save it:
-        change_spec = p4.fetch_change()
-        change_spec._description = str(description)
-        # have to clear the file list as otherwise it would contain everything 
-        # in the default changelist!
-        change_spec._files = []
-        p4_res = p4.save_change(change_spec)
-    
-        if p4_res:
-            try:
-                # p4_res should be like: ["Change 25 created."]
-                new_change_id = int(p4_res[0].split()[1])
-                new_change = str(new_change_id)
-            except ValueError:
-                raise TankError("Perforce: Failed to extract new change id from '%s'" % p4_res)
-        
-    except P4Exception, e:
-        raise TankError("Perforce: %s" % (p4.errors[0] if p4.errors else e))
-    
-    if new_change == None:
-        raise TankError("Perforce: Failed to create new change!")
-    
+    new_change, _ = _save_new_change(p4, description)
     return new_change
 
 def add_to_change(p4, change, file_paths):
@@ -57,29 +69,300 @@ def add_to_change(p4, change, file_paths):
         p4.run_reopen("-c", str(change), file_paths)
     except P4Exception, e:
         raise TankError("Perforce: %s" % (p4.errors[0] if p4.errors else e))
+    finally:
+        # the files may have moved change so cached query results for them & for the change
+        # are out of date.  Cached results for the changes the files were previously in are
+        # found through the files they contain:
+        file_paths = [file_paths] if isinstance(file_paths, basestring) else list(file_paths)
+        get_request_coalescer().invalidate(p4, file_paths + [str(change)])
     
 def find_change_containing(p4, path):
     """
     Find the current change that the specified path is in.
     """
+    change = find_changes_containing(p4, [path]).get(path)
+    return change.change if change else None
+
+def find_changes_containing(p4, paths):
+    """
+    Find the current changes that the specified paths are open in using a single
+    field-filtered fstat for each type of path (local or depot).
+
+    :param p4:       An open Perforce connection
+    :param paths:    List of local and/or depot paths to find the change for
+    :returns dict:   A dictionary mapping each path to a Change record for the change
+                     it is open in or None if the path isn't open.  Paths that are open
+                     in the same change share the same Change record.
+    """
+    if isinstance(paths, basestring):
+        paths = [paths]
+
+    depot_paths = [path for path in paths if path.startswith("//")]
+    client_paths = [path for path in paths if not path.startswith("//")]
+
+    changes = {}
+    path_changes = {}
+    # local paths returned by the server use the case of the workspace root & may differ
+    # in case or separators from the paths passed in so both are normalized to match:
+    normalize_depot_path = lambda path: path.replace("\\", "/")
+    for query_paths, key, normalize in [(depot_paths, "depotFile", normalize_depot_path),
+                                        (client_paths, "clientFile", normalize_local_path)]:
+        if not query_paths:
+            continue
+
+        # only query opened files and only return the fields needed to match
+        # the results back up with the paths:
+        try:
+            p4_res = p4.run_fstat("-Ro", "-T", "%s,change" % key, query_paths)
+        except P4Exception, e:
+            raise TankError("Perforce: %s" % (p4.errors[0] if p4.errors else e))
+
+        p4_res_lookup = {}
+        for item in p4_res:
+            if not isinstance(item, dict) or key not in item or "change" not in item:
+                continue
+            p4_res_lookup[normalize(item[key])] = item["change"]
+
+        for path in query_paths:
+            change_id = p4_res_lookup.get(normalize(path))
+            if change_id is None:
+                path_changes[path] = None
+                continue
+            change = changes.get(change_id)
+            if not change:
+                change = Change(change_id, status="pending")
+                changes[change_id] = change
+            change.files.append(path)
+            path_changes[path] = change
+
+    return path_changes
+
+def submit_change(p4, change, parallel_threads=0, progress=None):
+    """
+    Submit the specified change
+
+    :param p4:                  An open Perforce connection
+    :param change:              The change to submit
+    :param parallel_threads:    If greater than 1 then ask the server to transfer files using
+                                this many threads ('submit --parallel').  If PARALLEL_AUTO then
+                                the number of threads is chosen from the number and size of the
+                                files in the change.  If the server doesn't support parallel
+                                submits then the change is submitted serially instead.
+    :param progress:            Optional P4.Progress instance used to report transfer progress
+    :returns:                   The id of the submitted change.  This may differ from the id
+                                of the pending change if the server renumbered it.
+    """
+    p4_res = _run_transfer(p4, "submit", ["-c", str(change)], change, parallel_threads, progress)
+
+    # the submitted files are no longer open and have new revisions so cached checkout
+    # states and query results are out of date:
+    get_checkout_state_cache().invalidate(p4)
+    get_request_coalescer().invalidate(p4)
+    submitted_change = _get_submitted_change(p4_res, change)
+    _notify_submitted(p4, p4_res, submitted_change)
+    return submitted_change
+
+def shelve_change(p4, change, parallel_threads=0, progress=None, revert=True):
+    """
+    Shelve the files in the specified change so that the change can be submitted
+    later, by a different process, using submit_shelved_change().  This is much
+    quicker than a submit for the user publishing as the submit never has to
+    transfer the file content again.
+
+    Any attributes set on the open files (e.g. the publish metadata) are shelved
+    with the files.
+
+    :param p4:                  An open Perforce connection
+    :param change:              The pending change to shelve
+    :param parallel_threads:    Number of threads to use to transfer files.  See
+                                submit_change() for details
+    :param progress:            Optional P4.Progress instance used to report transfer progress
+    :param revert:              If True then the files are reverted from the change once they
+                                have been shelved, leaving the local files untouched.  A shelved
+                                change can only be submitted with 'submit -e' once no files are
+                                open in it.
+    """
+    # '-f' forces any previously shelved versions of the files to be replaced:
+    _run_transfer(p4, "shelve", ["-f", "-c", str(change)], change, parallel_threads, progress)
+    get_request_coalescer().invalidate(p4, [str(change)])
+
+    if revert:
+        try:
+            p4.run_revert("-k", "-c", str(change), "//%s/..." % p4.client)
+        except P4Exception, e:
+            raise TankError("Perforce: Failed to revert files in shelved change %s - %s"
+                            % (change, p4.errors[0] if p4.errors else e))
+
+        # reverting with -k leaves the local files untouched so the checkout state of the
+        # files can't be detected as out of date locally:
+        get_checkout_state_cache().invalidate(p4)
+        get_request_coalescer().invalidate(p4)
+
+def submit_shelved_change(p4, change):
+    """
+    Submit a previously shelved change directly from the shelf ('submit -e') without
+    transferring any file content.  This doesn't need the workspace the change was
+    created in so can be run by a background or farm process.
+
+    :param p4:      An open Perforce connection for the user that owns the change
+    :param change:  The shelved change to submit
+    :returns:       The id of the submitted change
+    """
     try:
-        p4_res = p4.run_fstat(path)
+        p4_res = p4.run_submit("-e", str(change))
     except P4Exception, e:
-        raise TankError("Perforce: %s" % (p4.errors[0] if p4.errors else e))
-    
-    change = p4_res[0].get("change")
-    return change
+        raise TankError("Perforce: Failed to submit shelved change %s - %s"
+                        % (change, p4.errors[0] if p4.errors else e))
+    get_request_coalescer().invalidate(p4)
+    submitted_change = _get_submitted_change(p4_res, change)
+    _notify_submitted(p4, p4_res, submitted_change, shelved=True)
+    return submitted_change
 
-def submit_change(p4, change):
+def get_parallel_submit_threads(file_count, total_size, max_threads=None):
     """
-    Submit the specified change
+    Choose the number of threads to use when submitting files.  Parallel transfer only
+    pays off when there are several files and enough data to keep each thread busy.
+
+    :param file_count:  The number of files being submitted
+    :param total_size:  The total size of the files being submitted in bytes
+    :param max_threads: The maximum number of threads to use.  Defaults to
+                        MAX_PARALLEL_SUBMIT_THREADS
+    :returns:           The number of threads to use or 0 for a serial submit
+    """
+    max_threads = MAX_PARALLEL_SUBMIT_THREADS if max_threads is None else max_threads
+    if file_count < PARALLEL_SUBMIT_MIN_FILES or total_size < PARALLEL_SUBMIT_MIN_BYTES:
+        return 0
+
+    threads = min(max_threads, file_count, int(total_size / PARALLEL_SUBMIT_BYTES_PER_THREAD) or 1)
+    return threads if threads > 1 else 0
+
+def _run_transfer(p4, command, args, change, parallel_threads, progress):
+    """
+    Run a command that transfers the files in a change to the server (submit or
+    shelve), using parallel transfer when requested and supported.
+
+    :returns:   The result of the command
+    :raises:    TankError if the command fails
     """
+    parallel_supported = p4.port not in _g_parallel_submit_unsupported
+    if parallel_threads and parallel_supported:
+        # only attempt a parallel transfer if the server version supports it:
+        feature = (ServerCapabilities.PARALLEL_SHELVE if command == "shelve" 
+                   else ServerCapabilities.PARALLEL_SUBMIT)
+        parallel_supported = get_server_capabilities(p4).supports(feature)
+
+    if parallel_threads == PARALLEL_AUTO:
+        parallel_threads = 0
+        if parallel_supported:
+            file_count, total_size = _get_change_transfer_size(p4, change)
+            parallel_threads = get_parallel_submit_threads(file_count, total_size)
+
+    if parallel_threads > 1 and parallel_supported:
+        try:
+            return _run_with_progress(p4, command, ["--parallel=threads=%d" % parallel_threads] + args, progress)
+        except P4Exception, e:
+            error_msg = (p4.errors[0] if p4.errors else str(e))
+            if not _is_parallel_unsupported_error(error_msg):
+                raise TankError("Perforce: %s" % error_msg)
+            # the server doesn't allow parallel transfers so remember this and
+            # fall back to a serial transfer:
+            _g_parallel_submit_unsupported.add(p4.port)
+
     try:
-        change_spec = p4.fetch_change("-o", str(change))
-        p4.run_submit(change_spec)
+        return _run_with_progress(p4, command, args, progress)
     except P4Exception, e:
         raise TankError("Perforce: %s" % (p4.errors[0] if p4.errors else e))
 
+def _run_with_progress(p4, command, args, progress):
+    """
+    Run the specified command with the progress handler set on the connection
+    """
+    prev_progress = None
+    if progress is not None:
+        prev_progress = getattr(p4, "progress", None)
+        p4.progress = progress
+    try:
+        return p4.run(command, args)
+    finally:
+        if progress is not None:
+            p4.progress = prev_progress
+
+def _get_submitted_change(p4_res, change):
+    """
+    Find the submitted change id in the result of a submit
+    """
+    for item in p4_res or []:
+        if isinstance(item, dict) and item.get("submittedChange"):
+            return str(item["submittedChange"])
+    return str(change)
+
+def _notify_submitted(p4, p4_res, change, shelved=False):
+    """
+    Let the metadata backend know which file revisions were submitted so that metadata
+    stored against the open files can be associated with them
+    """
+    revisions = [(item["depotFile"], int(item["rev"])) for item in p4_res or []
+                 if isinstance(item, dict) and item.get("depotFile") and item.get("rev")]
+    if not revisions:
+        return
+    try:
+        get_metadata_backend().submitted(p4, change, revisions, shelved)
+    except Exception, e:
+        # the change has been submitted so this mustn't be treated as a failure:
+        try:
+            sgtk.platform.current_bundle().log_warning("Failed to update metadata for submitted change %s: %s"
+                                                       % (change, e))
+        except Exception:
+            # not running within a bundle
+            pass
+
+def _get_change_transfer_size(p4, change):
+    """
+    Find the number and total size of the local files that will be transferred when
+    the specified change is submitted.
+
+    :returns:   Tuple containing (file count, total size in bytes)
+    """
+    try:
+        p4_res = p4.run_fstat("-Ro", "-e", str(change), "-T", "clientFile,action", "//%s/..." % p4.client)
+    except P4Exception:
+        # not critical - just don't use a parallel submit:
+        return (0, 0)
+
+    file_count = 0
+    total_size = 0
+    for item in p4_res:
+        if not isinstance(item, dict) or item.get("action") not in ("add", "edit", "integrate", "branch"):
+            continue
+        try:
+            total_size += os.path.getsize(item.get("clientFile", ""))
+            file_count += 1
+        except OSError:
+            pass
+    return (file_count, total_size)
+
+def _is_parallel_unsupported_error(error_msg):
+    """
+    :returns:   True if the error message indicates that the server (or client) doesn't
+                support parallel submits.  Any other error, including a failure in one of
+                the parallel transfer threads, returns False.
+    """
+    error_msg = error_msg.lower()
+    return any(regex.search(error_msg) for regex in PARALLEL_UNSUPPORTED_REGEXES)
+
+def get_changes(p4, changes):
+    """
+    Get typed Change records for one or more changes
+
+    :param p4:         The Perforce connection
+    :param changes:    The list of changes to query Perforce for
+    :returns dict:     A dictionary mapping each change to a Change record or None
+                       if the change wasn't found
+    """
+    change_details = get_change_details(p4, changes)
+    return dict((change, Change.from_p4_result(details) if details else None)
+                for change, details in change_details.iteritems())
+
 def get_change_details(p4, changes):
     """
     Get the changes details for one or more changes
@@ -89,7 +372,11 @@ def get_change_details(p4, changes):
     :returns dict:     A dictionary mapping each change to the details found
     """
     try:
-        p4_res = p4.run_describe(changes)
+        # identical queries for the same changes running in other threads are merged and
+        # queries that exceed a server limit are split into smaller queries:
+        run_describe = lambda chs: run_with_limit_splitting(p4, "describe", p4.run_describe, chs)
+        p4_res = get_request_coalescer().run(p4, "describe", [], [str(c) for c in changes],
+                                             run_describe, "change")
     except P4Exception, e:
         raise TankError("Perforce: %s" % (p4.errors[0] if p4.errors else e))
 
@@ -107,9 +394,218 @@ def get_change_details(p4, changes):
         
     return change_details
 
+class Change(object):
+    """
+    Lightweight record describing a single Perforce change
+    """
+    __slots__ = ["change", "description", "user", "client", "status", "time", "files"]
+
+    def __init__(self, change, description=None, user=None, client=None, status=None, time=None, files=None):
+        """
+        Construction
+
+        :param change:        The change id as a string (or 'default')
+        :param description:   The change description
+        :param user:          The Perforce user that owns the change
+        :param client:        The workspace the change belongs to
+        :param status:        The change status - 'pending', 'shelved' or 'submitted'
+        :param time:          The time the change was last updated/submitted (seconds since the epoch)
+        :param files:         List of files in the change
+        """
+        self.change = str(change)
+        self.description = description
+        self.user = user
+        self.client = client
+        self.status = status
+        self.time = time
+        self.files = list(files) if files else []
+
+    @classmethod
+    def from_p4_result(cls, item):
+        """
+        Construct a Change from a tagged 'describe' or 'changes' result
 
+        :param item:    Dictionary returned by Perforce for a single change
+        :returns:       A new Change instance
+        """
+        time = item.get("time")
+        files = item.get("depotFile") or []
+        if isinstance(files, basestring):
+            files = [files]
+        return cls(item.get("change"),
+                   description=item.get("desc"),
+                   user=item.get("user"),
+                   client=item.get("client"),
+                   status=item.get("status"),
+                   time=int(time) if time else None,
+                   files=files)
 
+    def __eq__(self, other):
+        if isinstance(other, Change):
+            return self.change == other.change
+        return self.change == str(other)
 
+    def __ne__(self, other):
+        return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash(self.change)
+
+    def __str__(self):
+        return self.change
+
+    def __repr__(self):
+        return "<Change %s (%s)>" % (self.change, self.status or "unknown")
+
+class ChangeBuilder(object):
+    """
+    Collect files during a publish and put them into a single numbered change with
+    as few server round trips as possible.
 
+    The first call to commit() creates the change using a single 'change -i' with
+    the file list already set.  Any files added after the change has been created
+    are moved into it with a single 'reopen' the next time commit() is called.
+    """
+
+    def __init__(self, p4, description, change=None):
+        """
+        Construction
+
+        :param p4:            An open Perforce connection
+        :param description:   The description to use for the new change
+        :param change:        An existing change to add files to.  If this is None
+                              then a new change will be created by commit()
+        """
+        self._p4 = p4
+        self._description = description
+        self._change = str(change) if change is not None else None
+        self._pending = []
+        self._files = []
+
+    @property
+    def change(self):
+        """
+        :returns:   The change id as a string or None if the change hasn't been
+                    created yet
+        """
+        return self._change
+
+    @property
+    def change_record(self):
+        """
+        :returns:   A Change record for the change or None if the change hasn't
+                    been created yet
+        """
+        if self._change is None:
+            return None
+        return Change(self._change, description=self._description, user=self._p4.user,
+                      client=self._p4.client, status="pending", files=self._files)
+
+    @property
+    def files(self):
+        """
+        :returns:   The list of all paths that have been committed to the change
+        """
+        return list(self._files)
+
+    @property
+    def pending_files(self):
+        """
+        :returns:   The list of paths that have been added but not yet committed
+                    to the change
+        """
+        return [path for path, _ in self._pending]
+
+    def add(self, path, depot_path=None):
+        """
+        Add a file to the change.  The file must already be open for add/edit.
+
+        :param path:        The local or depot path of the file
+        :param depot_path:  The depot path of the file if it's known.  Files with a known
+                            depot path can be included directly when the change is created
+        """
+        if depot_path is None and path.startswith("//"):
+            depot_path = path
+        self._pending.append((path, depot_path))
+
+    def commit(self):
+        """
+        Create the change if needed and move all pending files into it.
+
+        :returns:   The change id as a string
+        :raises:    TankError if any of the Perforce commands fail
+        """
+        pending = self._pending
+        self._pending = []
+
+        reopen_paths = [path for path, _ in pending]
+        if self._change is None:
+            # create the change including all files with a known depot path:
+            depot_paths = [depot_path for _, depot_path in pending if depot_path]
+            try:
+                self._change, num_files = _save_new_change(self._p4, self._description, depot_paths)
+            except TankError:
+                if not depot_paths:
+                    raise
+                # the server refused the file list (e.g. a file is open in a different
+                # numbered change) so create an empty change and reopen everything:
+                self._change, num_files = _save_new_change(self._p4, self._description)
+                depot_paths = []
+            if depot_paths and num_files == len(depot_paths) and len(depot_paths) == len(pending):
+                # everything made it into the new change:
+                reopen_paths = []
+
+        if reopen_paths:
+            # move anything that wasn't included when the change was created (e.g. files
+            # that weren't in the default change) with a single reopen:
+            add_to_change(self._p4, self._change, reopen_paths)
+
+        self._files.extend([path for path, _ in pending])
+        return self._change
+
+def _save_new_change(p4, description, depot_paths=None):
+    """
+    Create a new change using a single 'change -i' call.
+
+    :param p4:            An open Perforce connection
+    :param description:   The description for the new change
+    :param depot_paths:   Optional list of depot paths for files currently open in the
+                          default change that should be moved into the new change
+    :returns:             Tuple containing (change id, number of files moved into the change)
+    """
+    new_change = None
+    num_files = 0
+    try:
+        # build the spec directly rather than fetching it from the server - this
+        # saves a round trip and means the file list doesn't contain everything
+        # in the default changelist!
+        change_spec = {"Change":"new",
+                       "Client":str(p4.client),
+                       "User":str(p4.user),
+                       "Status":"new",
+                       "Description":str(description),
+                       "Files":list(depot_paths or [])}
+        p4_res = p4.save_change(change_spec)
+        if depot_paths:
+            # the files have moved change so cached query results are out of date:
+            get_request_coalescer().invalidate(p4, depot_paths)
+
+        if p4_res:
+            # p4_res should be like: ["Change 25 created."] but may also contain
+            # other messages so check all of them:
+            for msg in p4_res:
+                mo = NEW_CHANGE_REGEX.match(str(msg).strip())
+                if mo:
+                    new_change = mo.group("change")
+                    num_files = int(mo.group("num_files") or 0)
+                    break
+            else:
+                raise TankError("Perforce: Failed to extract new change id from '%s'" % p4_res)
+
+    except P4Exception, e:
+        raise TankError("Perforce: %s" % (p4.errors[0] if p4.errors else e))
+
+    if new_change == None:
+        raise TankError("Perforce: Failed to create new change!")
 
+    return (new_change, num_files)
@@ -0,0 +1,249 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Cache of the checkout state of local files so that repeated checks of whether a file can
+be opened for edit don't need to query the server every time
+"""
+
+import os
+import stat
+import threading
+import time
+
+from .path_mapping import normalize_local_path, get_client_path_mapper
+
+
+class CheckoutState(object):
+    """
+    The checkout state of a single local file, as reported by fstat, together with the
+    local signals that were current when it was reported.  If any of the local signals
+    change then the state may no longer be valid.
+    """
+
+    def __init__(self, path, fstat_record, timestamp=None):
+        """
+        Construction
+
+        :param path:            The local path of the file
+        :param fstat_record:    The fstat record for the file or None if the file isn't
+                                in the depot
+        :param timestamp:       The time the state was retrieved from the server
+        """
+        self._path = path
+        self._record = dict(fstat_record) if fstat_record else None
+        self._timestamp = timestamp if timestamp is not None else time.time()
+        self._signature = _get_local_signature(path)
+
+    @property
+    def path(self):
+        """
+        :returns:   The local path of the file
+        """
+        return self._path
+
+    @property
+    def fstat_record(self):
+        """
+        :returns:   The fstat record for the file or None if the file isn't in the depot
+        """
+        return self._record
+
+    @property
+    def in_depot(self):
+        """
+        :returns:   True if the file exists in the depot
+        """
+        return self._record is not None
+
+    @property
+    def timestamp(self):
+        """
+        :returns:   The time the state was retrieved from the server
+        """
+        return self._timestamp
+
+    def is_fresh(self, ttl, now=None):
+        """
+        :param ttl: The maximum age of the state in seconds
+        :returns:   True if the state is younger than the ttl and the local signals for the
+                    file haven't changed since the state was retrieved
+        """
+        now = now if now is not None else time.time()
+        if now - self._timestamp > ttl:
+            return False
+        return _get_local_signature(self._path) == self._signature
+
+    def _set_record_field(self, field, value):
+        """
+        Update a single field of the fstat record, e.g. from the result of another command
+        """
+        if self._record is None:
+            return
+        if value is None:
+            self._record.pop(field, None)
+        else:
+            self._record[field] = value
+
+
+def _get_local_signature(path):
+    """
+    Perforce makes files read-only until they are opened and rewrites them when they are
+    synced or reverted.  A change to whether the file exists, is writable or (for read-only
+    files) has been modified therefore indicates that its checkout state may have changed.
+    The modification time of writable files is ignored as that changes whenever the user
+    saves their work.
+
+    :param path:    The local path of the file
+    :returns:       A tuple of the local signals for the file
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (False, False, None)
+    writable = bool(st.st_mode & stat.S_IWUSR)
+    return (True, writable, None if writable else st.st_mtime)
+
+
+# the default time in seconds that a checkout state can be used for:
+DEFAULT_CHECKOUT_STATE_TTL = 60
+
+class CheckoutStateCache(object):
+    """
+    Cache of checkout states per server, workspace & local file.  The cache is fed by the
+    results of fstat & opened and a cached state is only used if it's younger than
+    the ttl and the local signals for the file haven't changed since it was retrieved.
+    """
+
+    def __init__(self, ttl=DEFAULT_CHECKOUT_STATE_TTL):
+        """
+        Construction
+
+        :param ttl: The time in seconds that a checkout state can be used for
+        """
+        self._ttl = ttl
+        self._states = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        """
+        :returns:   The time in seconds that a checkout state can be used for
+        """
+        return self._ttl
+
+    def get(self, p4, path, ttl=None):
+        """
+        :param p4:      The Perforce connection the state is for
+        :param path:    The local path of the file
+        :param ttl:     Optional override of the cache's ttl
+        :returns:       The CheckoutState for the file if it's known and fresh, otherwise None
+        """
+        key = normalize_local_path(path)
+        self._lock.acquire()
+        try:
+            states = self._states.get(_get_workspace_key(p4), {})
+            state = states.get(key)
+            if state and not state.is_fresh(self._ttl if ttl is None else ttl):
+                del states[key]
+                state = None
+            return state
+        finally:
+            self._lock.release()
+
+    def update_from_fstat(self, p4, paths, fstat_records, timestamp=None):
+        """
+        Store the checkout state of files from the result of an fstat.  The fstat must have
+        been run for (at least) the 'editability' fields together with headRev & headAction
+
+        :param p4:              The Perforce connection fstat was run with
+        :param paths:           The local paths fstat was run for.  Any paths without a
+                                record are stored as not being in the depot
+        :param fstat_records:   The fstat records returned
+        :param timestamp:       The time fstat was run
+        """
+        timestamp = timestamp if timestamp is not None else time.time()
+        new_states = {}
+        for path in paths or []:
+            new_states[normalize_local_path(path)] = CheckoutState(path, None, timestamp)
+        for record in fstat_records or []:
+            if not isinstance(record, dict) or not record.get("clientFile"):
+                continue
+            path = record["clientFile"]
+            new_states[normalize_local_path(path)] = CheckoutState(path, record, timestamp)
+
+        self._lock.acquire()
+        try:
+            self._states.setdefault(_get_workspace_key(p4), {}).update(new_states)
+        finally:
+            self._lock.release()
+
+    def update_from_opened(self, p4, opened_records):
+        """
+        Update the cached states of files from the result of 'p4 opened' for the workspace.
+        Cached files that aren't in the result are no longer opened by us
+
+        :param p4:              The Perforce connection 'opened' was run with
+        :param opened_records:  The records returned by 'p4 opened'
+        """
+        mapper = get_client_path_mapper(p4)
+        opened = {}
+        for record in opened_records or []:
+            if not isinstance(record, dict) or not record.get("depotFile"):
+                continue
+            local_path = mapper.depot_to_local_path(record["depotFile"])
+            if local_path:
+                opened[normalize_local_path(local_path)] = record
+
+        self._lock.acquire()
+        try:
+            for key, state in self._states.get(_get_workspace_key(p4), {}).iteritems():
+                record = opened.get(key, {})
+                state._set_record_field("action", record.get("action"))
+                state._set_record_field("change", record.get("change"))
+        finally:
+            self._lock.release()
+
+    def invalidate(self, p4=None, paths=None):
+        """
+        Forget cached states
+
+        :param p4:      The Perforce connection to forget states for or None for all
+                        connections
+        :param paths:   The local paths to forget states for or None for all paths
+        """
+        self._lock.acquire()
+        try:
+            if p4 is None:
+                self._states.clear()
+            elif paths is None:
+                self._states.pop(_get_workspace_key(p4), None)
+            else:
+                states = self._states.get(_get_workspace_key(p4), {})
+                for path in paths:
+                    states.pop(normalize_local_path(path), None)
+        finally:
+            self._lock.release()
+
+
+def _get_workspace_key(p4):
+    """
+    :returns:   The key states are cached under for the connection
+    """
+    return (p4.port, p4.client)
+
+
+_g_checkout_state_cache = CheckoutStateCache()
+
+def get_checkout_state_cache():
+    """
+    :returns:   The checkout state cache shared by all connections in this process
+    """
+    return _g_checkout_state_cache
@@ -0,0 +1,338 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Coalescing of identical & overlapping queries (fstat, describe) that are run from several
+threads at the same time, together with a short-lived cache of their results.
+"""
+
+import threading
+import time
+
+from .path_mapping import normalize_local_path, get_client_path_mapper
+
+# the default time in seconds that query results are cached for:
+DEFAULT_RESULT_TTL = 2.0
+
+
+class _Flight(object):
+    """
+    A query for a set of keys that is currently being run by one thread
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.results = {}
+        self.failed = False
+        self.generation = 0
+
+
+class RequestCoalescer(object):
+    """
+    Merges queries for the same keys (file paths or changes) that are run at the same time
+    by different threads using different connections to the same server & workspace.  Each
+    key is only queried by one thread at a time - any other thread that needs the key waits
+    for that query to complete and shares its results, only querying the keys that aren't
+    already in flight itself.
+
+    Results are also cached for a short time so that the same query repeated within
+    milliseconds (e.g. by several apps refreshing at once) doesn't reach the server.  The
+    cache must be invalidated when the framework changes the state of files or changes.
+    """
+
+    def __init__(self, ttl=DEFAULT_RESULT_TTL):
+        """
+        Construction
+
+        :param ttl: The time in seconds results are cached for.  If 0 then results aren't
+                    cached but in-flight queries are still shared
+        """
+        self.enabled = True
+        self._ttl = ttl
+        # {scope: {key: (timestamp, records)}}:
+        self._cache = {}
+        # {port: {alias: set([(scope, key)])}} - the cache entries each depot path, local
+        # path or change refers to:
+        self._aliases = {}
+        # {scope: {key: _Flight}}:
+        self._in_flight = {}
+        self._stats = {"queries": 0, "server_queries": 0, "cached": 0, "coalesced": 0}
+        # incremented whenever results are invalidated so that results of queries that were
+        # in flight at the time aren't cached:
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def ttl(self):
+        """
+        :returns:   The time in seconds results are cached for
+        """
+        return self._ttl
+
+    def get_stats(self):
+        """
+        :returns:   A dictionary with the number of queries made, the number that reached the
+                    server and the number of keys answered from the cache or by another
+                    thread's query
+        """
+        self._lock.acquire()
+        try:
+            return dict(self._stats)
+        finally:
+            self._lock.release()
+
+    def run(self, p4, command, options, keys, run_fn, key_field):
+        """
+        Run a query for a list of keys, sharing results with identical queries running in
+        other threads and using cached results where possible.
+
+        :param p4:          The Perforce connection the query is for
+        :param command:     The command being run, e.g. 'fstat'
+        :param options:     The list of options the command is run with.  Only queries with
+                            identical options are merged
+        :param keys:        The list of keys (file paths or changes) to query
+        :param run_fn:      Callable taking a list of keys that runs the query on the
+                            connection and returns the list of result records
+        :param key_field:   The field of each result record that holds the key it's for,
+                            e.g. 'depotFile', 'clientFile' or 'change'
+        :returns:           The list of result records for all keys, in the order of the keys
+        """
+        if not self.enabled or not keys or not _can_coalesce(keys, key_field):
+            return run_fn(keys)
+
+        scope = (p4.port, p4.user, p4.client, command, tuple(_flatten(options)), key_field)
+        key_lookup = {}
+        for key in keys:
+            key_lookup.setdefault(_normalize_key(key, key_field), key)
+
+        # find the keys that are cached or already being queried by another thread and
+        # register a flight for the rest:
+        now = time.time()
+        results = {}
+        waiting = {}
+        to_query = []
+        own_flight = _Flight()
+        self._lock.acquire()
+        try:
+            self._stats["queries"] += 1
+            cache = self._cache.get(scope, {})
+            in_flight = self._in_flight.setdefault(scope, {})
+            for norm_key, key in key_lookup.iteritems():
+                cached = cache.get(norm_key)
+                if cached and now - cached[0] <= self._ttl:
+                    results[norm_key] = cached[1]
+                    self._stats["cached"] += 1
+                elif norm_key in in_flight:
+                    waiting[norm_key] = in_flight[norm_key]
+                    self._stats["coalesced"] += 1
+                else:
+                    in_flight[norm_key] = own_flight
+                    to_query.append(key)
+            if to_query:
+                self._stats["server_queries"] += 1
+                own_flight.generation = self._generation
+        finally:
+            self._lock.release()
+
+        # run our own query first so that threads waiting on each other can't deadlock:
+        unattributed = []
+        if to_query:
+            unattributed = self._run_flight(p4, scope, own_flight, to_query, run_fn, key_field)
+            results.update(own_flight.results)
+
+        retry = []
+        for norm_key, flight in waiting.iteritems():
+            flight.done.wait()
+            if flight.failed or norm_key not in flight.results:
+                # the other thread's query failed (it may have been a problem with its
+                # connection) or couldn't attribute results to the key so query it again:
+                retry.append(key_lookup[norm_key])
+            else:
+                results[norm_key] = flight.results[norm_key]
+        if retry:
+            # keep the records in the order of the keys where they can be matched:
+            retried = set(_normalize_key(key, key_field) for key in retry)
+            for record in run_fn(retry):
+                norm_key = _normalize_key(record.get(key_field), key_field) if isinstance(record, dict) else None
+                if norm_key in retried:
+                    results.setdefault(norm_key, []).append(record)
+                else:
+                    unattributed.append(record)
+
+        # return copies so that callers can't modify records shared with other threads:
+        p4_res = []
+        for key in keys:
+            for record in results.pop(_normalize_key(key, key_field), []):
+                p4_res.append(dict(record))
+        p4_res.extend(unattributed)
+        return p4_res
+
+    def invalidate(self, p4=None, keys=None):
+        """
+        Forget cached results.  Keys are matched against the keys queried and the depot &
+        local paths in the results so that, for example, invalidating the local path of a
+        file also invalidates the results of queries for its depot path.  Results are
+        forgotten for all workspaces on the server as a change made in one workspace (e.g.
+        opening a file for edit) can change the results for other workspaces.
+
+        :param p4:      The Perforce connection to forget results for or None to forget all
+                        results for all servers
+        :param keys:    List of depot paths, local paths or changes to forget results for
+                        or None to forget all results for the server
+        """
+        aliases = None
+        if p4 is not None and keys is not None:
+            aliases = set(_alias(key) for key in keys)
+            # the results of queries by depot path are also invalidated by local path:
+            try:
+                mapper = get_client_path_mapper(p4)
+            except Exception:
+                mapper = None
+            if mapper:
+                for key in keys:
+                    if not str(key).startswith("//"):
+                        depot_path = mapper.local_to_depot_path(key)
+                        if depot_path:
+                            aliases.add(depot_path)
+
+        self._lock.acquire()
+        try:
+            self._generation += 1
+            if p4 is None:
+                self._cache = {}
+                self._aliases = {}
+                return
+
+            port_aliases = self._aliases.get(p4.port, {})
+            if aliases is None:
+                for scope in [s for s in self._cache if s[0] == p4.port]:
+                    del self._cache[scope]
+                self._aliases.pop(p4.port, None)
+                return
+
+            for alias in aliases:
+                for scope, norm_key in port_aliases.pop(alias, ()):
+                    self._cache.get(scope, {}).pop(norm_key, None)
+        finally:
+            self._lock.release()
+
+    def _run_flight(self, p4, scope, flight, keys, run_fn, key_field):
+        """
+        Run the query for the keys owned by a flight and publish the results to any
+        waiting threads & the cache
+
+        :returns:   The list of result records that couldn't be matched to any key
+        """
+        records = None
+        try:
+            records = run_fn(keys)
+        finally:
+            now = time.time()
+            unattributed = []
+            if records is not None:
+                key_results = dict((_normalize_key(key, key_field), []) for key in keys)
+                for record in records:
+                    norm_key = _normalize_key(record.get(key_field), key_field) if isinstance(record, dict) else None
+                    if norm_key in key_results:
+                        key_results[norm_key].append(record)
+                    else:
+                        unattributed.append(record)
+                if unattributed:
+                    # some records couldn't be matched to a key (e.g. the server returned a
+                    # path with different case) so keys without records can't be trusted to
+                    # have no results:
+                    key_results = dict((k, r) for k, r in key_results.iteritems() if r)
+                flight.results = key_results
+            else:
+                flight.failed = True
+
+            self._lock.acquire()
+            try:
+                in_flight = self._in_flight.get(scope, {})
+                for key in keys:
+                    norm_key = _normalize_key(key, key_field)
+                    if in_flight.get(norm_key) is flight:
+                        del in_flight[norm_key]
+                if self._ttl > 0 and not flight.failed and flight.generation == self._generation:
+                    cache = self._cache.setdefault(scope, {})
+                    port_aliases = self._aliases.setdefault(scope[0], {})
+                    for norm_key, key_records in flight.results.iteritems():
+                        cache[norm_key] = (now, key_records)
+                        entry = (scope, norm_key)
+                        port_aliases.setdefault(_alias(norm_key), set()).add(entry)
+                        for record in key_records:
+                            for field in ("depotFile", "clientFile"):
+                                paths = record.get(field)
+                                if not paths:
+                                    continue
+                                # describe records hold a list of all the files in the change:
+                                for path in (paths if isinstance(paths, list) else [paths]):
+                                    port_aliases.setdefault(_alias(path), set()).add(entry)
+            finally:
+                self._lock.release()
+            flight.done.set()
+        return unattributed
+
+
+def _can_coalesce(keys, key_field):
+    """
+    Queries are merged per key so each key must identify the records returned for it.
+    Paths with revision specifiers or wildcards can't be matched to the records returned
+    and local paths can't be matched to depot paths (and vice versa)
+
+    :returns:   True if the query can be coalesced
+    """
+    if key_field not in ("depotFile", "clientFile"):
+        return True
+    for key in keys:
+        if "#" in key or "@" in key or "..." in key or "*" in key:
+            return False
+        if (key_field == "depotFile") != key.startswith("//"):
+            return False
+    return True
+
+def _normalize_key(key, key_field):
+    """
+    :returns:   The key normalized so that keys & result records can be matched
+    """
+    if key is None:
+        return None
+    if key_field == "clientFile":
+        return normalize_local_path(key)
+    return str(key)
+
+def _alias(key):
+    """
+    :returns:   The key normalized for invalidation, where the type of key isn't known
+    """
+    key = str(key)
+    if key.startswith("//") or key.isdigit():
+        return key
+    return normalize_local_path(key)
+
+def _flatten(args):
+    """
+    :returns:   The arguments flattened into a single list of strings
+    """
+    flat = []
+    for arg in args or []:
+        if isinstance(arg, (list, tuple)):
+            flat.extend(_flatten(arg))
+        else:
+            flat.append(str(arg))
+    return flat
+
+
+_g_request_coalescer = RequestCoalescer()
+
+def get_request_coalescer():
+    """
+    :returns:   The RequestCoalescer shared by all connections in this process
+    """
+    return _g_request_coalescer
@@ -0,0 +1,261 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Compact record for the fstat details of a single file
+"""
+
+# the fstat fields stored directly in a FileStatus.  Any other fields are kept in a
+# dictionary that's only created when needed:
+FILE_STATUS_FIELDS = ("depotFile", "clientFile", "headAction", "headType", "headTime", "headRev",
+                      "headChange", "headModTime", "haveRev", "action", "change", "type", "workRev",
+                      "actionOwner", "otherOpen", "otherOpens", "otherAction", "otherChange", "otherLock",
+                      "ourLock", "isMapped")
+
+# only strings shorter than this are interned - longer values (e.g. attributes) are
+# unlikely to repeat:
+_MAX_INTERN_LENGTH = 64
+
+# fields whose values are paths - these are stored split into an interned directory and
+# the file name so that the directory is shared by all files in it:
+_PATH_FIELDS = ("depotFile", "clientFile")
+
+
+class FileStatus(object):
+    """
+    The fstat details of a single file.  This holds the same fields and (string) values as
+    the dictionary returned by fstat but uses a fraction of the memory:
+
+    - the common fields are held in slots rather than a per-record dictionary
+    - values that repeat across files (actions, file types, users, revisions, changes)
+      are interned so a single copy is shared by every record
+    - depot & local paths are stored as an interned directory plus a file name
+
+    Records support the read & write dictionary interface (record["headRev"],
+    record.get("action"), "haveRev" in record, iteritems(), etc.) so they can be used
+    anywhere an fstat result dictionary is expected.  The integer fields can also be
+    read as integers, parsed on access, through head_rev, have_rev, head_change and
+    head_mod_time.
+    """
+    __slots__ = tuple("_%s" % f for f in FILE_STATUS_FIELDS if f not in _PATH_FIELDS) + (
+                "_depotFile_dir", "_depotFile_name", "_clientFile_dir", "_clientFile_name", "_extra")
+
+    def __init__(self, fields=None):
+        """
+        Construction
+
+        :param fields:  Optional dictionary of fstat fields, e.g. a single fstat result
+        """
+        # slots are left unset until a value is stored - unset slots are read as None:
+        if fields:
+            for field, value in fields.iteritems():
+                self[field] = value
+
+    # ------------------------------------------------------------------------------------
+    # typed accessors
+
+    @property
+    def head_rev(self):
+        """
+        :returns:   The head revision as an integer or None if the file has no head revision
+        """
+        return _to_int(getattr(self, "_headRev", None))
+
+    @property
+    def have_rev(self):
+        """
+        :returns:   The revision synced to the workspace as an integer or None if the file
+                    isn't synced
+        """
+        return _to_int(getattr(self, "_haveRev", None))
+
+    @property
+    def head_change(self):
+        """
+        :returns:   The change of the head revision as an integer or None
+        """
+        return _to_int(getattr(self, "_headChange", None))
+
+    @property
+    def head_mod_time(self):
+        """
+        :returns:   The modification time of the head revision (seconds since the epoch) as
+                    an integer or None
+        """
+        return _to_int(getattr(self, "_headModTime", None))
+
+    # ------------------------------------------------------------------------------------
+    # dictionary interface
+
+    def __getitem__(self, field):
+        value = self._get(field)
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def __setitem__(self, field, value):
+        path_attrs = _PATH_ATTRS.get(field)
+        if path_attrs:
+            directory, name = _split_path(value)
+            setattr(self, path_attrs[0], directory)
+            setattr(self, path_attrs[1], name)
+            return
+        attr = _SLOT_ATTRS.get(field)
+        if attr:
+            setattr(self, attr, _intern_value(value))
+        else:
+            extra = getattr(self, "_extra", None)
+            if extra is None:
+                extra = self._extra = {}
+            extra[field] = _intern_value(value)
+
+    def __delitem__(self, field):
+        if self._get(field) is None:
+            raise KeyError(field)
+        path_attrs = _PATH_ATTRS.get(field)
+        if path_attrs:
+            delattr(self, path_attrs[0])
+            delattr(self, path_attrs[1])
+        elif field in _SLOT_ATTRS:
+            delattr(self, _SLOT_ATTRS[field])
+        else:
+            del self._extra[field]
+            if not self._extra:
+                del self._extra
+
+    def __contains__(self, field):
+        return self._get(field) is not None
+
+    has_key = __contains__
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (FileStatus, dict)):
+            return dict(self.iteritems()) == dict(other.iteritems())
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "FileStatus(%r)" % dict(self.iteritems())
+
+    def get(self, field, default=None):
+        value = self._get(field)
+        return default if value is None else value
+
+    def keys(self):
+        keys = [f for f in FILE_STATUS_FIELDS if self._get(f) is not None]
+        extra = getattr(self, "_extra", None)
+        if extra:
+            keys.extend(extra.keys())
+        return keys
+
+    def values(self):
+        return [self._get(f) for f in self.keys()]
+
+    def items(self):
+        return [(f, self._get(f)) for f in self.keys()]
+
+    def iterkeys(self):
+        return iter(self.keys())
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def pop(self, field, *default):
+        value = self._get(field)
+        if value is None:
+            if default:
+                return default[0]
+            raise KeyError(field)
+        del self[field]
+        return value
+
+    def setdefault(self, field, default=None):
+        value = self._get(field)
+        if value is None:
+            self[field] = default
+            value = self._get(field)
+        return value
+
+    def update(self, fields):
+        for field, value in (fields.iteritems() if hasattr(fields, "iteritems") else fields):
+            self[field] = value
+
+    def copy(self):
+        return FileStatus(self)
+
+    def _get(self, field):
+        """
+        :returns:   The value of the field or None if it isn't set
+        """
+        attr = _SLOT_ATTRS.get(field)
+        if attr:
+            return getattr(self, attr, None)
+        path_attrs = _PATH_ATTRS.get(field)
+        if path_attrs:
+            name = getattr(self, path_attrs[1], None)
+            if name is None:
+                return None
+            directory = getattr(self, path_attrs[0], None)
+            return directory + name if directory else name
+        extra = getattr(self, "_extra", None)
+        return extra.get(field) if extra else None
+
+
+# {field: slot} for the fields stored in a single slot and {field: (directory slot, name slot)}
+# for the path fields:
+_SLOT_ATTRS = dict((f, "_%s" % f) for f in FILE_STATUS_FIELDS if f not in _PATH_FIELDS)
+_PATH_ATTRS = dict((f, ("_%s_dir" % f, "_%s_name" % f)) for f in _PATH_FIELDS)
+
+def _split_path(path):
+    """
+    :returns:   Tuple of (interned directory including the trailing separator, file name)
+    """
+    if path is None:
+        return None, None
+    path = str(path)
+    pos = max(path.rfind("/"), path.rfind("\\"))
+    if pos == -1:
+        return None, path
+    return intern(path[:pos + 1]), path[pos + 1:]
+
+def _intern_value(value):
+    """
+    :returns:   The value with any strings interned so that repeated values share memory
+    """
+    if isinstance(value, str):
+        return intern(value) if len(value) < _MAX_INTERN_LENGTH else value
+    if isinstance(value, list):
+        return [_intern_value(v) for v in value]
+    return value
+
+def _to_int(value):
+    """
+    :returns:   The string value as an integer or None if it isn't set or isn't a number
+    """
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
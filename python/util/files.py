@@ -12,22 +12,55 @@
 Common utilities for working with Perforce files
 """
 
+import binascii
 import os
 import re
 import urllib
 import urlparse
 
-from P4 import P4Exception, Map as P4Map # Prefix P4 for consistency
+from P4 import P4Exception
 
 import sgtk
 from sgtk import TankError
 
+from ..connection.capabilities import get_server_capabilities, ServerCapabilities
 from .url import depot_path_from_url
+from .path_mapping import get_client_path_mapper
+from .checkout_state import get_checkout_state_cache
+from .coalescing import get_request_coalescer
+from .limits import run_with_limit_splitting
+from .file_status import FileStatus
 
 # regex to split out path and revision from a Perforce path
 PATH_REVISION_REGEX = re.compile("(?P<path>.+)#(?P<revision>[0-9]+)$")
 PATH_CHANGE_REGEX = re.compile("(?P<path>.+)@(?P<change>[0-9]+)$")
 
+# Named sets of fstat fields that can be passed as (or included in) the 'fields' argument 
+# of get_client_file_details() & get_depot_file_details() instead of listing the fields 
+# individually.  Each profile contains just the fields needed for a common task so that 
+# the server doesn't have to send, and P4Python doesn't have to parse, every field for 
+# every file.  Note that the path, headRev & headAction fields are always added.
+FSTAT_FIELD_PROFILES = {
+    # mapping between depot & local paths:
+    "mapping":      ["depotFile", "clientFile"],
+    # whether the file can be opened for edit:
+    "editability":  ["depotFile", "clientFile", "haveRev", "action", "change", 
+                     "otherOpen", "otherOpens", "otherAction", "otherLock", "ourLock"],
+    # details shown for work files - revision, modification time & editability:
+    "workfile":     ["depotFile", "clientFile", "haveRev", "headChange", "headModTime", "headTime",
+                     "action", "otherOpen", "otherOpens", "otherAction"],
+    # details used to identify a revision when loading metadata stored against it:
+    "metadata":     ["depotFile", "headChange", "headType", "headTime"],
+}
+
+# The prefixes of the fstat fields that hold file attributes, e.g. 'attr-shotgun_metadata'.
+# Querying any of these requires fstat to be run with -Oa.
+ATTRIBUTE_FIELD_PREFIXES = ("attr-", "attrProp-", "openattr-", "openattrProp-")
+
+# The maximum number of paths passed to a single fstat command.  Larger lists are split
+# into several commands to keep each command line and server request to a reasonable size.
+FSTAT_CHUNK_SIZE = 1000
+
 def client_to_depot_paths(p4, client_paths):
     """
     Utility method to return a list of depot paths given a list of client/local
@@ -40,13 +73,13 @@ def client_to_depot_paths(p4, client_paths):
     if isinstance(client_paths, basestring):
         client_paths = [client_paths]
         
-    # check that all client paths are actually under the current workspace root
-    # otherwise fstat will raise an exception:
-    client_root = __get_client_root(p4)
-    # (TODO) - this might need to be a little more robust!
-    valid_client_paths = [path for path in client_paths if path.startswith(client_root)]
+    # check that all client paths are actually under the current workspace root and
+    # mapped by its view, otherwise fstat will raise an exception.  This is done locally
+    # in a single pass so only the mappable paths are sent to the server:
+    mapper = get_client_path_mapper(p4)
+    valid_client_paths = mapper.filter_mapped_local_paths(client_paths)
 
-    client_file_details = get_client_file_details(p4, valid_client_paths)
+    client_file_details = get_client_file_details(p4, valid_client_paths, fields="mapping")
     depot_paths = []
     for client_path in client_paths:
         depot_path = client_file_details.get(client_path, {}).get("depotFile", "")
@@ -67,49 +100,83 @@ def depot_to_client_paths(p4, depot_paths):
         depot_paths = [depot_paths]
             
     # filter list of depot paths that are mapped in the current client:
-    map = __get_client_view(p4)
-    mapped_depot_paths = [path for path in depot_paths if map.includes(path)]
+    mapper = get_client_path_mapper(p4)
+    mapped_depot_paths = mapper.filter_mapped_depot_paths(depot_paths)
             
-    depot_file_details = get_depot_file_details(p4, mapped_depot_paths)
+    depot_file_details = get_depot_file_details(p4, mapped_depot_paths, fields="mapping")
     client_paths = []
     for depot_path in depot_paths:
         client_path = depot_file_details.get(depot_path, {}).get("clientFile", "")
         client_paths.append(client_path)
     return client_paths
 
-def get_client_file_details(p4, paths, fields = [], flags = []):
+def get_client_file_details(p4, paths, fields = [], flags = [], compact = False):
     """
     Return file details for the specified list of local/client paths as 
     a dictionary keyed by the local/client path.
     
     :param p4:        An open Perforce connection
     :param paths:     List of local/client paths to find details for
-    :param fields:    List of Perforce fstat fields to return
+    :param fields:    List of Perforce fstat fields and/or field profile names (see 
+                      FSTAT_FIELD_PROFILES) to return, or a single profile name.  All
+                      fields are returned if this is empty
     :param flags:     List of additional flags to pass to fstat
+    :param compact:   If True then the details of each file are returned as a FileStatus
+                      record rather than a dictionary.  Records behave like dictionaries but
+                      use much less memory when querying many files.  They take several
+                      times longer to build though, so are only worth using for results
+                      that are kept rather than read once & discarded
     """
     if isinstance(paths, basestring):
         paths = [paths]
         
     # (AD) - does this also need to filter input list?
         
-    return __run_fstat_and_aggregate(p4, paths, fields, flags, "clientFile")
+    return __run_fstat_and_aggregate(p4, paths, fields, flags, "clientFile", compact=compact)
     
-def get_depot_file_details(p4, paths, fields = [], flags = []):
+def get_depot_file_details(p4, paths, fields = [], flags = [], compact = False):
     """
     Return file details for the specified list of depot paths as 
     a dictionary keyed by the depot path.
     
     :param p4:        An open Perforce connection
     :param paths:     List of depot paths to find details for
-    :param fields:    List of Perforce fstat fields to return
+    :param fields:    List of Perforce fstat fields and/or field profile names (see 
+                      FSTAT_FIELD_PROFILES) to return, or a single profile name.  All
+                      fields are returned if this is empty
     :param flags:     List of additional flags to pass to fstat
+    :param compact:   If True then the details of each file are returned as a FileStatus
+                      record rather than a dictionary.  Records behave like dictionaries but
+                      use much less memory when querying many files.  They take several
+                      times longer to build though, so are only worth using for results
+                      that are kept rather than read once & discarded
     """
     if isinstance(paths, basestring):
         paths = [paths]    
     
     # (AD) - does this also need to filter input list?  What if there is no client?
     
-    return __run_fstat_and_aggregate(p4, paths, fields, flags, "depotFile")
+    return __run_fstat_and_aggregate(p4, paths, fields, flags, "depotFile", compact=compact)
+
+def expand_fstat_fields(fields):
+    """
+    Expand any field profile names in a list of fstat fields to the fields they contain.
+
+    :param fields:    List of Perforce fstat fields and/or field profile names, or a single
+                      profile/field name
+    :returns:         List of unique fstat fields in the order they were first found
+    """
+    if not fields:
+        return []
+    if isinstance(fields, basestring):
+        fields = [fields]
+
+    expanded_fields = []
+    for field in fields:
+        for expanded_field in FSTAT_FIELD_PROFILES.get(field, [field]):
+            if expanded_field not in expanded_fields:
+                expanded_fields.append(expanded_field)
+    return expanded_fields
 
 def sync_published_file(p4, published_file_entity, latest=True):#, dependencies=True):
     """
@@ -134,11 +201,18 @@ def sync_published_file(p4, published_file_entity, latest=True):#, dependencies=
     if revision:
         sync_path = "%s#%d" % (depot_path, revision)
     
-    # sync file:
+    # sync file.  If the path is a wildcard that exceeds a server limit then it's synced
+    # a directory at a time instead:
+    p4_res = []
     try:        
-        p4.run_sync(sync_args, sync_path)
+        p4_res = run_with_limit_splitting(p4, "sync", lambda paths: p4.run_sync(sync_args, paths), [sync_path])
     except P4Exception, e:
         raise TankError("Perforce: Failed to sync file %s - %s" % (sync_path, p4.errors[0] if p4.errors else e))
+
+    # the synced files have changed so forget any cached checkout state for them:
+    synced_paths = [item["clientFile"] for item in p4_res or [] if isinstance(item, dict) and item.get("clientFile")]
+    get_checkout_state_cache().invalidate(p4, synced_paths)
+    get_request_coalescer().invalidate(p4, synced_paths)
     
     # (TODO) handle dependencies
     # ...
@@ -159,20 +233,32 @@ def open_file_for_edit(p4, path, add_if_new=True, test_only=False):
                         be added
     :param test_only:   Test that the file can be checked-out/added but don't actually
                         perform the action
+    :returns:           The depot path of the opened file if it's known, otherwise None.  This
+                        is always None when test_only is True
     :raises:            Raises a TankError if for any reason the file can't be opened/added
                         for edit or if any of the perforce commands fail.
     """
-    # get the current status of the file:
+    # get the current status of the file.  When only testing, a recently cached state
+    # can be used as long as nothing has changed locally since it was retrieved:
+    checkout_states = get_checkout_state_cache()
     file_stat = []
-    try:
-        file_stat = p4.run_fstat(path)
-    except P4Exception, e:
-        raise TankError("Failed to run p4 fstat on file - %s" % (p4.errors[0] if p4.errors else e))
+    state = checkout_states.get(p4, path) if test_only else None
+    if state:
+        file_stat = [state.fstat_record] if state.in_depot else []
+    else:
+        try:
+            fields = expand_fstat_fields(["editability", "headRev", "headAction"])
+            file_stat = p4.run_fstat("-T", ",".join(fields), path)
+        except P4Exception, e:
+            raise TankError("Failed to run p4 fstat on file - %s" % (p4.errors[0] if p4.errors else e))
+        if not file_stat or (isinstance(file_stat, list) and len(file_stat) == 1):
+            checkout_states.update_from_fstat(p4, [path], file_stat)
     
     # to edit the file in p4 we may need to do either an add or an edit depending on the
     # status of the file!
     (P4_EDIT, P4_ADD) = range(2)
     p4_operation = P4_EDIT
+    depot_path = None
     if file_stat:
         if not isinstance(file_stat, list) or len(file_stat) != 1 or not isinstance(file_stat[0], dict):
             raise TankError("p4 fstat returned unexpected result for file '%s'!" % path)
@@ -194,6 +280,7 @@ def open_file_for_edit(p4, path, add_if_new=True, test_only=False):
             raise TankError("File '%s' is already opened for '%s' by '%s'" 
                             % (path, file_stat.get("otherAction", ["<unknown>"])[0], other_sg_user))
         
+        depot_path = file_stat.get("depotFile")
         if "action" in file_stat:
             # we are already doing something to the file so assume that we can
             # edit the file - we won't get latest though!
@@ -239,19 +326,18 @@ def open_file_for_edit(p4, path, add_if_new=True, test_only=False):
     if p4_operation == P4_ADD and add_if_new:
         # file isn't in Perforce yet:
         if test_only:
-            # ensure file exists under the client root:
-            try:
-                p4.run_where(path)
-            except P4Exception, e:
-                raise TankError("Unable to add file '%s' to depot - %s"
-                                % (path, p4.errors[0] if p4.errors else e))
+            # ensure file exists under the client root and is mapped by the view:
+            if not get_client_path_mapper(p4).is_local_path_mapped(path):
+                raise TankError("Unable to add file '%s' to depot - the file is not under the root or "
+                                "mapped by the view of workspace '%s'" % (path, p4.client))
         else:
             if not os.path.exists(path):
                 raise TankError("Unable to add file '%s' to Perforce as it doesn't exist!" % path)
             
             # add file to depot:
             try:
-                p4.run_add(path)
+                p4_res = p4.run_add(path)
+                depot_path = __get_result_depot_path(p4_res) or depot_path
             except P4Exception, e:
                 raise TankError("Failed to add file '%s' to depot - %s" 
                                 % (path, p4.errors[0] if p4.errors else e))
@@ -259,42 +345,106 @@ def open_file_for_edit(p4, path, add_if_new=True, test_only=False):
     elif p4_operation == P4_EDIT:
         # File is already in Perforce so check it out to edit:
         try:
-            p4.run_edit(path)
+            p4_res = p4.run_edit(path)
+            depot_path = __get_result_depot_path(p4_res) or depot_path
         except P4Exception, e:
             raise TankError("Failed to checkout file '%s' - %s" 
                             % (path, p4.errors[0] if p4.errors else e))
-        
-def __get_client_root(p4):
+    else:
+        # the file wasn't opened:
+        return None
+
+    # the state of the file has changed so the cached state is no longer valid:
+    checkout_states.invalidate(p4, [path])
+    get_request_coalescer().invalidate(p4, [path])
+    return depot_path
+
+def refresh_checkout_states(p4, paths=None, stale_only=False):
     """
-    Get the local root directory for the current workspace (as set
-    in the p4 instance)
+    Refresh the cached checkout state of files so that subsequent calls to open_file_for_edit()
+    with test_only=True can be answered without querying the server, e.g. before showing a
+    publish dialog.
+
+    :param p4:          An open Perforce connection
+    :param paths:       List of local paths to refresh the state for.  These are queried using
+                        fstat.  If None then just the opened state of all files already in the
+                        cache is refreshed using a single 'p4 opened' for the workspace
+    :param stale_only:  If True then only paths that don't already have a fresh cached state
+                        are queried.  If all of the paths have one then the server isn't
+                        queried at all
+    """
+    checkout_states = get_checkout_state_cache()
+    if paths is None:
+        try:
+            p4_res = p4.run_opened()
+        except P4Exception, e:
+            raise TankError("Perforce: Failed to find opened files - %s" % (p4.errors[0] if p4.errors else e))
+        checkout_states.update_from_opened(p4, p4_res)
+        return
+
+    if isinstance(paths, basestring):
+        paths = [paths]
+
+    # only query files that are mapped in the workspace, otherwise fstat will raise an
+    # exception.  Unmapped files are left for open_file_for_edit() to report on:
+    paths = get_client_path_mapper(p4).filter_mapped_local_paths(paths)
+    if stale_only:
+        paths = [path for path in paths if not checkout_states.get(p4, path)]
+    fields = expand_fstat_fields(["editability", "headRev", "headAction"])
+    for ci in range(0, len(paths), FSTAT_CHUNK_SIZE):
+        chunk = paths[ci:ci+FSTAT_CHUNK_SIZE]
+        try:
+            p4_res = p4.run_fstat("-T", ",".join(fields), chunk)
+        except P4Exception, e:
+            raise TankError("Perforce: Failed to run fstat on file(s) - %s" % (p4.errors[0] if p4.errors else e))
+        checkout_states.update_from_fstat(p4, chunk, p4_res)
+
+def __get_result_depot_path(p4_res):
+    """
+    Find the depot path in the tagged result of a command like add or edit
+
+    :param p4_res:    The result returned from the Perforce command
+    :returns:         The depot path if found, otherwise None
+    """
+    for item in p4_res or []:
+        if isinstance(item, dict) and item.get("depotFile"):
+            return item["depotFile"]
+    return None
+
+def __get_attribute_pattern(attribute_fields):
+    """
+    Return the pattern passed to 'fstat -A' that matches just the attributes of the
+    specified fields.  fstat only accepts a single pattern so several attributes are
+    matched using a wildcard following the longest prefix their names share.
     
-    :param p4:    The Perforce connection to use
-    :returns:     The workspace root directory if found
+    :param attribute_fields:  List of attribute fields, e.g. ['attr-shotgun_metadata']
+    :return str:              The pattern or None if all attributes must be returned
     """
-    try:
-        client_spec = p4.fetch_client(p4.client)
-        return client_spec._root.rstrip("\\/") + os.path.sep
-    except P4Exception, e:
-        raise TankError("Perforce: Failed to query the workspace root for user '%s', workspace '%s': %s" 
-                        % (p4.user, p4.client, p4.errors[0] if p4.errors else e))
-        
-def __get_client_view(p4):
+    names = set()
+    for field in attribute_fields:
+        names.add(field.split("-", 1)[1])
+    if len(names) == 1:
+        return names.pop()
+    prefix = os.path.commonprefix(list(names))
+    return "%s*" % prefix if prefix else None
+
+def __decode_hex_attributes(item, attribute_fields):
     """
-    Get the view/mapping for the current workspace and user (as set
-    in the p4 instance)
+    Decode the hex encoded values of the attribute fields returned by 'fstat -Oae' in
+    place.  Values that aren't valid hex are left unchanged.
     
-    :param p4:    The Perforce connection to use
-    :returns:     The workspace root directory if found
+    :param item:              A single fstat result
+    :param attribute_fields:  List of the attribute fields to decode
     """
-    try:
-        client_spec = p4.fetch_client(p4.client)
-        return P4Map(client_spec._view)
-    except P4Exception, e:
-        raise TankError("Perforce: Failed to query the workspace view/mapping for user '%s', workspace '%s': %s" 
-                        % (p4.user, p4.client, p4.errors[0] if p4.errors else e))      
+    for field in attribute_fields:
+        value = item.get(field)
+        if value:
+            try:
+                item[field] = binascii.unhexlify(value)
+            except (TypeError, binascii.Error):
+                pass
 
-def __run_fstat_and_aggregate(p4, file_paths, fields, flags, type, ignore_deleted=True):
+def __run_fstat_and_aggregate(p4, file_paths, fields, flags, type, ignore_deleted=True, compact=False):
     """
     Return file details for the specified list of paths by calling
     fstat on them.
@@ -304,16 +454,17 @@ def __run_fstat_and_aggregate(p4, file_paths, fields, flags, type, ignore_delete
     :param fields:        Perforce fields to query
     :param flags:         Additional flags to pass to fstat
     :param type:          Path type to key result by - either 'depotFile' or 'clientFile'
+    :param compact:       If True then results are returned as FileStatus records
     
     :return dict:         Dictionary of the results for each file keyed by type.
     """
     if not file_paths:
         return {}
     
+    fields = expand_fstat_fields(fields)
     if fields:
         # ensure type headRev and headAction are included in
         # the fields so we can extrapolate the results
-        fields = list(fields)
         for required_field in [type, "headRev", "headAction"]:
             if not required_field in fields:
                 fields.append(required_field)
@@ -322,13 +473,19 @@ def __run_fstat_and_aggregate(p4, file_paths, fields, flags, type, ignore_delete
     flags = list(flags) if flags else []
 
     # special case handling for querying attributes as this requires
-    # the -Oa flag to be passed
-    if "-Oa" not in flags:
-        for field in fields:
-            if (field.startswith("attr-") or field.startswith("attrProp-")
-                or field.startswith("openattr-") or field.startswith("openattrProp-")):
-                flags.append("-Oa")
-                break
+    # the -Oa flag to be passed.  Files can have many (and large) attributes
+    # set by other tools so only the attributes requested are returned:
+    attribute_fields = [f for f in fields if f.startswith(ATTRIBUTE_FIELD_PREFIXES)]
+    decode_hex = False
+    if attribute_fields and not any(f.startswith("-O") and "a" in f[2:] for f in flags):
+        capabilities = get_server_capabilities(p4)
+        # attribute values are translated to the client charset by a unicode server which
+        # corrupts binary values so they are requested hex encoded and decoded here:
+        decode_hex = capabilities.unicode and capabilities.supports(ServerCapabilities.FSTAT_HEX_ATTRIBUTES)
+        flags.append("-Oae" if decode_hex else "-Oa")
+        pattern = __get_attribute_pattern(attribute_fields)
+        if pattern and capabilities.supports(ServerCapabilities.FSTAT_ATTRIBUTE_PATTERN):
+            flags.extend(["-A", pattern])
     
     # ensure any fields follow -T flag:
     if "-T" in flags:
@@ -343,10 +500,17 @@ def __run_fstat_and_aggregate(p4, file_paths, fields, flags, type, ignore_delete
         flags.append("-F")
         flags.append("^headAction=delete ^headAction=move/delete ^headAction=purge ^headAction=archive")
     
-    # query files using fstat
-    p4_res = []
+    # query files using fstat.  Identical queries for the same files running in other
+    # threads are merged into a single query and chunks that exceed a server limit are
+    # split into smaller queries:
+    def run_fstat(paths):
+        p4_res = []
+        for ci in range(0, len(paths), FSTAT_CHUNK_SIZE):
+            p4_res.extend(run_with_limit_splitting(p4, "fstat", lambda part: p4.run_fstat(flags, part),
+                                                   paths[ci:ci+FSTAT_CHUNK_SIZE]))
+        return p4_res
     try:
-        p4_res = p4.run_fstat(flags, file_paths)
+        p4_res = get_request_coalescer().run(p4, "fstat", flags, file_paths, run_fstat, type)
     except P4Exception, e:
         # under normal circumstances, this shouldn't happen so just raise a TankError.
         raise TankError("Perforce: Failed to run fstat on file(s) - %s" % (p4.errors[0] if p4.errors else e))
@@ -361,6 +525,10 @@ def __run_fstat_and_aggregate(p4, file_paths, fields, flags, type, ignore_delete
         if type not in item:
             continue
         
+        if decode_hex:
+            __decode_hex_attributes(item, attribute_fields)
+        if compact:
+            item = FileStatus(item)
         head_revision = int(item.get("headRev", "0"))
         path_key = item[type].replace("\\", "/")
         
@@ -0,0 +1,512 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Ingestion of submitted Perforce changes into Shotgun.  The publish & review data stored
+against files by the store hooks is loaded for every newly submitted change and
+registered as PublishedFile & Version entities.
+"""
+
+import os
+import threading
+
+from P4 import P4Exception
+
+from sgtk import TankError
+
+from .url import url_from_depot_path, depot_path_from_url
+from .limits import run_with_limit_splitting
+from .metadata import get_metadata_backend
+
+# the default counter that records the last change ingested:
+DEFAULT_INGEST_COUNTER = "shotgun_publish_ingest"
+
+# the names the default store hooks store publish & review data under:
+PUBLISH_METADATA_NAME = "shotgun_metadata"
+REVIEW_METADATA_NAME = "shotgun_review_metadata"
+
+# the actions that leave a file without content at a revision:
+_DELETE_ACTIONS = ("delete", "move/delete", "purge", "archive")
+
+
+class IngestStats(object):
+    """
+    The work done by one or more ingestion passes
+    """
+    def __init__(self):
+        self.changes = 0
+        self.revisions = 0
+        self.publishes = 0
+        self.versions = 0
+        self.dependencies = 0
+        self.skipped = 0
+        self.sg_batches = 0
+        self.last_change = None
+
+    def to_dict(self):
+        """
+        :returns:   The statistics as a dictionary
+        """
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return "<IngestStats %s>" % ", ".join("%s=%s" % kv for kv in sorted(self.__dict__.iteritems()))
+
+
+class PublishIngester(object):
+    """
+    Registers the publishes in newly submitted changes with Shotgun.  Each pass:
+
+    - finds the changes submitted since the last change ingested, recorded in a Perforce
+      counter, using 'p4 review -t' (or 'p4 changes -e' when restricted to depot paths)
+    - describes the changes in batches and loads the publish & review data for all of
+      their files through the metadata backend in a single query per batch, before
+      running the load hooks for just the files that have data
+    - creates the PublishedFile, PublishedFileDependency & Version entities using batched
+      Shotgun requests
+    - advances the counter past the batch once everything in it has been registered
+
+    If anything fails, the counter isn't advanced and the batch is retried by the next
+    pass.  Publishes registered by a partially completed batch are found and reused, and
+    any of their dependencies, Versions & uploads that are missing are created, so a retry
+    completes the batch without creating duplicates.
+    """
+
+    def __init__(self, fw, p4, shotgun, project=None, counter=DEFAULT_INGEST_COUNTER, depot_paths=None,
+                 changes_per_batch=50, sg_batch_size=100, prefetch=True):
+        """
+        Construction
+
+        :param fw:                  The framework (or a stand-in) used to run the load hooks
+                                    and look up Shotgun users
+        :param p4:                  An open Perforce connection for a user with permission to
+                                    run 'review' & 'counter'
+        :param shotgun:             The Shotgun API instance (or a stand-in) to register with
+        :param project:             The Project entity publishes are registered in when their
+                                    data doesn't include a context.  Defaults to the project
+                                    of the framework's context
+        :param counter:             The name of the counter recording the last change ingested
+        :param depot_paths:         Optional list of depot paths (e.g. '//depot/project/...')
+                                    to restrict ingestion to
+        :param changes_per_batch:   The number of changes described and registered together
+        :param sg_batch_size:       The maximum number of requests in a single Shotgun batch
+        :param prefetch:            If True then publish & review data are loaded through the
+                                    metadata backend first and the load hooks are only run for
+                                    files with data.  Set to False if the load hooks have been
+                                    overridden to load data from somewhere else
+        """
+        self._fw = fw
+        self._p4 = p4
+        self._sg = shotgun
+        self._project = project
+        if self._project is None:
+            context = getattr(fw, "context", None)
+            self._project = getattr(context, "project", None)
+        self._counter = counter
+        self._depot_paths = list(depot_paths or [])
+        self._changes_per_batch = max(changes_per_batch, 1)
+        self._sg_batch_size = max(sg_batch_size, 1)
+        self._prefetch = prefetch
+
+        self._sg_users = {}
+        self._file_types = {}
+        self._stats = IngestStats()
+
+    @property
+    def counter(self):
+        """
+        :returns:   The name of the counter recording the last change ingested
+        """
+        return self._counter
+
+    @property
+    def stats(self):
+        """
+        :returns:   The IngestStats for all passes run so far
+        """
+        return self._stats
+
+    def get_last_change(self):
+        """
+        :returns:   The last change ingested, read from the counter
+        """
+        try:
+            p4_res = self._p4.run_counter(self._counter)
+        except P4Exception, e:
+            raise TankError("Perforce: Failed to read counter '%s' - %s"
+                            % (self._counter, self._p4.errors[0] if self._p4.errors else e))
+        for item in p4_res:
+            if isinstance(item, dict) and "value" in item:
+                return int(item["value"] or 0)
+        return 0
+
+    def run_once(self, max_changes=0):
+        """
+        Ingest the changes submitted since the last pass
+
+        :param max_changes: The maximum number of changes to ingest or 0 for all of them
+        :returns:           The IngestStats for this pass
+        """
+        pass_stats = IngestStats()
+        changes = self._find_new_changes()
+        if max_changes:
+            changes = changes[:max_changes]
+
+        try:
+            for ci in range(0, len(changes), self._changes_per_batch):
+                batch = changes[ci:ci + self._changes_per_batch]
+                self._ingest_changes(batch, pass_stats)
+                # only advance the counter once everything in the batch is registered:
+                self._set_last_change(batch[-1])
+                pass_stats.last_change = batch[-1]
+        finally:
+            for name in ("changes", "revisions", "publishes", "versions", "dependencies", "skipped",
+                         "sg_batches"):
+                setattr(self._stats, name, getattr(self._stats, name) + getattr(pass_stats, name))
+            if pass_stats.last_change is not None:
+                self._stats.last_change = pass_stats.last_change
+        return pass_stats
+
+    def run(self, poll_interval=30.0, stop_event=None):
+        """
+        Ingest new changes continuously until stopped.  Errors are logged and the failed
+        changes are retried on the next poll.
+
+        :param poll_interval:   The time in seconds to wait between passes
+        :param stop_event:      Optional threading.Event that stops the loop when set
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                pass_stats = self.run_once()
+                if pass_stats.changes:
+                    self._fw.log_info("Ingested %d change(s) up to %s: %d publish(es), %d version(s)"
+                                      % (pass_stats.changes, pass_stats.last_change, pass_stats.publishes,
+                                         pass_stats.versions))
+            except Exception, e:
+                self._fw.log_error("Publish ingestion failed, will retry: %s" % e)
+            stop_event.wait(poll_interval)
+
+    def _find_new_changes(self):
+        """
+        :returns:   The sorted list of changes submitted after the counter
+        """
+        try:
+            if self._depot_paths:
+                # review can't be restricted to paths so list the submitted changes instead:
+                last_change = self.get_last_change()
+                p4_res = self._p4.run_changes("-s", "submitted", "-e", str(last_change + 1), self._depot_paths)
+            else:
+                p4_res = self._p4.run_review("-t", self._counter)
+        except P4Exception, e:
+            raise TankError("Perforce: Failed to find new changes - %s" % (self._p4.errors[0] if self._p4.errors else e))
+        return sorted(set(int(item["change"]) for item in p4_res if isinstance(item, dict) and item.get("change")))
+
+    def _set_last_change(self, change):
+        """
+        Advance the counter to the last change ingested
+        """
+        try:
+            self._p4.run_counter(self._counter, str(change))
+        except P4Exception, e:
+            raise TankError("Perforce: Failed to set counter '%s' to %s - %s"
+                            % (self._counter, change, self._p4.errors[0] if self._p4.errors else e))
+
+    def _ingest_changes(self, changes, stats):
+        """
+        Register the publishes & versions for a batch of changes
+        """
+        p4 = self._p4
+        try:
+            run_describe = lambda chs: p4.run_describe("-s", chs)
+            p4_res = run_with_limit_splitting(p4, "describe", run_describe, [str(c) for c in changes])
+        except P4Exception, e:
+            raise TankError("Perforce: Failed to describe changes - %s" % (p4.errors[0] if p4.errors else e))
+
+        # list of (depot path, revision, change details):
+        revisions = []
+        for item in p4_res:
+            if not isinstance(item, dict) or not item.get("change"):
+                continue
+            for depot_path, rev, action in zip(item.get("depotFile", []), item.get("rev", []),
+                                               item.get("action", [])):
+                if action in _DELETE_ACTIONS or not self._is_included(depot_path):
+                    continue
+                revisions.append((depot_path, int(rev), item))
+        stats.changes += len(changes)
+        stats.revisions += len(revisions)
+
+        # load the data for all files in the batch at once so that only files with data
+        # need to be passed to the load hooks:
+        has_publish = has_review = None
+        if self._prefetch and revisions:
+            backend = get_metadata_backend()
+            keys = [(depot_path, rev) for depot_path, rev, _ in revisions]
+            has_publish = set(k for k, v in backend.load_many(p4, keys, PUBLISH_METADATA_NAME).iteritems() if v)
+            has_review = set(k for k, v in backend.load_many(p4, keys, REVIEW_METADATA_NAME).iteritems() if v)
+
+        temp_files = []
+        try:
+            # list of (depot path, revision, change, publish data, review data):
+            to_register = []
+            for depot_path, rev, change in revisions:
+                key = (depot_path, rev)
+                if has_publish is not None and key not in has_publish:
+                    stats.skipped += 1
+                    continue
+                sg_user = self._get_sg_user(change.get("user"))
+                publish_res = self._fw.load_publish_data(depot_path, sg_user, change.get("client"), rev, p4)
+                if not publish_res or not publish_res.get("data"):
+                    stats.skipped += 1
+                    continue
+                temp_files.extend(publish_res.get("temp_files") or [])
+
+                review_data = None
+                if has_review is None or key in has_review:
+                    review_res = self._fw.load_publish_review_data(depot_path, sg_user, change.get("client"),
+                                                                   rev, p4)
+                    if review_res:
+                        review_data = review_res.get("data")
+                        temp_files.extend(review_res.get("temp_files") or [])
+                to_register.append((depot_path, rev, change, publish_res["data"], review_data))
+
+            if to_register:
+                self._register(to_register, stats)
+        finally:
+            for path in set(temp_files):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _register(self, to_register, stats):
+        """
+        Create the Shotgun entities for a list of (depot path, revision, change, publish
+        data, review data) tuples
+        """
+        # publishes already registered by a previous, partially completed, attempt:
+        existing = self._find_publishes([(depot_path, rev) for depot_path, rev, _, _, _ in to_register])
+
+        publish_requests = []
+        pending = []
+        publishes = {}
+        for depot_path, rev, change, publish_data, review_data in to_register:
+            if (depot_path, rev) in existing:
+                publishes[(depot_path, rev)] = {"type": "PublishedFile", "id": existing[(depot_path, rev)]["id"]}
+                continue
+            publish_requests.append({"request_type": "create", "entity_type": "PublishedFile",
+                                     "data": self._publish_create_data(depot_path, rev, change, publish_data)})
+            pending.append((depot_path, rev))
+        for key, entity in zip(pending, self._batch(publish_requests, stats)):
+            publishes[key] = {"type": "PublishedFile", "id": entity["id"]}
+        stats.publishes += len(pending)
+
+        # the dependencies & versions the previous attempt created for the existing
+        # publishes before it failed:
+        registered_dependencies, registered_versions = self._find_registered_links(
+            [publishes[key] for key in existing])
+
+        # dependencies, versions & uploads that are missing:
+        dependency_requests = []
+        version_requests = []
+        version_uploads = []
+        movie_uploads = []
+        thumbnails = []
+        dependencies = self._find_dependencies(to_register, publishes)
+        for depot_path, rev, change, publish_data, review_data in to_register:
+            publish = publishes[(depot_path, rev)]
+            for dependency in dependencies.get((depot_path, rev), []):
+                if (publish["id"], dependency["id"]) in registered_dependencies:
+                    continue
+                dependency_requests.append({"request_type": "create", "entity_type": "PublishedFileDependency",
+                                            "data": {"published_file": publish,
+                                                     "dependent_published_file": dependency}})
+            thumbnail_path = publish_data.get("thumbnail_path")
+            if (isinstance(thumbnail_path, basestring) and os.path.exists(thumbnail_path)
+                    and not existing.get((depot_path, rev), {}).get("image")):
+                thumbnails.append((publish, thumbnail_path))
+            if review_data:
+                data = dict(review_data)
+                movie_path = data.pop("sg_uploaded_movie", None)
+                movie_path = movie_path if isinstance(movie_path, basestring) else None
+                version = registered_versions.get(publish["id"])
+                if version:
+                    if not version.get("sg_uploaded_movie"):
+                        movie_uploads.append((version, movie_path))
+                    continue
+                data.setdefault("project", self._project)
+                data["published_files"] = [publish]
+                version_requests.append({"request_type": "create", "entity_type": "Version", "data": data})
+                version_uploads.append(movie_path)
+
+        self._batch(dependency_requests, stats)
+        stats.dependencies += len(dependency_requests)
+        versions = self._batch(version_requests, stats)
+        stats.versions += len(versions)
+        movie_uploads.extend(zip(versions, version_uploads))
+
+        # uploads can't be batched:
+        for publish, path in thumbnails:
+            self._sg.upload_thumbnail("PublishedFile", publish["id"], path)
+        for version, movie_path in movie_uploads:
+            if movie_path and os.path.exists(movie_path):
+                self._sg.upload("Version", version["id"], movie_path, "sg_uploaded_movie")
+
+    def _publish_create_data(self, depot_path, rev, change, publish_data):
+        """
+        :returns:   The PublishedFile creation data for a file revision
+        """
+        name = os.path.basename(depot_path)
+        context = publish_data.get("context")
+        project = getattr(context, "project", None) or self._project
+        data = {"code": name,
+                "name": publish_data.get("name") or name,
+                "version_number": publish_data.get("version_number") or rev,
+                "path": {"url": url_from_depot_path(depot_path, rev), "name": name},
+                "description": publish_data.get("comment") or change.get("desc", ""),
+                "project": project,
+                "created_by": publish_data.get("created_by") or self._get_sg_user(change.get("user"))}
+        entity = getattr(context, "entity", None)
+        if entity:
+            data["entity"] = entity
+        task = publish_data.get("task") or getattr(context, "task", None)
+        if task:
+            data["task"] = task
+        file_type = publish_data.get("published_file_type")
+        if file_type:
+            data["published_file_type"] = self._get_file_type(file_type, project)
+        return data
+
+    def _find_publishes(self, revisions):
+        """
+        :returns:   Dictionary of {(depot path, revision): PublishedFile entity} for the file
+                    revisions that are already registered.  The entities include the image
+                    field so that missing thumbnails can be uploaded
+        """
+        if not revisions:
+            return {}
+        # publishes are matched on the url of the revision alone as the version number may
+        # have come from the publish data:
+        urls = dict((url_from_depot_path(depot_path, rev), (depot_path, rev)) for depot_path, rev in revisions)
+        sg_res = self._sg.find("PublishedFile",
+                               [["code", "in", list(set(os.path.basename(dp) for dp, _ in revisions))]],
+                               ["path", "image"])
+        found = {}
+        for entity in sg_res:
+            key = urls.get((entity.get("path") or {}).get("url"))
+            if key:
+                found[key] = entity
+        return found
+
+    def _find_registered_links(self, publishes):
+        """
+        :returns:   Tuple of (set of (publish id, dependent publish id), {publish id: Version
+                    entity}) for the dependencies & Versions already registered for the
+                    publishes
+        """
+        if not publishes:
+            return set(), {}
+        sg_res = self._sg.find("PublishedFileDependency", [["published_file", "in", publishes]],
+                               ["published_file", "dependent_published_file"])
+        dependencies = set((item["published_file"]["id"], item["dependent_published_file"]["id"])
+                           for item in sg_res
+                           if item.get("published_file") and item.get("dependent_published_file"))
+
+        publish_ids = set(publish["id"] for publish in publishes)
+        versions = {}
+        sg_res = self._sg.find("Version", [["published_files", "in", publishes]],
+                               ["published_files", "sg_uploaded_movie"])
+        for version in sg_res:
+            for publish in version.get("published_files") or []:
+                if publish.get("id") in publish_ids:
+                    versions.setdefault(publish["id"], version)
+        return dependencies, versions
+
+    def _find_dependencies(self, to_register, publishes):
+        """
+        :returns:   Dictionary of {(depot path, revision): [PublishedFile entity]} for the
+                    dependencies of each file revision that are registered.  The latest
+                    registered revision of each dependency is used
+        """
+        # depot path -> (revision, entity) for the latest revision registered:
+        latest = {}
+        for (depot_path, rev), entity in publishes.iteritems():
+            if rev > latest.get(depot_path, (0, None))[0]:
+                latest[depot_path] = (rev, entity)
+
+        dependency_paths = set()
+        for _, _, _, publish_data, _ in to_register:
+            dependency_paths.update(p for p in publish_data.get("dependency_paths") or [] if p not in latest)
+        if dependency_paths:
+            sg_res = self._sg.find("PublishedFile",
+                                   [["code", "in", list(set(os.path.basename(p) for p in dependency_paths))]],
+                                   ["path", "version_number"])
+            for entity in sg_res:
+                path_and_revision = depot_path_from_url((entity.get("path") or {}).get("url") or "",
+                                                        validate_server=False)
+                depot_path = path_and_revision[0] if path_and_revision else None
+                if depot_path not in dependency_paths:
+                    continue
+                rev = entity.get("version_number") or 0
+                if rev > latest.get(depot_path, (0, None))[0]:
+                    latest[depot_path] = (rev, {"type": "PublishedFile", "id": entity["id"]})
+
+        dependencies = {}
+        for depot_path, rev, _, publish_data, _ in to_register:
+            dependencies[(depot_path, rev)] = [latest[p][1] for p in publish_data.get("dependency_paths") or []
+                                               if p in latest]
+        return dependencies
+
+    def _batch(self, requests, stats):
+        """
+        Run requests in Shotgun batches of at most sg_batch_size requests
+
+        :returns:   The list of results of all requests
+        """
+        results = []
+        for ri in range(0, len(requests), self._sg_batch_size):
+            results.extend(self._sg.batch(requests[ri:ri + self._sg_batch_size]))
+            stats.sg_batches += 1
+        return results
+
+    def _get_sg_user(self, p4_user):
+        """
+        :returns:   The Shotgun user for a Perforce user, looked up once per user
+        """
+        if p4_user not in self._sg_users:
+            self._sg_users[p4_user] = self._fw.get_shotgun_user(p4_user) if p4_user else None
+        return self._sg_users[p4_user]
+
+    def _get_file_type(self, code, project):
+        """
+        :returns:   The PublishedFileType entity for the code, created if it doesn't exist
+        """
+        if code not in self._file_types:
+            entity = self._sg.find_one("PublishedFileType", [["code", "is", code]])
+            if not entity:
+                data = {"code": code}
+                if project:
+                    data["project"] = project
+                entity = self._sg.create("PublishedFileType", data)
+            self._file_types[code] = {"type": "PublishedFileType", "id": entity["id"]}
+        return self._file_types[code]
+
+    def _is_included(self, depot_path):
+        """
+        :returns:   True if the depot path is under one of the depot paths ingestion is
+                    restricted to
+        """
+        if not self._depot_paths:
+            return True
+        for path in self._depot_paths:
+            prefix = path[:-3] if path.endswith("...") else path
+            if depot_path.startswith(prefix):
+                return True
+        return False
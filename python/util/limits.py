@@ -0,0 +1,145 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Handling of the limits a server can place on the size of a single command through the
+MaxResults, MaxScanRows & MaxLockTime group settings.  Commands that exceed a limit are
+split into smaller commands that don't.
+"""
+
+import re
+import threading
+
+from P4 import P4Exception
+
+import sgtk
+
+# the errors reported when a command exceeds one of the group limits, e.g.
+#   "Request too large (over 50000); see 'p4 help maxresults'."
+#   "Too many rows scanned (over 100000); see 'p4 help maxscanrows'."
+#   "Operation took too long (over 30.00 seconds); see 'p4 help maxlocktime'."
+SERVER_LIMIT_REGEX = re.compile("p4 help (maxresults|maxscanrows|maxlocktime)", re.IGNORECASE)
+
+# wildcard path (with an optional revision specifier) that can be split by directory:
+_WILDCARD_PATH_REGEX = re.compile("^(?P<dir>.+)/\.\.\.(?P<revision>[#@].*)?$")
+
+
+def is_server_limit_error(message):
+    """
+    :param message: The error message reported by the server
+    :returns:       True if the error means the command exceeded a MaxResults, MaxScanRows
+                    or MaxLockTime limit
+    """
+    return bool(message and SERVER_LIMIT_REGEX.search(str(message)))
+
+def run_with_limit_splitting(p4, command, run_fn, args):
+    """
+    Run a command for a list of arguments (files or changes), splitting the list in half
+    and running each half separately whenever the server reports that a limit has been
+    exceeded.  A single wildcard path (e.g. '//depot/project/...') that exceeds a limit is
+    split into the files directly in the directory and a wildcard path per sub-directory.
+
+    :param p4:          The Perforce connection the command is run on
+    :param command:     The name of the command, used to record statistics
+    :param run_fn:      Callable taking a list of arguments that runs the command and
+                        returns the list of results
+    :param args:        The list of arguments to run the command for
+    :returns:           The merged list of results for all arguments
+    :raises:            P4Exception if the command fails for any other reason or if a
+                        single argument that can't be split exceeds a limit
+    """
+    try:
+        return run_fn(args)
+    except P4Exception, e:
+        message = p4.errors[0] if p4.errors else str(e)
+        if not is_server_limit_error(message):
+            raise
+        parts = _split_args(p4, args)
+        if not parts:
+            _record(command, failed=True)
+            raise
+
+    _record(command, len(parts))
+    try:
+        sgtk.platform.current_bundle().log_debug("Perforce: '%s' for %d argument(s) exceeded a server limit "
+                                                 "(%s) - retrying in %d parts" % (command, len(args), message,
+                                                                                  len(parts)))
+    except Exception:
+        # not running within a bundle
+        pass
+
+    p4_res = []
+    for part in parts:
+        p4_res.extend(run_with_limit_splitting(p4, command, run_fn, part))
+    return p4_res
+
+def _split_args(p4, args):
+    """
+    :returns:   A list of smaller argument lists that together cover the same files or
+                changes as the arguments or None if the arguments can't be split
+    """
+    if len(args) > 1:
+        mid = len(args) / 2
+        return [args[:mid], args[mid:]]
+
+    mo = _WILDCARD_PATH_REGEX.match(str(args[0])) if args else None
+    if not mo:
+        return None
+    directory = mo.group("dir")
+    revision = mo.group("revision") or ""
+    try:
+        sub_dirs = [item["dir"] for item in p4.run_dirs("%s/*%s" % (directory, revision))
+                    if isinstance(item, dict) and item.get("dir")]
+    except P4Exception:
+        return None
+    return [["%s/*%s" % (directory, revision)]] + [["%s/...%s" % (d, revision)] for d in sub_dirs]
+
+
+_g_split_stats = {}
+_g_split_stats_lock = threading.Lock()
+
+def _record(command, parts=0, failed=False):
+    """
+    Record that a command exceeded a server limit and was split into parts
+    """
+    _g_split_stats_lock.acquire()
+    try:
+        stats = _g_split_stats.setdefault(command, {"limit_errors": 0, "splits": 0, "parts": 0, "failed": 0})
+        stats["limit_errors"] += 1
+        if failed:
+            stats["failed"] += 1
+        else:
+            stats["splits"] += 1
+            stats["parts"] += parts
+    finally:
+        _g_split_stats_lock.release()
+
+def get_limit_split_stats():
+    """
+    :returns:   A dictionary of {command: {"limit_errors", "splits", "parts", "failed"}}
+                recording how often each command exceeded a server limit, how often it was
+                split, the number of parts it was split into and how often it couldn't be
+                split any further
+    """
+    _g_split_stats_lock.acquire()
+    try:
+        return dict((command, dict(stats)) for command, stats in _g_split_stats.iteritems())
+    finally:
+        _g_split_stats_lock.release()
+
+def reset_limit_split_stats():
+    """
+    Forget the recorded statistics
+    """
+    _g_split_stats_lock.acquire()
+    try:
+        _g_split_stats.clear()
+    finally:
+        _g_split_stats_lock.release()
@@ -0,0 +1,524 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Storage of the publish & review metadata associated with submitted file revisions
+"""
+
+import os
+import tempfile
+import threading
+
+from P4 import P4Exception
+
+import sgtk
+from sgtk import TankError
+
+try:
+    import sqlite3
+except ImportError:
+    # some embedded Python distributions don't include sqlite
+    sqlite3 = None
+
+from .files import get_depot_file_details
+
+METADATA_INDEX_FILE = "metadata_index.sqlite"
+
+# the actions that leave a file without content at a revision:
+_DELETE_ACTIONS = ("delete", "move/delete", "purge", "archive")
+
+
+class MetadataBackend(object):
+    """
+    Interface for the storage of named metadata values (e.g. the YAML publish data
+    stored by the store_publish_data hook) against file revisions.  Values are stored
+    against the open file in a workspace and become associated with the revision the
+    file is submitted as.
+    """
+
+    def store(self, p4, local_path, name, value, propagate=False):
+        """
+        Store a value against a file open in the workspace
+
+        :param p4:          An open Perforce connection
+        :param local_path:  The local path of the open file
+        :param name:        The name of the metadata, e.g. 'shotgun_metadata'
+        :param value:       The string value to store or None to clear the value
+        :param propagate:   If True then the value is kept by future revisions of the file
+                            unless they store a value of their own
+        :raises:            P4Exception or TankError if the value can't be stored
+        """
+        raise NotImplementedError()
+
+    def load(self, p4, depot_path, revision, name):
+        """
+        Load the value stored against a single file revision
+
+        :param p4:          An open Perforce connection
+        :param depot_path:  The depot path of the file
+        :param revision:    The revision of the file
+        :param name:        The name of the metadata
+        :returns:           The string value or None if no value is stored
+        """
+        return self.load_many(p4, [(depot_path, revision)], name).get((depot_path, int(revision)))
+
+    def load_many(self, p4, revisions, name):
+        """
+        Load the values stored against several file revisions at once
+
+        :param p4:          An open Perforce connection
+        :param revisions:   List of (depot path, revision) tuples
+        :param name:        The name of the metadata
+        :returns:           Dictionary of {(depot path, revision): value or None}.  Revisions
+                            that can't be found, e.g. because they're deleted, hidden by
+                            protections or not yet replicated, are left out
+        """
+        raise NotImplementedError()
+
+    def load_names(self, p4, revisions, names):
+        """
+        Load the values of several names stored against several file revisions at once
+
+        :param p4:          An open Perforce connection
+        :param revisions:   List of (depot path, revision) tuples
+        :param names:       List of the names of the metadata
+        :returns:           Dictionary of {name: {(depot path, revision): value or None}}.
+                            As with load_many(), revisions that can't be found are left out
+        """
+        return dict((name, self.load_many(p4, revisions, name)) for name in names)
+
+    def find_in_change(self, p4, change, name):
+        """
+        Find all values stored against the file revisions submitted in a change
+
+        :param p4:      An open Perforce connection
+        :param change:  The submitted change
+        :param name:    The name of the metadata
+        :returns:       Dictionary of {(depot path, revision): value} for the revisions in
+                        the change that have a value
+        """
+        raise NotImplementedError()
+
+    def submitted(self, p4, change, revisions, shelved=False):
+        """
+        Called once a change has been submitted through the framework
+
+        :param p4:          The Perforce connection the change was submitted on
+        :param change:      The id of the submitted change
+        :param revisions:   List of (depot path, revision) tuples submitted in the change
+        :param shelved:     True if the change was submitted from a shelf, in which case the
+                            files may have been opened in a different workspace
+        """
+        pass
+
+
+class AttributeMetadataBackend(MetadataBackend):
+    """
+    Stores metadata in Perforce attributes on the files so that it lives with them on the
+    server.  Every load is a round trip to the server.
+    """
+
+    def store(self, p4, local_path, name, value, propagate=False):
+        """
+        Store a value in an attribute of a file open in the workspace.  See
+        MetadataBackend.store() for details.
+        """
+        args = ["-p"] if propagate else []
+        args += ["-n", name]
+        if value is not None:
+            args += ["-v", value]
+        p4.run_attribute(args, local_path)
+
+    def load_many(self, p4, revisions, name):
+        """
+        Load the attribute values of several file revisions using a single fstat.  See
+        MetadataBackend.load_many() for details.
+        """
+        return self.load_names(p4, revisions, [name]).get(name, {})
+
+    def load_names(self, p4, revisions, names):
+        """
+        Load several attribute values of several file revisions using a single fstat.  See
+        MetadataBackend.load_names() for details.
+        """
+        if not revisions or not names:
+            return {}
+        fields = ["attr-%s" % name for name in names]
+        paths = ["%s#%d" % (depot_path, int(rev)) for depot_path, rev in revisions]
+        file_details = get_depot_file_details(p4, paths, fields=["metadata"] + fields)
+
+        values = dict((name, {}) for name in names)
+        for (depot_path, rev), path in zip(revisions, paths):
+            details = file_details.get(path)
+            if not details:
+                # no record was returned for the revision so nothing is known about it:
+                continue
+            for name, field in zip(names, fields):
+                values[name][(depot_path, int(rev))] = details.get(field)
+        return values
+
+    def find_in_change(self, p4, change, name):
+        """
+        Find the attribute values of all file revisions submitted in a change.  See
+        MetadataBackend.find_in_change() for details.
+        """
+        try:
+            p4_res = p4.run_files("//...@=%s" % change)
+        except P4Exception, e:
+            raise TankError("Perforce: Failed to find files in change %s - %s"
+                            % (change, p4.errors[0] if p4.errors else e))
+        revisions = [(item["depotFile"], int(item["rev"])) for item in p4_res
+                     if isinstance(item, dict) and item.get("depotFile") and item.get("rev")
+                     and item.get("action") not in _DELETE_ACTIONS]
+
+        values = self.load_many(p4, revisions, name)
+        return dict((revision, value) for revision, value in values.iteritems() if value is not None)
+
+
+class MetadataIndex(object):
+    """
+    Local sqlite index of metadata values keyed by server and depot revision
+    (depot_path#rev).  Submitted revisions are immutable so values can be indexed
+    indefinitely.  The index is shared by all processes on the machine - sqlite handles
+    the locking between them.
+    """
+
+    def __init__(self, path):
+        """
+        Construction
+
+        :param path:    The path of the sqlite database file, created if it doesn't exist
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        # the connection is shared by all threads but only used while holding the lock:
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.text_factory = str
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS metadata (server TEXT, depot_path TEXT, rev INTEGER, name TEXT,
+                                                 change INTEGER, value BLOB,
+                                                 PRIMARY KEY (server, depot_path, rev, name));
+            CREATE INDEX IF NOT EXISTS metadata_change ON metadata (server, change, name);
+            CREATE TABLE IF NOT EXISTS indexed_changes (server TEXT, change INTEGER, name TEXT,
+                                                        PRIMARY KEY (server, change, name));
+        """)
+        self._db.commit()
+
+    @property
+    def path(self):
+        """
+        :returns:   The path of the sqlite database file
+        """
+        return self._path
+
+    def get(self, server, revisions, name):
+        """
+        :param server:      The server the revisions are on
+        :param revisions:   List of (depot path, revision) tuples
+        :param name:        The name of the metadata
+        :returns:           Dictionary of {(depot path, revision): value or None} for the
+                            revisions that are indexed
+        """
+        values = {}
+        self._lock.acquire()
+        try:
+            cursor = self._db.cursor()
+            for depot_path, rev in revisions:
+                cursor.execute("SELECT value FROM metadata WHERE server=? AND depot_path=? AND rev=? AND name=?",
+                               (server, depot_path, int(rev), name))
+                row = cursor.fetchone()
+                if row:
+                    values[(depot_path, int(rev))] = _from_blob(row[0])
+        finally:
+            self._lock.release()
+        return values
+
+    def add(self, server, values, name, change=None):
+        """
+        Index values against file revisions
+
+        :param server:  The server the revisions are on
+        :param values:  Dictionary of {(depot path, revision): value or None}
+        :param name:    The name of the metadata
+        :param change:  The change the revisions were submitted in, if known
+        """
+        rows = [(server, depot_path, int(rev), name, int(change) if change else None, _to_blob(value))
+                for (depot_path, rev), value in values.iteritems()]
+        self._write("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def find_change(self, server, change, name):
+        """
+        :returns:   Dictionary of {(depot path, revision): value} for the indexed revisions
+                    submitted in the change that have a value
+        """
+        self._lock.acquire()
+        try:
+            cursor = self._db.execute("SELECT depot_path, rev, value FROM metadata "
+                                      "WHERE server=? AND change=? AND name=? AND value IS NOT NULL",
+                                      (server, int(change), name))
+            return dict(((depot_path, rev), _from_blob(value)) for depot_path, rev, value in cursor)
+        finally:
+            self._lock.release()
+
+    def is_change_indexed(self, server, change, name):
+        """
+        :returns:   True if the values of all revisions in the change have been indexed
+        """
+        self._lock.acquire()
+        try:
+            cursor = self._db.execute("SELECT 1 FROM indexed_changes WHERE server=? AND change=? AND name=?",
+                                      (server, int(change), name))
+            return cursor.fetchone() is not None
+        finally:
+            self._lock.release()
+
+    def mark_change_indexed(self, server, change, name):
+        """
+        Record that the values of all revisions in the change have been indexed
+        """
+        self._write("INSERT OR REPLACE INTO indexed_changes VALUES (?, ?, ?)", [(server, int(change), name)])
+
+    def clear(self, server=None):
+        """
+        Remove all indexed values
+
+        :param server:  The server to remove values for or None for all servers
+        """
+        self._lock.acquire()
+        try:
+            for table in ("metadata", "indexed_changes"):
+                if server is None:
+                    self._db.execute("DELETE FROM %s" % table)
+                else:
+                    self._db.execute("DELETE FROM %s WHERE server=?" % table, (server,))
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """
+        Close the database
+        """
+        self._lock.acquire()
+        try:
+            self._db.close()
+        finally:
+            self._lock.release()
+
+    def _write(self, sql, rows):
+        """
+        Execute a statement for each row and commit
+        """
+        if not rows:
+            return
+        self._lock.acquire()
+        try:
+            self._db.executemany(sql, rows)
+            self._db.commit()
+        finally:
+            self._lock.release()
+
+
+class IndexedMetadataBackend(MetadataBackend):
+    """
+    Wraps another backend, typically an AttributeMetadataBackend, with a local
+    MetadataIndex.  The index is populated when changes containing stored values are
+    submitted through the framework and when values are first loaded so that repeated
+    loads, and queries for all values in a change, don't reach the server.  Only values
+    read back from the wrapped backend are indexed - values stored against open files may
+    still be changed or reverted, possibly outside of the framework, before they're
+    submitted.  Problems with the index are logged and never stop values
+    being stored or loaded through the wrapped backend.
+    """
+
+    def __init__(self, backend, index):
+        """
+        Construction
+
+        :param backend: The MetadataBackend values are stored in and loaded from
+        :param index:   The MetadataIndex to populate
+        """
+        self._backend = backend
+        self._index = index
+        # the names of the values stored through this backend:
+        self._stored_names = set()
+
+    @property
+    def backend(self):
+        """
+        :returns:   The wrapped MetadataBackend
+        """
+        return self._backend
+
+    @property
+    def index(self):
+        """
+        :returns:   The MetadataIndex
+        """
+        return self._index
+
+    def store(self, p4, local_path, name, value, propagate=False):
+        """
+        Store a value through the wrapped backend.  The value is indexed once the file is
+        submitted.  See MetadataBackend.store() for details.
+        """
+        self._backend.store(p4, local_path, name, value, propagate)
+        self._stored_names.add(name)
+
+    def load_many(self, p4, revisions, name):
+        """
+        Load values from the index, loading any that aren't indexed from the wrapped backend.
+        Only revisions the wrapped backend returns are indexed so revisions that can't be
+        found yet are loaded again next time.  See MetadataBackend.load_many() for details.
+        """
+        revisions = [(depot_path, int(rev)) for depot_path, rev in revisions]
+        values = {}
+        try:
+            values = self._index.get(p4.port, revisions, name)
+        except Exception, e:
+            _log_index_error(e)
+
+        missing = [r for r in revisions if r not in values]
+        if missing:
+            loaded = self._backend.load_many(p4, missing, name)
+            values.update(loaded)
+            try:
+                self._index.add(p4.port, loaded, name)
+            except Exception, e:
+                _log_index_error(e)
+        return values
+
+    def find_in_change(self, p4, change, name):
+        """
+        Find the values for a change in the index, indexing the change first if needed.
+        See MetadataBackend.find_in_change() for details.
+        """
+        try:
+            if self._index.is_change_indexed(p4.port, change, name):
+                return self._index.find_change(p4.port, change, name)
+        except Exception, e:
+            _log_index_error(e)
+
+        values = self._backend.find_in_change(p4, change, name)
+        try:
+            self._index.add(p4.port, values, name, change)
+            self._index.mark_change_indexed(p4.port, change, name)
+        except Exception, e:
+            _log_index_error(e)
+        return values
+
+    def submitted(self, p4, change, revisions, shelved=False):
+        """
+        Index the values stored against the submitted revisions, read back from the
+        wrapped backend in a single query, for all names stored through this backend.  See
+        MetadataBackend.submitted() for details.
+        """
+        self._backend.submitted(p4, change, revisions, shelved)
+        names = sorted(self._stored_names)
+        if not names:
+            return
+        for name, values in self._backend.load_names(p4, revisions, names).iteritems():
+            try:
+                self._index.add(p4.port, values, name, change)
+            except Exception, e:
+                _log_index_error(e)
+
+
+def _to_blob(value):
+    """
+    :returns:   The value as a blob so that non-UTF8 strings can be stored
+    """
+    return None if value is None else sqlite3.Binary(value)
+
+def _from_blob(value):
+    """
+    :returns:   The blob as a string
+    """
+    return None if value is None else str(value)
+
+def _log_index_error(e):
+    """
+    Log a problem with the metadata index
+    """
+    try:
+        sgtk.platform.current_bundle().log_warning("Metadata index error: %s" % e)
+    except Exception:
+        # not running within a bundle
+        pass
+
+def _get_setting(name, default):
+    """
+    :returns:   The value of the framework setting or the default if it can't be found
+    """
+    try:
+        value = sgtk.platform.current_bundle().get_setting(name)
+    except Exception:
+        # not running within a bundle or an older configuration
+        return default
+    return default if value is None else value
+
+def _get_index_path():
+    """
+    :returns:   The path of the metadata index, either from the metadata_index_file
+                setting or in the framework's cache location
+    """
+    path = _get_setting("metadata_index_file", "")
+    if path:
+        return path
+    cache_folder = None
+    try:
+        cache_folder = getattr(sgtk.platform.current_bundle(), "cache_location", None)
+    except Exception:
+        # not running within a bundle
+        pass
+    return os.path.join(cache_folder or tempfile.gettempdir(), METADATA_INDEX_FILE)
+
+
+_g_metadata_backend = None
+_g_metadata_backend_lock = threading.Lock()
+
+def get_metadata_backend():
+    """
+    :returns:   The MetadataBackend used to store & load publish and review data.  Unless
+                one has been set with set_metadata_backend(), this is an
+                AttributeMetadataBackend, wrapped with a local index if the
+                enable_metadata_index setting is True and sqlite is available
+    """
+    global _g_metadata_backend
+    _g_metadata_backend_lock.acquire()
+    try:
+        if _g_metadata_backend is None:
+            backend = AttributeMetadataBackend()
+            if sqlite3 and _get_setting("enable_metadata_index", True):
+                try:
+                    backend = IndexedMetadataBackend(backend, MetadataIndex(_get_index_path()))
+                except Exception, e:
+                    _log_index_error(e)
+            _g_metadata_backend = backend
+        return _g_metadata_backend
+    finally:
+        _g_metadata_backend_lock.release()
+
+def set_metadata_backend(backend):
+    """
+    Replace the MetadataBackend used to store & load publish and review data, e.g. with a
+    studio specific implementation
+
+    :param backend: The MetadataBackend to use or None to use the default backend
+    """
+    global _g_metadata_backend
+    _g_metadata_backend_lock.acquire()
+    try:
+        _g_metadata_backend = backend
+    finally:
+        _g_metadata_backend_lock.release()
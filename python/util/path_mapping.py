@@ -0,0 +1,384 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Local mapping of paths through a workspace without querying the server for each path
+"""
+
+import os
+import re
+import shlex
+import sys
+import threading
+import time
+
+from P4 import P4Exception, Map as P4Map # Prefix P4 for consistency
+
+from sgtk import TankError
+
+from ..connection.capabilities import get_server_capabilities
+
+# revision/change specifiers that can follow a depot path:
+_REVISION_SPECIFIER_REGEX = re.compile("[#@][^/\\\\]*$")
+
+
+class ClientPathMapper(object):
+    """
+    Maps local, client-syntax & depot paths through a workspace's root & view.  All of the
+    work is done locally so whole lists of paths can be checked in a single pass without
+    a server round trip per path.  Include, exclude ('-') & overlay ('+') view lines are
+    all handled by the underlying P4.Map.  When paths aren't case-sensitive, both the
+    view and the paths are matched without regard to case, the same as the server does.
+    """
+
+    def __init__(self, client, root, view, alt_roots=None, case_sensitive=None):
+        """
+        Construction
+
+        :param client:          The name of the workspace
+        :param root:            The local root directory of the workspace
+        :param view:            List of view lines from the workspace spec
+        :param alt_roots:       Optional list of alternate root directories
+        :param case_sensitive:  True if local paths & the view should be matched
+                                case-sensitively.  If None then this is determined from
+                                the current platform
+        """
+        if case_sensitive is None:
+            case_sensitive = LOCAL_PATHS_CASE_SENSITIVE
+        self._case_sensitive = case_sensitive
+
+        self._client = client
+        self._client_prefix = "//%s/" % client
+        self._view = P4Map(view) if case_sensitive else _CaseInsensitiveMap(view)
+        self._reverse_view = self._view.reverse()
+
+        # normalized roots, each ending in a single separator:
+        self._roots = []
+        for r in [root] + list(alt_roots or []):
+            if not r or r.lower() == "null":
+                continue
+            root_key = self._normalize(r).rstrip("/") + "/"
+            if root_key not in [k for k, _ in self._roots]:
+                self._roots.append((root_key, r.rstrip("\\/")))
+
+    @staticmethod
+    def from_client_spec(client_spec, case_sensitive=None):
+        """
+        :param client_spec: The workspace spec as returned by p4.fetch_client()
+        :returns:           A new ClientPathMapper for the workspace
+        """
+        return ClientPathMapper(client_spec.get("Client"), client_spec.get("Root"), client_spec.get("View", []),
+                                client_spec.get("AltRoots"), case_sensitive)
+
+    @property
+    def client(self):
+        """
+        :returns:   The name of the workspace
+        """
+        return self._client
+
+    @property
+    def root(self):
+        """
+        :returns:   The local root directory of the workspace
+        """
+        return self._roots[0][1] if self._roots else ""
+
+    def local_to_client_path(self, local_path):
+        """
+        :param local_path:  A local file path
+        :returns:           The path in client syntax (//client/...) or None if the path
+                            isn't under the workspace root
+        """
+        key = self._normalize(local_path)
+        # use the original path (minus the root) so that the case is preserved:
+        original = local_path.replace("\\", "/")
+        for root_key, _ in self._roots:
+            if key.startswith(root_key):
+                return self._client_prefix + original[len(root_key):]
+        return None
+
+    def local_to_depot_path(self, local_path):
+        """
+        :param local_path:  A local file path
+        :returns:           The depot path the local path maps to or None if it isn't
+                            under the workspace root or isn't mapped by the view
+        """
+        client_path = self.local_to_client_path(local_path)
+        if not client_path:
+            return None
+        return self.client_to_depot_path(client_path)
+
+    def client_to_depot_path(self, client_path):
+        """
+        :param client_path: A path in client syntax (//client/...)
+        :returns:           The depot path the client path maps to or None if it isn't mapped
+                            by the view
+        """
+        return self._reverse_view.translate(client_path)
+
+    def depot_to_client_path(self, depot_path):
+        """
+        :param depot_path:  A depot path.  Any revision specifier is ignored
+        :returns:           The path in client syntax (//client/...) the depot path maps to or
+                            None if it isn't mapped by the view
+        """
+        client_path = self._view.translate(_strip_revision(depot_path))
+        if not client_path or not self._normalize(client_path).startswith(self._normalize(self._client_prefix)):
+            return None
+        return client_path
+
+    def depot_to_local_path(self, depot_path):
+        """
+        :param depot_path:  A depot path.  Any revision specifier is ignored
+        :returns:           The local path the depot path maps to or None if it isn't mapped
+                            by the view
+        """
+        client_path = self.depot_to_client_path(depot_path)
+        if not client_path or not self._roots:
+            return None
+        return os.path.join(self._roots[0][1], *client_path[len(self._client_prefix):].split("/"))
+
+    def is_local_path_mapped(self, local_path):
+        """
+        :returns:   True if the local path is under the workspace root and mapped by the view
+        """
+        return self.local_to_depot_path(local_path) is not None
+
+    def is_depot_path_mapped(self, depot_path):
+        """
+        :returns:   True if the depot path is mapped by the view
+        """
+        return self._view.includes(_strip_revision(depot_path))
+
+    def filter_mapped_local_paths(self, local_paths):
+        """
+        :param local_paths: List of local paths
+        :returns:           The local paths that are under the workspace root and mapped by
+                            the view, in their original order
+        """
+        return [p for p in local_paths if p and self.local_to_depot_path(p) is not None]
+
+    def filter_mapped_depot_paths(self, depot_paths):
+        """
+        :param depot_paths: List of depot paths, optionally with revision specifiers
+        :returns:           The depot paths that are mapped by the view, in their original order
+        """
+        includes = self._view.includes
+        return [p for p in depot_paths if p and includes(_strip_revision(p))]
+
+    def _normalize(self, path):
+        """
+        :returns:   The path with '/' separators, lower case if paths aren't case-sensitive
+        """
+        return normalize_local_path(path, self._case_sensitive)
+
+
+class _CaseInsensitiveMap(object):
+    """
+    Case-insensitive equivalent of the parts of P4.Map used by ClientPathMapper.  P4.Map
+    always matches case-sensitively so the view & paths are lower-cased before they are
+    matched.  The case of a translated path is then restored from the view line that
+    mapped it, with the parts matched by wildcards taken from the original path - the
+    same result the server returns.
+    """
+
+    def __init__(self, view):
+        """
+        Construction
+
+        :param view:    List of view lines or of (flag, left, right) tuples as returned
+                        by _split_view_line()
+        """
+        self._lines = [line if isinstance(line, tuple) else _split_view_line(line) for line in view]
+        self._map = P4Map()
+        # list of (left regex, left wildcards, right) for all lines that aren't
+        # exclusions, last line first:
+        self._translations = []
+        for flag, left, right in self._lines:
+            self._map.insert(flag + left.lower(), right.lower())
+            if flag != "-":
+                left_regex, left_wildcards = _wildcard_regex(left)
+                self._translations.insert(0, (left_regex, left_wildcards, right))
+
+    def reverse(self):
+        """
+        :returns:   A new map translating from the right side of the view to the left
+        """
+        return _CaseInsensitiveMap([(flag, right, left) for flag, left, right in self._lines])
+
+    def includes(self, path):
+        """
+        :returns:   True if the path is mapped by the view
+        """
+        return self._map.translate(path.lower()) is not None
+
+    def translate(self, path):
+        """
+        :returns:   The path translated from the left side of the view to the right or None
+                    if it isn't mapped
+        """
+        translated = self._map.translate(path.lower())
+        if translated is None:
+            return None
+        for left_regex, left_wildcards, right in self._translations:
+            match = left_regex.match(path)
+            if not match:
+                continue
+            result = _substitute_wildcards(right, left_wildcards, match.groups())
+            if result.lower() == translated:
+                return result
+        # couldn't work out which line mapped the path so the case can't be restored:
+        return translated
+
+
+# wildcards that can be used in view lines:
+_WILDCARD_REGEX = re.compile("(\\.\\.\\.|\\*|%%[0-9])")
+
+def _split_view_line(line):
+    """
+    :param line:    A view line, e.g. '-//depot/a/... //ws/a/...' or
+                    '"+//depot/with space/..." "//ws/with space/..."'
+    :returns:       Tuple containing (flag, left path, right path) where flag is the
+                    leading '-', '+' or '&' of the line, or "" if there isn't one
+    """
+    lexer = shlex.shlex(line, posix=True)
+    lexer.whitespace_split = True
+    lexer.escape = ""
+    left, right = list(lexer)[:2]
+    if left[:1] in ("-", "+", "&"):
+        return (left[0], left[1:], right)
+    return ("", left, right)
+
+def _wildcard_regex(path):
+    """
+    :returns:   Tuple containing a case-insensitive regex matching the view path, with a
+                group for each wildcard, and the list of wildcards in the order they appear
+    """
+    pattern = ""
+    wildcards = []
+    for part in _WILDCARD_REGEX.split(path):
+        if part == "...":
+            pattern += "(.*)"
+        elif part == "*" or part.startswith("%%"):
+            pattern += "([^/]*)"
+        else:
+            pattern += re.escape(part)
+            continue
+        wildcards.append(part)
+    return re.compile("^%s$" % pattern, re.IGNORECASE | re.DOTALL), wildcards
+
+def _substitute_wildcards(path, wildcards, values):
+    """
+    Replace the wildcards in a view path with the values they matched in the path on the
+    other side of the view.  '...' & '*' wildcards are matched up in order and positional
+    wildcards (%%1 - %%9) by number.
+
+    :returns:   The path with the wildcards replaced
+    """
+    ordered = {"...": [], "*": []}
+    positional = {}
+    for wildcard, value in zip(wildcards, values):
+        if wildcard in ordered:
+            ordered[wildcard].append(value)
+        else:
+            positional[wildcard] = value
+
+    result = ""
+    for part in _WILDCARD_REGEX.split(path):
+        if part in ordered:
+            result += ordered[part].pop(0) if ordered[part] else ""
+        elif part.startswith("%%"):
+            result += positional.get(part, "")
+        else:
+            result += part
+    return result
+
+
+# local paths are compared case-insensitively on platforms where the file system
+# is case-insensitive by default:
+LOCAL_PATHS_CASE_SENSITIVE = sys.platform not in ("win32", "darwin")
+
+def normalize_local_path(path, case_sensitive=None):
+    """
+    Normalize a local path so that it can be used to compare or look up paths
+
+    :param path:            The local path to normalize
+    :param case_sensitive:  True if the path is case-sensitive.  If None then this is
+                            determined from the current platform
+    :returns:               The path with '/' separators, lower case if paths aren't
+                            case-sensitive
+    """
+    if case_sensitive is None:
+        case_sensitive = LOCAL_PATHS_CASE_SENSITIVE
+    path = path.replace("\\", "/")
+    return path if case_sensitive else path.lower()
+
+
+def _strip_revision(depot_path):
+    """
+    :returns:   The depot path without any trailing #rev or @change specifier
+    """
+    return _REVISION_SPECIFIER_REGEX.sub("", depot_path)
+
+
+# how long a mapper is re-used for before the workspace spec is fetched again:
+MAPPER_CACHE_TTL = 30
+
+_g_mappers = {}
+_g_mappers_lock = threading.Lock()
+
+def get_client_path_mapper(p4, ttl=MAPPER_CACHE_TTL):
+    """
+    Get a ClientPathMapper for the connection's current workspace.  Mappers are cached for
+    a short time so that a sequence of calls only fetches the workspace spec once.
+
+    :param p4:  An open Perforce connection with the workspace set
+    :param ttl: The time in seconds a cached mapper can be re-used for
+    :returns:   A ClientPathMapper
+    :raises:    TankError if the workspace spec can't be fetched
+    """
+    key = (p4.port, p4.user, p4.client)
+    now = time.time()
+
+    _g_mappers_lock.acquire()
+    try:
+        cached = _g_mappers.get(key)
+        if cached and now - cached[0] <= ttl:
+            return cached[1]
+    finally:
+        _g_mappers_lock.release()
+
+    try:
+        client_spec = p4.fetch_client(p4.client)
+    except P4Exception, e:
+        raise TankError("Perforce: Failed to query the workspace view/mapping for user '%s', workspace '%s': %s"
+                        % (p4.user, p4.client, p4.errors[0] if p4.errors else e))
+    # the view is matched case-insensitively if either the workspace or the server
+    # isn't case-sensitive:
+    case_sensitive = LOCAL_PATHS_CASE_SENSITIVE and get_server_capabilities(p4).case_sensitive
+    mapper = ClientPathMapper.from_client_spec(client_spec, case_sensitive)
+
+    _g_mappers_lock.acquire()
+    try:
+        _g_mappers[key] = (now, mapper)
+    finally:
+        _g_mappers_lock.release()
+    return mapper
+
+def clear_client_path_mappers():
+    """
+    Forget all cached mappers, e.g. after a workspace's view has been changed
+    """
+    _g_mappers_lock.acquire()
+    try:
+        _g_mappers.clear()
+    finally:
+        _g_mappers_lock.release()
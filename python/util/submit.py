@@ -0,0 +1,241 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Asynchronous submit/shelve of Perforce changes
+"""
+
+import threading
+
+import P4
+
+from sgtk import TankError
+
+from .change import submit_change, shelve_change, PARALLEL_AUTO
+from ..connection.pool import get_connection_pool
+
+# P4.Progress is only available in newer versions of P4Python - when it's missing,
+# submits still work but no transfer progress is reported.
+_P4ProgressBase = getattr(P4, "Progress", object)
+
+
+class _SubmitProgress(_P4ProgressBase):
+    """
+    P4.Progress implementation that forwards transfer progress to a SubmitHandle
+    """
+
+    def __init__(self, handle):
+        """
+        Construction
+        """
+        if _P4ProgressBase is not object:
+            _P4ProgressBase.__init__(self)
+        self._handle = handle
+        self._description = ""
+        self._total = 0
+
+    def init(self, type):
+        self._description = ""
+        self._total = 0
+
+    def setDescription(self, description, units):
+        self._description = description
+
+    def setTotal(self, total):
+        self._total = total
+
+    def update(self, position):
+        if self._total:
+            percent = min(100.0, 100.0 * float(position) / float(self._total))
+            self._handle._set_progress(percent, "%s %s" % (self._handle._verbs[1], self._description))
+
+    def done(self, fail):
+        pass
+
+
+class SubmitHandle(object):
+    """
+    Handle for a change being submitted or shelved on a worker thread.  The handle 
+    can be polled or waited on, e.g. by the post-publish hook.
+    """
+
+    def __init__(self, change, progress_cb=None, shelve=False):
+        """
+        Construction
+
+        :param change:          The pending change being submitted
+        :param progress_cb:     Optional callback 'progress_cb(percentage, msg)'.  Note that
+                                this is called from the worker thread!
+        :param shelve:          True if the change is being shelved rather than submitted
+        """
+        self._change = str(change)
+        self._shelve = shelve
+        self._verbs = ("shelve", "Shelving", "Shelved") if shelve else ("submit", "Submitting", "Submitted")
+        self._progress_cb = progress_cb
+        self._progress = (0.0, "Waiting to %s change %s" % (self._verbs[0], change))
+        self._submitted_change = None
+        self._error = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    @property
+    def change(self):
+        """
+        :returns:   The id of the pending change being submitted
+        """
+        return self._change
+
+    @property
+    def shelve(self):
+        """
+        :returns:   True if the change is being shelved rather than submitted
+        """
+        return self._shelve
+
+    @property
+    def progress(self):
+        """
+        :returns:   Tuple containing the latest (percentage, message) reported by the transfer
+        """
+        self._lock.acquire()
+        try:
+            return self._progress
+        finally:
+            self._lock.release()
+
+    def done(self):
+        """
+        :returns:   True if the submit/shelve has finished, whether it succeeded or not
+        """
+        return self._done.isSet()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the submit/shelve to finish
+
+        :param timeout: Maximum time to wait in seconds or None to wait indefinitely
+        :returns:       True if the submit/shelve has finished, False if the wait timed out
+        """
+        self._done.wait(timeout)
+        return self._done.isSet()
+
+    def result(self, timeout=None):
+        """
+        Wait for the submit/shelve to finish and return the resulting change id
+
+        :param timeout: Maximum time to wait in seconds or None to wait indefinitely
+        :returns:       The id of the submitted change or the shelved change
+        :raises:        TankError if the submit/shelve failed or didn't finish within the timeout
+        """
+        if not self.wait(timeout):
+            raise TankError("Perforce: Timed out waiting to %s change %s" % (self._verbs[0], self._change))
+        if self._error:
+            raise TankError("Failed to %s change %s - %s" % (self._verbs[0], self._change, self._error))
+        return self._submitted_change
+
+    def _set_progress(self, percent, msg):
+        """
+        Update the progress - called from the worker thread
+        """
+        self._lock.acquire()
+        try:
+            self._progress = (percent, msg)
+        finally:
+            self._lock.release()
+
+        if self._progress_cb:
+            try:
+                self._progress_cb(percent, msg)
+            except Exception:
+                # never let a progress callback break the transfer!
+                pass
+
+    def _set_result(self, submitted_change, error):
+        """
+        Record the result of the transfer - called from the worker thread
+        """
+        self._submitted_change = submitted_change
+        self._error = error
+        if error:
+            self._set_progress(100.0, "Failed to %s change %s" % (self._verbs[0], self._change))
+        else:
+            self._set_progress(100.0, "%s change %s" % (self._verbs[2], submitted_change))
+        self._done.set()
+
+
+def submit_change_async(p4, change, progress_cb=None, parallel_threads=PARALLEL_AUTO):
+    """
+    Submit the specified change on a worker thread using a pooled connection so that
+    the calling thread (and any DCC UI) isn't blocked while the files are uploaded.
+
+    :param p4:                  An open Perforce connection.  This is only used to find the
+                                server, user and workspace - it is never used from the worker
+                                thread.
+    :param change:              The pending change to submit
+    :param progress_cb:         Optional callback 'progress_cb(percentage, msg)' called from the
+                                worker thread as the submit progresses
+    :param parallel_threads:    Number of threads the server should use to transfer files.  By
+                                default this is chosen automatically - see submit_change() for
+                                details
+    :returns:                   A SubmitHandle that can be used to poll/wait for the result
+    """
+    return _start_transfer(p4, change, progress_cb, parallel_threads, False)
+
+def shelve_change_async(p4, change, progress_cb=None, parallel_threads=PARALLEL_AUTO):
+    """
+    Shelve the specified change on a worker thread using a pooled connection.  The
+    files are reverted from the change once shelved (keeping the local files) so that
+    a separate process can submit it with submit_shelved_change().
+
+    :param p4:                  An open Perforce connection.  This is only used to find the
+                                server, user and workspace.
+    :param change:              The pending change to shelve
+    :param progress_cb:         Optional callback 'progress_cb(percentage, msg)' called from the
+                                worker thread as the shelve progresses
+    :param parallel_threads:    Number of threads the server should use to transfer files
+    :returns:                   A SubmitHandle that can be used to poll/wait for the result
+    """
+    return _start_transfer(p4, change, progress_cb, parallel_threads, True)
+
+def _start_transfer(p4, change, progress_cb, parallel_threads, shelve):
+    """
+    Start submitting/shelving the change on a worker thread
+
+    :returns:   A SubmitHandle for the transfer
+    """
+    handle = SubmitHandle(change, progress_cb, shelve)
+    pool = get_connection_pool()
+
+    # acquire the connection on the calling thread so that any problem connecting
+    # is reported immediately:
+    transfer_p4 = pool.acquire(p4)
+
+    def _do_transfer():
+        result_change = None
+        error = None
+        try:
+            handle._set_progress(0.0, "%s change %s" % (handle._verbs[1], change))
+            progress = _SubmitProgress(handle) if _P4ProgressBase is not object else None
+            if shelve:
+                shelve_change(transfer_p4, change, parallel_threads, progress)
+                result_change = str(change)
+            else:
+                result_change = submit_change(transfer_p4, change, parallel_threads, progress)
+        except Exception, e:
+            error = str(e)
+        finally:
+            pool.release(transfer_p4)
+        handle._set_result(result_change, error)
+
+    worker = threading.Thread(target=_do_transfer, name="Perforce %s %s" % (handle._verbs[0], change))
+    worker.daemon = True
+    worker.start()
+
+    return handle
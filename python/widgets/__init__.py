@@ -13,4 +13,5 @@ if hasattr(QtGui, "QWidget"):
     from .open_connection_form import OpenConnectionForm
     from .password_form import PasswordForm
     from .select_workspace_form import SelectWorkspaceForm
-    from .trust_form import TrustForm
\ No newline at end of file
+    from .trust_form import TrustForm
+    from .workspace_model import WorkspaceModel
\ No newline at end of file
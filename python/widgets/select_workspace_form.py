@@ -24,12 +24,20 @@ class SelectWorkspaceForm(QtGui.QWidget):
     def hide_tk_title_bar(self):
         return True    
     
-    def __init__(self, server, user, workspace_details, current_workspace=None, parent=None):
+    def __init__(self, server, user, workspace_model, current_workspace=None, parent=None):
         """
         Construction
+
+        :param server:              The server the workspaces are on
+        :param user:                The user the workspaces are being listed for
+        :param workspace_model:     A WorkspaceModel that will query the workspaces to list
+        :param current_workspace:   The workspace to select once it has been loaded
+        :param parent:              The parent widget
         """
         QtGui.QWidget.__init__(self, parent)
         
+        self._current_workspace = current_workspace
+        
         # setup UI:
         self.__ui = Ui_SelectWorkspaceForm()
         self.__ui.setupUi(self)
@@ -40,13 +48,29 @@ class SelectWorkspaceForm(QtGui.QWidget):
         self.__ui.cancel_btn.clicked.connect(self._on_cancel)
         self.__ui.ok_btn.clicked.connect(self._on_ok)
         
+        # the model is owned by the form from now on:
+        self._model = workspace_model
+        self._model.setParent(self)
+        self._model.rowsInserted.connect(self._on_workspaces_loaded)
+        self._model.layoutChanged.connect(self._update_ui)
+        self._model.modelReset.connect(self._update_ui)
+        self._model.query_finished.connect(self._on_query_finished)
+        self.__ui.workspace_list.setModel(self._model)
+        
         self.__ui.workspace_list.clicked.connect(self._on_workspace_clicked)
         self.__ui.workspace_list.doubleClicked.connect(self._on_workspace_doubleclicked)
-        self.__ui.workspace_list.currentCellChanged.connect(self._on_workspace_changed)
+        self.__ui.workspace_list.selectionModel().currentRowChanged.connect(self._on_workspace_changed)
         self.__ui.workspace_list.installEventFilter(self)
         
+        # filter the list once the user stops typing rather than on every key press:
+        self._filter_timer = QtCore.QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.setInterval(300)
+        self._filter_timer.timeout.connect(self._on_filter_timeout)
+        self.__ui.filter_edit.textChanged.connect(self._on_filter_changed)
+        
         # init list:
-        self._initialize(workspace_details, current_workspace)
+        self._initialize()
         
         # update UI:
         self._update_ui()
@@ -56,13 +80,10 @@ class SelectWorkspaceForm(QtGui.QWidget):
         """
         Return the name of the currently selected workspace: 
         """
-        items = self.__ui.workspace_list.selectedItems()
-        if not items:
+        rows = self.__ui.workspace_list.selectionModel().selectedRows()
+        if not rows:
             return None
-        selected_row = items[0].row()
-        
-        item = self.__ui.workspace_list.item(selected_row, 0)
-        return item.text()
+        return self._model.workspace_name(rows[0].row())
     
     def eventFilter(self, q_object, event):
         """
@@ -71,7 +92,7 @@ class SelectWorkspaceForm(QtGui.QWidget):
         """
         if q_object == self.__ui.workspace_list and event.type() == QtCore.QEvent.KeyPress:
             # handle key-press event in the workspace list control:
-            if event.key() == QtCore.Qt.Key_Return and self.__ui.workspace_list.selectedItems():
+            if event.key() == QtCore.Qt.Key_Return and self._something_selected():
                 # same as pressing ok:
                 self._on_ok()
                 return True
@@ -94,7 +115,7 @@ class SelectWorkspaceForm(QtGui.QWidget):
     def _on_workspace_doubleclicked(self, index):
         """
         """
-        if self.__ui.workspace_list.selectedItems():
+        if self._something_selected():
             self._on_ok()
 
     def _on_workspace_clicked(self, index):
@@ -102,47 +123,57 @@ class SelectWorkspaceForm(QtGui.QWidget):
         """
         self._update_ui()
     
-    def _on_workspace_changed(self, row, column, prev_row, prev_column):
+    def _on_workspace_changed(self, current, previous):
         """
         """
         self._update_ui()
         
-    def _update_ui(self):
+    def _on_filter_changed(self, text):
         """
         """
-        something_selected = bool(self.__ui.workspace_list.selectedItems())
-        self.__ui.ok_btn.setEnabled(something_selected)
+        self._filter_timer.start()
         
-    def _initialize(self, workspace_details, current_workspace):
+    def _on_filter_timeout(self):
         """
         """
-        column_labels = ["Workspace", "Description", "Location"]
-        self.__ui.workspace_list.setColumnCount(len(column_labels))
-        self.__ui.workspace_list.setHorizontalHeaderLabels(column_labels)
+        self._model.set_filter(self.__ui.filter_edit.text())
         
-        self.__ui.workspace_list.setRowCount(len(workspace_details))
+    def _on_workspaces_loaded(self, parent, first, last):
+        """
+        Select the current workspace as soon as it's been loaded
+        """
+        if self._current_workspace and not self._something_selected():
+            row = self._model.find_workspace(self._current_workspace)
+            if row >= first and row <= last:
+                self.__ui.workspace_list.selectRow(row)
+        self._update_ui()
         
-        selected_index = -1
-        for wsi, ws in enumerate(workspace_details):
-            ws_name = ws.get("client", "").strip()
-            if ws_name == current_workspace:
-                selected_index = wsi
-            
-            self.__ui.workspace_list.setItem(wsi, 0, QtGui.QTableWidgetItem(ws_name))
-            self.__ui.workspace_list.setItem(wsi, 1, QtGui.QTableWidgetItem(ws.get("Description", "").strip()))
-            self.__ui.workspace_list.setItem(wsi, 2, QtGui.QTableWidgetItem(ws.get("Root", "").strip()))
-            
-        if selected_index >= 0:
-            self.__ui.workspace_list.selectRow(selected_index)
-        else:
-            self.__ui.workspace_list.clearSelection()
-            
+    def _on_query_finished(self, error):
+        """
+        """
+        if error:
+            self.__ui.details_label.setText("Failed to retrieve the list of workspaces: %s" % error)
+        self._update_ui()
+        
+    def _something_selected(self):
+        """
+        """
+        return bool(self.__ui.workspace_list.selectionModel().selectedRows())
+        
+    def _update_ui(self):
+        """
+        """
+        self.__ui.ok_btn.setEnabled(self._something_selected())
+        
+    def _initialize(self):
+        """
+        """
+        self.__ui.workspace_list.clearSelection()
+        # don't sort until the user asks for it - the server already returns the 
+        # workspaces sorted by name:
+        self.__ui.workspace_list.horizontalHeader().setSortIndicator(-1, QtCore.Qt.AscendingOrder)
         self.__ui.workspace_list.setSortingEnabled(True)
-        self.__ui.workspace_list.resizeColumnToContents(0)
-    
-    
-    
-    
-    
-    
-    
\ No newline at end of file
+        self.__ui.workspace_list.setColumnWidth(0, 200)
+        
+        # start loading the workspaces:
+        self._model.refresh()
@@ -24,7 +24,10 @@ class Ui_SelectWorkspaceForm(object):
         self.details_label.setWordWrap(True)
         self.details_label.setObjectName("details_label")
         self.verticalLayout.addWidget(self.details_label)
-        self.workspace_list = QtGui.QTableWidget(SelectWorkspaceForm)
+        self.filter_edit = QtGui.QLineEdit(SelectWorkspaceForm)
+        self.filter_edit.setObjectName("filter_edit")
+        self.verticalLayout.addWidget(self.filter_edit)
+        self.workspace_list = QtGui.QTableView(SelectWorkspaceForm)
         self.workspace_list.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
         self.workspace_list.setTabKeyNavigation(False)
         self.workspace_list.setSelectionMode(QtGui.QAbstractItemView.SingleSelection)
@@ -32,8 +35,6 @@ class Ui_SelectWorkspaceForm(object):
         self.workspace_list.setWordWrap(False)
         self.workspace_list.setCornerButtonEnabled(False)
         self.workspace_list.setObjectName("workspace_list")
-        self.workspace_list.setColumnCount(0)
-        self.workspace_list.setRowCount(0)
         self.workspace_list.horizontalHeader().setCascadingSectionResizes(False)
         self.workspace_list.horizontalHeader().setSortIndicatorShown(True)
         self.workspace_list.horizontalHeader().setStretchLastSection(True)
@@ -67,6 +68,7 @@ class Ui_SelectWorkspaceForm(object):
     def retranslateUi(self, SelectWorkspaceForm):
         SelectWorkspaceForm.setWindowTitle(QtGui.QApplication.translate("SelectWorkspaceForm", "Form", None, QtGui.QApplication.UnicodeUTF8))
         self.details_label.setText(QtGui.QApplication.translate("SelectWorkspaceForm", "Please choose a Perforce Workspace for user \'\' on server \'\'", None, QtGui.QApplication.UnicodeUTF8))
+        self.filter_edit.setPlaceholderText(QtGui.QApplication.translate("SelectWorkspaceForm", "Filter workspaces...", None, QtGui.QApplication.UnicodeUTF8))
         self.cancel_btn.setText(QtGui.QApplication.translate("SelectWorkspaceForm", "Cancel", None, QtGui.QApplication.UnicodeUTF8))
         self.ok_btn.setText(QtGui.QApplication.translate("SelectWorkspaceForm", "Ok", None, QtGui.QApplication.UnicodeUTF8))
 
@@ -0,0 +1,326 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Lazily populated table model for the workspaces available to a user
+"""
+
+import threading
+
+from sgtk.platform.qt import QtCore
+
+
+class _QueryNotifier(QtCore.QObject):
+    """
+    Emits the results of a background workspace query.  Signals emitted from the worker
+    thread are queued and delivered to the model on the main thread.
+    """
+    query_finished = QtCore.Signal(int, object, object)
+
+
+class WorkspaceModel(QtCore.QAbstractTableModel):
+    """
+    Table model listing workspaces.  Workspaces are queried from the server a page at a time
+    on a background thread using a fetch function equivalent to:
+
+        p4.run_clients("-u", user, "-m", max_results, "-E", pattern)
+
+    and rows are only exposed to the view as it scrolls (canFetchMore/fetchMore) so that the
+    dialog opens immediately, even for users that own thousands of workspaces.
+    """
+
+    COLUMNS = ["Workspace", "Description", "Location"]
+    _COLUMN_KEYS = ["client", "Description", "Root"]
+
+    # emitted on the main thread whenever a query has finished - args are (error_msg or None)
+    query_finished = QtCore.Signal(object)
+
+    def __init__(self, fetch_fn, host=None, page_size=100, parent=None):
+        """
+        Construction
+
+        :param fetch_fn:    Callable 'fetch_fn(pattern, max_results)' returning a list of
+                            client dictionaries as returned by 'p4 clients'.  This is called
+                            from a worker thread so it must not use a connection that is in
+                            use elsewhere.
+        :param host:        If specified, only workspaces that are bound to this host or that
+                            aren't bound to any host are listed
+        :param page_size:   The number of workspaces to request from the server at a time
+        :param parent:      The parent QObject
+        """
+        QtCore.QAbstractTableModel.__init__(self, parent)
+
+        self._fetch_fn = fetch_fn
+        self._host = host
+        self._page_size = max(1, page_size)
+
+        self._pattern = None
+        self._workspaces = []
+        self._workspace_names = set()
+        self._visible_rows = 0
+        self._server_rows = 0
+        self._requested_rows = 0
+        self._server_exhausted = False
+        self._fetch_pending = False
+        self._sort_column = -1
+        self._sort_order = QtCore.Qt.AscendingOrder
+
+        self._query_id = 0
+        self._query_running = False
+        self._notifier = _QueryNotifier()
+        self._notifier.query_finished.connect(self._on_query_finished)
+
+    @property
+    def is_loading(self):
+        """
+        :returns:   True if a query is currently running in the background
+        """
+        return self._query_running
+
+    def set_filter(self, text):
+        """
+        Filter the workspaces to those whose name contains the specified text.  This
+        restarts the query from the first page.
+
+        :param text:    The text to filter on (case insensitive), or None/"" for all workspaces
+        """
+        text = (text or "").strip()
+        pattern = "*%s*" % text if text else None
+        if pattern == self._pattern and (self._requested_rows or self._query_running):
+            return
+
+        self._pattern = pattern
+        self.refresh()
+
+    def refresh(self):
+        """
+        Discard all workspaces and start querying again from the first page
+        """
+        self.beginResetModel()
+        try:
+            self._workspaces = []
+            self._workspace_names = set()
+            self._visible_rows = 0
+            self._server_rows = 0
+            self._requested_rows = 0
+            self._server_exhausted = False
+            self._fetch_pending = False
+            # any query still running is now stale - its results will be ignored:
+            self._query_id += 1
+            self._query_running = False
+        finally:
+            self.endResetModel()
+
+        self._request_page()
+
+    def workspace(self, row):
+        """
+        :param row: The row of the workspace in the model
+        :returns:   The client dictionary for the row or None
+        """
+        if row < 0 or row >= self._visible_rows:
+            return None
+        return self._workspaces[row]
+
+    def workspace_name(self, row):
+        """
+        :param row: The row of the workspace in the model
+        :returns:   The name of the workspace for the row or None
+        """
+        ws = self.workspace(row)
+        return ws.get("client", "").strip() if ws else None
+
+    def find_workspace(self, name):
+        """
+        :param name:    The name of the workspace to find
+        :returns:       The row of the workspace or -1 if it hasn't been loaded yet
+        """
+        if not name or name not in self._workspace_names:
+            return -1
+        for row in range(self._visible_rows):
+            if self.workspace_name(row) == name:
+                return row
+        return -1
+
+    # ------------------------------------------------------------------------------------------
+    # QAbstractTableModel overrides
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._visible_rows
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(WorkspaceModel.COLUMNS)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if (orientation == QtCore.Qt.Horizontal and role == QtCore.Qt.DisplayRole
+            and 0 <= section < len(WorkspaceModel.COLUMNS)):
+            return WorkspaceModel.COLUMNS[section]
+        return None
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or role not in (QtCore.Qt.DisplayRole, QtCore.Qt.ToolTipRole):
+            return None
+        ws = self.workspace(index.row())
+        if not ws or index.column() >= len(WorkspaceModel._COLUMN_KEYS):
+            return None
+        return ws.get(WorkspaceModel._COLUMN_KEYS[index.column()], "").strip()
+
+    def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.NoItemFlags
+        return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsSelectable
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return False
+        return self._visible_rows < len(self._workspaces) or not self._server_exhausted
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return
+
+        # expose the next batch of rows that have already been loaded:
+        remaining = len(self._workspaces) - self._visible_rows
+        if remaining > 0:
+            count = min(remaining, self._page_size)
+            self.beginInsertRows(QtCore.QModelIndex(), self._visible_rows, self._visible_rows + count - 1)
+            self._visible_rows += count
+            self.endInsertRows()
+        else:
+            # the view wants more rows than are loaded so expose them as soon as they arrive:
+            self._fetch_pending = True
+
+        # and make sure the next page is on its way from the server:
+        if len(self._workspaces) - self._visible_rows < self._page_size:
+            self._request_page()
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        self._sort_column = column
+        self._sort_order = order
+        self._sort_workspaces()
+
+    # ------------------------------------------------------------------------------------------
+    # private methods
+
+    def _request_page(self):
+        """
+        Start a background query for the next page of workspaces if one isn't already running
+        """
+        if self._query_running or self._server_exhausted:
+            return
+
+        # 'p4 clients' has no offset so each query asks for everything up to the next page.  The
+        # page size doubles each time to keep the total number of workspaces transferred bounded:
+        if not self._requested_rows:
+            self._requested_rows = self._page_size
+        else:
+            self._requested_rows = max(self._requested_rows * 2, self._server_rows + self._page_size)
+
+        self._query_running = True
+        query_id = self._query_id
+        pattern = self._pattern
+        max_results = self._requested_rows
+        fetch_fn = self._fetch_fn
+        notifier = self._notifier
+
+        def _do_query():
+            results = None
+            error = None
+            try:
+                results = fetch_fn(pattern, max_results)
+            except Exception, e:
+                error = str(e)
+            notifier.query_finished.emit(query_id, results, error)
+
+        worker = threading.Thread(target=_do_query, name="Perforce workspace query")
+        worker.daemon = True
+        worker.start()
+
+    def _on_query_finished(self, query_id, results, error):
+        """
+        Called on the main thread when a background query has finished
+        """
+        if query_id != self._query_id:
+            # results from a query that is no longer relevant:
+            return
+        self._query_running = False
+
+        if error:
+            self._server_exhausted = True
+            self.query_finished.emit(error)
+            return
+
+        results = results or []
+        self._server_exhausted = len(results) < self._requested_rows
+        new_results = results[self._server_rows:]
+        self._server_rows = len(results)
+
+        new_workspaces = []
+        for ws in new_results:
+            name = ws.get("client", "").strip()
+            if not name or name in self._workspace_names:
+                continue
+            # Host is always set but can be empty in which case the workspace can be used on
+            # any host, including this one:
+            if self._host and (ws.get("Host") or self._host) != self._host:
+                continue
+            self._workspace_names.add(name)
+            new_workspaces.append(ws)
+
+        if new_workspaces:
+            self._workspaces.extend(new_workspaces)
+            if self._sort_column >= 0:
+                self._sort_workspaces()
+            if self._visible_rows < self._page_size or self._fetch_pending:
+                self._fetch_pending = False
+                self.fetchMore()
+        elif not self._server_exhausted and self._visible_rows == len(self._workspaces):
+            # everything in this page was filtered out so keep going:
+            self._request_page()
+
+        self.query_finished.emit(None)
+
+    def _sort_workspaces(self):
+        """
+        Sort the loaded workspaces by the current sort column, keeping any persistent indexes
+        (e.g. the selection) pointing at the same workspaces.
+        """
+        if self._sort_column < 0 or self._sort_column >= len(WorkspaceModel._COLUMN_KEYS):
+            return
+
+        # sorting moves rows from anywhere in the loaded list so expose them all first:
+        if self._visible_rows < len(self._workspaces):
+            self.beginInsertRows(QtCore.QModelIndex(), self._visible_rows, len(self._workspaces) - 1)
+            self._visible_rows = len(self._workspaces)
+            self.endInsertRows()
+
+        self.layoutAboutToBeChanged.emit()
+        try:
+            persistent = self.persistentIndexList()
+            persistent_ws = [(idx, self.workspace(idx.row())) for idx in persistent]
+
+            key = WorkspaceModel._COLUMN_KEYS[self._sort_column]
+            self._workspaces.sort(key=lambda ws: ws.get(key, "").strip().lower(),
+                                  reverse=(self._sort_order == QtCore.Qt.DescendingOrder))
+
+            rows = dict((id(ws), row) for row, ws in enumerate(self._workspaces))
+            from_indexes = []
+            to_indexes = []
+            for idx, ws in persistent_ws:
+                from_indexes.append(idx)
+                row = rows.get(id(ws), -1) if ws else -1
+                to_indexes.append(self.index(row, idx.column()) if row >= 0 else QtCore.QModelIndex())
+            self.changePersistentIndexList(from_indexes, to_indexes)
+        finally:
+            self.layoutChanged.emit()
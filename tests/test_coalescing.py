@@ -0,0 +1,205 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Checks that util.RequestCoalescer shares queries between threads & invalidates its cached
+results correctly, running fstat against the fake server:
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import import_framework_module
+
+from P4 import P4Exception
+
+util = import_framework_module("util")
+testing = import_framework_module("testing")
+capabilities = import_framework_module("connection.capabilities")
+
+ROOT = "/mnt/ws"
+PATHS = ["//depot/a.ma", "//depot/b.ma", "//depot/c.ma"]
+TIMEOUT = 5.0
+
+
+class FstatQuery(object):
+    """
+    Query function passed to the coalescer that runs fstat on a connection and records
+    the (sorted) paths of each query.  If gated then the query blocks until released.
+    """
+    def __init__(self, p4, gated=False, fail=False):
+        self.p4 = p4
+        self.fail = fail
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not gated:
+            self.release.set()
+
+    def __call__(self, paths):
+        self.calls.append(sorted(paths))
+        self.started.set()
+        self.release.wait(TIMEOUT)
+        if self.fail:
+            raise P4Exception("Simulated failure")
+        return self.p4.run_fstat(paths)
+
+
+class QueryThread(threading.Thread):
+    """
+    Runs a query through the coalescer, keeping the result or the exception raised
+    """
+    def __init__(self, coalescer, p4, query, paths):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.args = (p4, "fstat", [], paths, query, "depotFile")
+        self.coalescer = coalescer
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.coalescer.run(*self.args)
+        except Exception, e:
+            self.error = e
+
+
+class RequestCoalescerTests(unittest.TestCase):
+    """
+    Run fstat for files through a RequestCoalescer from several threads, each with its
+    own connection to the same server & workspace
+    """
+
+    def setUp(self):
+        self.depot = testing.FakeDepot()
+        self.depot.add_user("artist")
+        self.depot.add_client("ws", "artist", ROOT, ["//depot/... //ws/..."])
+        self.depot.submit("artist", "ws", "initial", [(p, "add", "binary", 10, None) for p in PATHS])
+        self.coalescer = util.RequestCoalescer(ttl=60.0)
+        capabilities.get_server_capabilities(self._connect(), refresh=True)
+        util.clear_client_path_mappers()
+
+    def tearDown(self):
+        util.clear_client_path_mappers()
+
+    def _connect(self):
+        p4 = testing.FakeP4(self.depot)
+        p4.user = "artist"
+        p4.client = "ws"
+        p4.exception_level = 1
+        p4.connect()
+        return p4
+
+    def _start(self, query, paths):
+        thread = QueryThread(self.coalescer, query.p4, query, paths)
+        thread.start()
+        return thread
+
+    def _wait_for_coalesced(self, count):
+        """
+        Wait until the expected number of keys are waiting on another thread's query
+        """
+        end = time.time() + TIMEOUT
+        while self.coalescer.get_stats()["coalesced"] < count:
+            self.assertTrue(time.time() < end, "Timed out waiting for queries to be coalesced")
+            time.sleep(0.001)
+
+    def _join(self, *threads):
+        for thread in threads:
+            thread.join(TIMEOUT)
+            self.assertFalse(thread.is_alive())
+
+    def _paths(self, records):
+        return [r["depotFile"] for r in records]
+
+    def test_identical_queries_are_merged(self):
+        first = FstatQuery(self._connect(), gated=True)
+        second = FstatQuery(self._connect())
+        first_thread = self._start(first, PATHS[:2])
+        self.assertTrue(first.started.wait(TIMEOUT))
+        second_thread = self._start(second, PATHS[:2])
+        self._wait_for_coalesced(2)
+        first.release.set()
+        self._join(first_thread, second_thread)
+
+        self.assertEqual(first.calls, [PATHS[:2]])
+        self.assertEqual(second.calls, [])
+        self.assertEqual(self._paths(first_thread.result), PATHS[:2])
+        self.assertEqual(self._paths(second_thread.result), PATHS[:2])
+
+    def test_overlapping_queries_only_query_new_keys(self):
+        first = FstatQuery(self._connect(), gated=True)
+        second = FstatQuery(self._connect())
+        first_thread = self._start(first, PATHS[:2])
+        self.assertTrue(first.started.wait(TIMEOUT))
+        second_thread = self._start(second, PATHS[1:])
+        self._wait_for_coalesced(1)
+        first.release.set()
+        self._join(first_thread, second_thread)
+
+        self.assertEqual(first.calls, [PATHS[:2]])
+        self.assertEqual(second.calls, [PATHS[2:]])
+        self.assertEqual(self._paths(second_thread.result), PATHS[1:])
+
+    def test_failed_query_is_retried_by_waiting_threads(self):
+        first = FstatQuery(self._connect(), gated=True, fail=True)
+        second = FstatQuery(self._connect())
+        first_thread = self._start(first, PATHS)
+        self.assertTrue(first.started.wait(TIMEOUT))
+        second_thread = self._start(second, PATHS)
+        self._wait_for_coalesced(3)
+        first.release.set()
+        self._join(first_thread, second_thread)
+
+        self.assertTrue(isinstance(first_thread.error, P4Exception))
+        self.assertEqual(second.calls, [PATHS])
+        self.assertEqual(self._paths(second_thread.result), PATHS)
+
+        # the failed results aren't cached:
+        third = FstatQuery(self._connect())
+        self.coalescer.run(third.p4, "fstat", [], PATHS, third, "depotFile")
+        self.assertEqual(third.calls, [PATHS])
+
+    def test_results_are_cached(self):
+        query = FstatQuery(self._connect())
+        for _ in range(2):
+            self.assertEqual(self._paths(self.coalescer.run(query.p4, "fstat", [], PATHS, query, "depotFile")),
+                             PATHS)
+        self.assertEqual(query.calls, [PATHS])
+
+    def test_invalidate_by_local_path(self):
+        query = FstatQuery(self._connect())
+        self.coalescer.run(query.p4, "fstat", [], PATHS, query, "depotFile")
+        # results of the query by depot path are invalidated by the local path of the file:
+        self.coalescer.invalidate(query.p4, [os.path.join(ROOT, "a.ma")])
+        self.assertEqual(self._paths(self.coalescer.run(query.p4, "fstat", [], PATHS, query, "depotFile")), PATHS)
+        self.assertEqual(query.calls, [PATHS, PATHS[:1]])
+
+    def test_invalidate_during_query(self):
+        # results of a query that was running when the cache was invalidated aren't cached:
+        query = FstatQuery(self._connect(), gated=True)
+        thread = self._start(query, PATHS)
+        self.assertTrue(query.started.wait(TIMEOUT))
+        self.coalescer.invalidate(query.p4, [PATHS[0]])
+        query.release.set()
+        self._join(thread)
+
+        self.coalescer.run(query.p4, "fstat", [], PATHS, query, "depotFile")
+        self.assertEqual(query.calls, [PATHS, PATHS])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,221 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Checks that util.PublishIngester registers publishes once, including when a pass fails
+part way through, using the fake Perforce server & Shotgun site:
+
+    python -m unittest discover tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import import_framework_module
+
+import sgtk
+
+util = import_framework_module("util")
+testing = import_framework_module("testing")
+
+PUBLISH_NAME = "shotgun_metadata"
+REVIEW_NAME = "shotgun_review_metadata"
+
+
+class IngestFramework(object):
+    """
+    Stand-in for the framework that loads publish & review data through the metadata
+    backend.  The stored values are keys into dictionaries of data rather than YAML so
+    that the default hooks aren't needed.
+    """
+    def __init__(self, sg, publish_data, review_data):
+        self.shotgun = sg
+        self.publish_data = publish_data
+        self.review_data = review_data
+
+    def get_setting(self, name, default=None):
+        return "fake:1666" if name == "server" else default
+
+    def get_shotgun_user(self, p4_user):
+        return {"type": "HumanUser", "id": 1}
+
+    def load_publish_data(self, depot_path, user, workspace, revision, p4=None):
+        return self._load(p4, depot_path, revision, PUBLISH_NAME, self.publish_data)
+
+    def load_publish_review_data(self, depot_path, user, workspace, revision, p4=None):
+        return self._load(p4, depot_path, revision, REVIEW_NAME, self.review_data)
+
+    def log_info(self, msg):
+        pass
+
+    def log_warning(self, msg):
+        pass
+
+    def log_error(self, msg):
+        pass
+
+    def _load(self, p4, depot_path, revision, name, data):
+        key = util.get_metadata_backend().load(p4, depot_path, revision, name)
+        return {"data": dict(data[key]), "temp_files": []} if key else None
+
+
+class FailingShotgun(testing.FakeShotgun):
+    """
+    FakeShotgun that fails a single batch, counting from 1
+    """
+    def __init__(self):
+        testing.FakeShotgun.__init__(self)
+        self.fail_batch = None
+        self._batches = 0
+
+    def batch(self, requests):
+        self._batches += 1
+        if self._batches == self.fail_batch:
+            self.batch_error = testing.FakeShotgunError("Simulated failure of batch %d" % self._batches)
+        return testing.FakeShotgun.batch(self, requests)
+
+
+class PublishIngesterTests(unittest.TestCase):
+    """
+    Ingest a depot with a published texture, a published scene that depends on it & has
+    a review and a file without publish data
+    """
+
+    def setUp(self):
+        self.temp_folder = tempfile.mkdtemp()
+        thumbnail_path = os.path.join(self.temp_folder, "thumb.png")
+        movie_path = os.path.join(self.temp_folder, "review.mov")
+        for path in (thumbnail_path, movie_path):
+            with open(path, "w") as fh:
+                fh.write("data")
+
+        self.depot = testing.FakeDepot()
+        self.depot.add_user("artist")
+        self.depot.add_client("ws", "artist", "/mnt/ws", ["//depot/... //ws/..."])
+        self.changes = [
+            self.depot.submit("artist", "ws", "texture", [("//depot/tex.png", "add", "binary", 10,
+                                                           {PUBLISH_NAME: "tex"})]),
+            self.depot.submit("artist", "ws", "scene", [("//depot/scene.ma", "add", "binary", 10,
+                                                         {PUBLISH_NAME: "scene", REVIEW_NAME: "scene"})]),
+            self.depot.submit("artist", "ws", "notes", [("//depot/notes.txt", "add", "text", 10, None)])]
+        self.p4 = testing.FakeP4(self.depot)
+        self.p4.user = "artist"
+        self.p4.exception_level = 1
+        self.p4.connect()
+
+        self.sg = FailingShotgun()
+        publish_data = {"tex": {"name": "tex", "version_number": 5},
+                        "scene": {"name": "scene", "thumbnail_path": thumbnail_path,
+                                  "dependency_paths": ["//depot/tex.png"]}}
+        review_data = {"scene": {"code": "scene_review", "sg_uploaded_movie": movie_path}}
+        self.fw = IngestFramework(self.sg, publish_data, review_data)
+
+        self._current_bundle = sgtk.platform.current_bundle
+        sgtk.platform.current_bundle = lambda: self.fw
+        util.set_metadata_backend(util.AttributeMetadataBackend())
+
+    def tearDown(self):
+        sgtk.platform.current_bundle = self._current_bundle
+        util.set_metadata_backend(None)
+        shutil.rmtree(self.temp_folder)
+
+    def _ingester(self, changes_per_batch=50):
+        return util.PublishIngester(self.fw, self.p4, self.sg, {"type": "Project", "id": 1},
+                                    changes_per_batch=changes_per_batch)
+
+    def _entities(self, entity_type):
+        return self.sg.entities.get(entity_type, {}).values()
+
+    def _check_registered(self):
+        """
+        Check everything is registered exactly once
+        """
+        publishes = dict((p["code"], p) for p in self._entities("PublishedFile"))
+        self.assertEqual(sorted(publishes), ["scene.ma", "tex.png"])
+        self.assertEqual(len(self._entities("PublishedFile")), 2)
+
+        versions = self._entities("Version")
+        self.assertEqual(len(versions), 1)
+        self.assertEqual([p["id"] for p in versions[0]["published_files"]], [publishes["scene.ma"]["id"]])
+
+        dependencies = self._entities("PublishedFileDependency")
+        self.assertEqual([(d["published_file"]["id"], d["dependent_published_file"]["id"]) for d in dependencies],
+                         [(publishes["scene.ma"]["id"], publishes["tex.png"]["id"])])
+
+        uploads = sorted((entity_type, field) for entity_type, _, _, field in self.sg.uploads)
+        self.assertEqual(uploads, [("PublishedFile", "image"), ("Version", "sg_uploaded_movie")])
+
+    def test_ingest(self):
+        ingester = self._ingester()
+        stats = ingester.run_once()
+        self.assertEqual((stats.changes, stats.publishes, stats.versions, stats.dependencies, stats.skipped),
+                         (3, 2, 1, 1, 1))
+        self.assertEqual(ingester.get_last_change(), self.changes[-1])
+        self._check_registered()
+
+        # nothing new to ingest:
+        stats = ingester.run_once()
+        self.assertEqual((stats.changes, stats.publishes), (0, 0))
+        self._check_registered()
+
+    def _check_retry(self, fail_batch):
+        """
+        Fail a Shotgun batch, check the counter isn't advanced & that the next pass
+        completes the registration
+        """
+        self.sg.fail_batch = fail_batch
+        ingester = self._ingester()
+        self.assertRaises(testing.FakeShotgunError, ingester.run_once)
+        self.assertEqual(ingester.get_last_change(), 0)
+
+        ingester.run_once()
+        self.assertEqual(ingester.get_last_change(), self.changes[-1])
+        self._check_registered()
+
+    def test_retry_failed_publish_batch(self):
+        self._check_retry(1)
+
+    def test_retry_failed_dependency_batch(self):
+        self._check_retry(2)
+
+    def test_retry_failed_version_batch(self):
+        self._check_retry(3)
+
+    def test_retry_failed_upload(self):
+        ingester = self._ingester()
+        upload = self.sg.upload
+        def failing_upload(*args, **kwargs):
+            raise testing.FakeShotgunError("Simulated upload failure")
+        self.sg.upload = failing_upload
+        self.assertRaises(testing.FakeShotgunError, ingester.run_once)
+        self.assertEqual(ingester.get_last_change(), 0)
+
+        self.sg.upload = upload
+        ingester.run_once()
+        self._check_registered()
+
+    def test_counter_advances_per_batch(self):
+        # the counter is advanced past each batch of changes once it's registered:
+        self.sg.fail_batch = 2
+        ingester = self._ingester(changes_per_batch=1)
+        self.assertRaises(testing.FakeShotgunError, ingester.run_once)
+        self.assertEqual(ingester.get_last_change(), self.changes[0])
+
+        ingester.run_once()
+        self.assertEqual(ingester.get_last_change(), self.changes[-1])
+        self._check_registered()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Checks that util.run_with_limit_splitting splits queries that exceed a MaxResults limit
+on the fake server:
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import import_framework_module
+
+from P4 import P4Exception
+
+util = import_framework_module("util")
+testing = import_framework_module("testing")
+
+SCENE_PATHS = ["//depot/proj/scenes/shot_%02d.ma" % i for i in range(8)]
+TEXTURE_PATHS = ["//depot/proj/textures/tex_%d.png" % i for i in range(3)]
+ROOT_PATHS = ["//depot/proj/readme.txt"]
+
+
+class LimitSplittingTests(unittest.TestCase):
+    """
+    Run fstat with run_with_limit_splitting against a server with a MaxResults limit
+    """
+
+    def setUp(self):
+        self.depot = testing.FakeDepot()
+        self.depot.add_user("artist")
+        self.depot.submit("artist", "ws", "initial",
+                          [(p, "add", "binary", 10, None) for p in SCENE_PATHS + TEXTURE_PATHS + ROOT_PATHS])
+        self.p4 = testing.FakeP4(self.depot)
+        self.p4.user = "artist"
+        self.p4.exception_level = 1
+        self.p4.connect()
+        util.reset_limit_split_stats()
+
+    def tearDown(self):
+        util.reset_limit_split_stats()
+
+    def _fstat(self, args):
+        p4_res = util.run_with_limit_splitting(self.p4, "fstat", lambda part: self.p4.run_fstat(part), args)
+        return sorted(item["depotFile"] for item in p4_res)
+
+    def test_within_limit(self):
+        self.p4.max_results = len(SCENE_PATHS)
+        self.assertEqual(self._fstat(SCENE_PATHS), SCENE_PATHS)
+        self.assertEqual(self.p4.round_trips, 1)
+        self.assertEqual(util.get_limit_split_stats(), {})
+
+    def test_file_lists_are_bisected(self):
+        self.p4.max_results = 3
+        self.assertEqual(self._fstat(SCENE_PATHS), SCENE_PATHS)
+        # 8 -> 4 + 4 -> 2 + 2 + 2 + 2:
+        self.assertEqual(self.p4.command_counts.get("fstat"), 7)
+        self.assertEqual(util.get_limit_split_stats()["fstat"],
+                         {"limit_errors": 3, "splits": 3, "parts": 6, "failed": 0})
+
+    def test_wildcards_are_split_by_directory(self):
+        self.p4.max_results = len(SCENE_PATHS)
+        self.assertEqual(self._fstat(["//depot/proj/..."]), sorted(SCENE_PATHS + TEXTURE_PATHS + ROOT_PATHS))
+        # the files directly in the directory & each sub-directory are queried separately:
+        self.assertEqual(self.p4.command_counts.get("dirs"), 1)
+        self.assertEqual(self.p4.command_counts.get("fstat"), 4)
+        self.assertEqual(util.get_limit_split_stats()["fstat"],
+                         {"limit_errors": 1, "splits": 1, "parts": 3, "failed": 0})
+
+    def test_wildcard_revisions_are_kept(self):
+        self.p4.max_results = len(SCENE_PATHS)
+        self.assertEqual(self._fstat(["//depot/proj/...#head"]), sorted(SCENE_PATHS + TEXTURE_PATHS + ROOT_PATHS))
+
+    def test_unsplittable_query_fails(self):
+        self.p4.max_results = 2
+        self.assertRaises(P4Exception, self._fstat, SCENE_PATHS[:1] + ["//depot/proj/textures/*"])
+        self.assertEqual(util.get_limit_split_stats()["fstat"]["failed"], 1)
+
+    def test_other_errors_are_raised(self):
+        self.p4.max_results = 3
+        self.assertRaises(P4Exception, util.run_with_limit_splitting, self.p4, "fstat",
+                          lambda part: self.p4.run("unknown", part), SCENE_PATHS)
+        self.assertEqual(util.get_limit_split_stats(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Checks that util.IndexedMetadataBackend only indexes values confirmed by the server,
+using the fake server:
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import import_framework_module
+
+util = import_framework_module("util")
+testing = import_framework_module("testing")
+
+ROOT = "/mnt/ws"
+NAME = "shotgun_metadata"
+
+
+class IndexedMetadataBackendTests(unittest.TestCase):
+    """
+    Store, submit & load values through an IndexedMetadataBackend wrapping an
+    AttributeMetadataBackend on the fake server
+    """
+
+    def setUp(self):
+        self.depot = testing.FakeDepot()
+        self.depot.add_user("artist")
+        self.depot.add_client("ws", "artist", ROOT, ["//depot/... //ws/..."])
+        self.depot.submit("artist", "ws", "initial", [("//depot/a.ma", "add", "binary", 10, {NAME: "v1"})])
+        self.p4 = testing.FakeP4(self.depot)
+        self.p4.user = "artist"
+        self.p4.client = "ws"
+        self.p4.exception_level = 1
+        self.p4.connect()
+        self.p4.run_sync("//depot/...")
+        self.index = util.MetadataIndex(":memory:")
+        self.backend = util.IndexedMetadataBackend(util.AttributeMetadataBackend(), self.index)
+        util.set_metadata_backend(self.backend)
+
+    def tearDown(self):
+        util.set_metadata_backend(None)
+        self.index.close()
+
+    def _submit(self, values):
+        """
+        Edit //depot/a.ma, store the values against it & submit it through the framework
+
+        :returns:   The submitted revision
+        """
+        local_path = ROOT + "/a.ma"
+        self.p4.run_edit(local_path)
+        for name, value in values.iteritems():
+            self.backend.store(self.p4, local_path, name, value)
+        change = util.create_change(self.p4, "update")
+        util.add_to_change(self.p4, change, [local_path])
+        util.submit_change(self.p4, change)
+        return self.depot.head("//depot/a.ma").rev
+
+    def test_loads_are_indexed(self):
+        self.assertEqual(self.backend.load(self.p4, "//depot/a.ma", 1, NAME), "v1")
+        self.p4.reset_stats()
+        self.assertEqual(self.backend.load(self.p4, "//depot/a.ma", 1, NAME), "v1")
+        self.assertEqual(self.p4.round_trips, 0)
+
+    def test_missing_revisions_are_not_indexed(self):
+        # a revision the server doesn't return yet, e.g. on a lagging replica:
+        self.assertEqual(self.backend.load_many(self.p4, [("//depot/a.ma", 2)], NAME), {})
+        self.assertEqual(self.index.get(self.p4.port, [("//depot/a.ma", 2)], NAME), {})
+        rev = self._submit({NAME: "v2"})
+        self.assertEqual(rev, 2)
+        self.index.clear()
+        self.assertEqual(self.backend.load(self.p4, "//depot/a.ma", 2, NAME), "v2")
+
+    def test_submitted_values_are_read_back(self):
+        rev = self._submit({NAME: "v2"})
+        self.assertEqual(self.index.get(self.p4.port, [("//depot/a.ma", rev)], NAME), {("//depot/a.ma", rev): "v2"})
+
+    def test_reverted_values_are_not_indexed(self):
+        self.p4.run_edit(ROOT + "/a.ma")
+        self.backend.store(self.p4, ROOT + "/a.ma", "shotgun_review_metadata", "reverted")
+        self.p4.run_revert(ROOT + "/a.ma")
+        rev = self._submit({NAME: "v2"})
+        self.assertEqual(self.index.get(self.p4.port, [("//depot/a.ma", rev)], "shotgun_review_metadata"),
+                         {("//depot/a.ma", rev): None})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,192 @@
+# Copyright (c) 2013 Shotgun Software Inc.
+#
+# CONFIDENTIAL AND PROPRIETARY
+#
+# This work is provided "AS IS" and subject to the Shotgun Pipeline Toolkit
+# Source Code License included in this distribution package. See LICENSE.
+# By accessing, using, copying or modifying this work you indicate your
+# agreement to the Shotgun Pipeline Toolkit Source Code License. All rights
+# not expressly granted therein are reserved by Shotgun Software Inc.
+
+"""
+Checks that util.ClientPathMapper maps paths the same way as the server, using 'p4 where'
+on the fake server as the reference:
+
+    python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.common import import_framework_module
+
+util = import_framework_module("util")
+testing = import_framework_module("testing")
+capabilities = import_framework_module("connection.capabilities")
+
+ROOT = "/mnt/ws"
+
+
+class ClientPathMapperTests(unittest.TestCase):
+    """
+    Map depot & local paths through a variety of views with ClientPathMapper and with
+    'p4 where' and check the results match
+    """
+
+    def _connect(self, view, case_sensitive=True, alt_roots=None):
+        """
+        :returns:   A FakeP4 connected to a workspace with the view & a ClientPathMapper
+                    for the workspace
+        """
+        depot = testing.FakeDepot(case_sensitive=case_sensitive)
+        depot.add_user("artist")
+        depot.add_client("ws", "artist", ROOT, view, alt_roots=alt_roots)
+        p4 = testing.FakeP4(depot)
+        p4.user = "artist"
+        p4.client = "ws"
+        p4.exception_level = 1
+        p4.connect()
+        mapper = util.ClientPathMapper.from_client_spec(p4.fetch_client("ws"), case_sensitive)
+        return p4, mapper
+
+    def _where(self, p4, path):
+        """
+        :returns:   The single record returned by 'p4 where' for the path or an empty
+                    dictionary if it isn't mapped
+        """
+        results = [r for r in p4.run_where(path) if isinstance(r, dict)]
+        self.assertTrue(len(results) <= 1)
+        return results[0] if results else {}
+
+    def _assert_same(self, mapped, expected, case_sensitive):
+        """
+        Check a path mapped by ClientPathMapper against the path returned by the server.
+        Servers that aren't case-sensitive may return paths in a different case.
+        """
+        if not case_sensitive and mapped is not None and expected is not None:
+            mapped, expected = mapped.lower(), expected.lower()
+        self.assertEqual(mapped, expected)
+
+    def _check(self, view, depot_paths, local_paths, case_sensitive=True, alt_roots=None):
+        """
+        Check all of the paths map the same through ClientPathMapper & the server and
+        return the mapper for any further checks
+        """
+        p4, mapper = self._connect(view, case_sensitive, alt_roots)
+        for depot_path in depot_paths:
+            where = self._where(p4, depot_path)
+            self._assert_same(mapper.depot_to_client_path(depot_path), where.get("clientFile"), case_sensitive)
+            self._assert_same(mapper.depot_to_local_path(depot_path), where.get("path"), case_sensitive)
+            self.assertEqual(mapper.is_depot_path_mapped(depot_path), bool(where))
+        for local_path in local_paths:
+            where = self._where(p4, local_path)
+            self._assert_same(mapper.local_to_depot_path(local_path), where.get("depotFile"), case_sensitive)
+            self.assertEqual(mapper.is_local_path_mapped(local_path), bool(where))
+        self.assertEqual(mapper.filter_mapped_depot_paths(depot_paths),
+                         [p for p in depot_paths if self._where(p4, p)])
+        self.assertEqual(mapper.filter_mapped_local_paths(local_paths),
+                         [p for p in local_paths if self._where(p4, p)])
+        return mapper
+
+    def test_overlay_lines(self):
+        mapper = self._check(["//depot/... //ws/...",
+                              "+//depot/patches/... //ws/main/..."],
+                             ["//depot/main/a.ma", "//depot/patches/a.ma", "//depot/patches/sub/b.ma",
+                              "//depot/other/c.ma"],
+                             [ROOT + "/main/a.ma", ROOT + "/main/sub/b.ma", ROOT + "/patches/a.ma",
+                              ROOT + "/other/c.ma"])
+        # the later overlay line takes precedence for files in both locations:
+        self.assertEqual(mapper.local_to_depot_path(ROOT + "/main/a.ma"), "//depot/patches/a.ma")
+        self.assertEqual(mapper.depot_to_client_path("//depot/main/a.ma"), "//ws/main/a.ma")
+
+    def test_exclusion_lines(self):
+        mapper = self._check(["//depot/... //ws/...",
+                              "-//depot/main/private/... //ws/main/private/...",
+                              "//depot/main/private/keep/... //ws/main/private/keep/...",
+                              "-//depot/....tmp //ws/....tmp"],
+                             ["//depot/main/a.ma", "//depot/main/private/a.ma", "//depot/main/private/keep/a.ma",
+                              "//depot/main/scratch.tmp", "//depot/main/private"],
+                             [ROOT + "/main/a.ma", ROOT + "/main/private/a.ma", ROOT + "/main/private/keep/a.ma",
+                              ROOT + "/main/scratch.tmp"])
+        self.assertIsNone(mapper.local_to_depot_path(ROOT + "/main/private/a.ma"))
+        self.assertEqual(mapper.local_to_depot_path(ROOT + "/main/private/keep/a.ma"),
+                         "//depot/main/private/keep/a.ma")
+
+    def test_later_lines_take_precedence(self):
+        mapper = self._check(["//depot/a/... //ws/x/...",
+                              "//depot/b/... //ws/x/...",
+                              "//depot/c/... //ws/y/...",
+                              "//depot/c/sub/... //ws/z/..."],
+                             ["//depot/a/f.ma", "//depot/b/f.ma", "//depot/c/f.ma", "//depot/c/sub/f.ma"],
+                             [ROOT + "/x/f.ma", ROOT + "/y/f.ma", ROOT + "/y/sub/f.ma", ROOT + "/z/f.ma"])
+        # the second line remaps //ws/x/... so the first line no longer maps anything:
+        self.assertIsNone(mapper.depot_to_client_path("//depot/a/f.ma"))
+        self.assertEqual(mapper.local_to_depot_path(ROOT + "/x/f.ma"), "//depot/b/f.ma")
+
+    def test_wildcards(self):
+        self._check(["//depot/%%1/scenes/... //ws/scenes/%%1/...",
+                     "//depot/*.txt //ws/docs/*.txt"],
+                    ["//depot/shot_a/scenes/main.ma", "//depot/shot_a/renders/main.exr", "//depot/readme.txt",
+                     "//depot/docs/readme.txt"],
+                    [ROOT + "/scenes/shot_a/main.ma", ROOT + "/docs/readme.txt", ROOT + "/readme.txt"])
+
+    def test_alt_roots(self):
+        mapper = self._check(["//depot/... //ws/..."],
+                             ["//depot/main/a.ma"],
+                             [ROOT + "/main/a.ma", "C:\\ws\\main\\a.ma", "C:/ws/main/b.ma",
+                              "/Volumes/ws/main/a.ma", "/mnt/other/main/a.ma"],
+                             alt_roots=["C:\\ws", "/Volumes/ws"])
+        # local paths are always mapped under the primary root:
+        self.assertEqual(mapper.depot_to_local_path("//depot/main/a.ma"), os.path.join(ROOT, "main", "a.ma"))
+
+    def test_revision_specifiers(self):
+        _, mapper = self._connect(["//depot/... //ws/..."])
+        for depot_path in ["//depot/main/a.ma#3", "//depot/main/a.ma@12", "//depot/main/a.ma#head"]:
+            self.assertEqual(mapper.depot_to_client_path(depot_path), "//ws/main/a.ma")
+            self.assertTrue(mapper.is_depot_path_mapped(depot_path))
+
+    def test_separators(self):
+        self._check(["//depot/... //ws/...", "-//depot/main/private/... //ws/main/private/..."],
+                    ["//depot/main/a.ma"],
+                    [ROOT + "\\main\\a.ma", ROOT + "/main\\sub/a.ma", ROOT + "\\main\\private\\a.ma"])
+
+    def test_case_sensitive(self):
+        mapper = self._check(["//depot/Project/... //ws/project/..."],
+                             ["//depot/Project/Assets/A.ma", "//depot/project/Assets/A.ma"],
+                             [ROOT + "/project/Assets/A.ma", ROOT + "/Project/Assets/A.ma",
+                              "/MNT/WS/project/Assets/A.ma"])
+        self.assertIsNone(mapper.local_to_depot_path(ROOT + "/Project/Assets/A.ma"))
+
+    def test_case_insensitive(self):
+        view = ["//depot/Project/... //ws/project/...",
+                "-//depot/Project/Private/... //ws/project/private/...",
+                "//depot/%%1/Scenes/... //ws/scenes/%%1/..."]
+        mapper = self._check(view,
+                             ["//depot/Project/Assets/A.ma", "//DEPOT/project/assets/a.ma",
+                              "//depot/project/private/a.ma", "//depot/ShotA/scenes/Main.ma"],
+                             [ROOT + "/project/Assets/A.ma", ROOT + "/Project/Assets/A.ma",
+                              "/MNT/WS/Project\\Assets\\A.ma", ROOT + "/PROJECT/PRIVATE/a.ma",
+                              ROOT + "/Scenes/ShotA/Main.ma"],
+                             case_sensitive=False)
+        # the case of the view & of the path are both preserved in the mapped path:
+        self.assertEqual(mapper.local_to_depot_path("/MNT/WS/Project\\Assets\\A.ma"), "//depot/Project/Assets/A.ma")
+        self.assertEqual(mapper.local_to_depot_path(ROOT + "/Scenes/ShotA/Main.ma"), "//depot/ShotA/Scenes/Main.ma")
+        self.assertEqual(mapper.depot_to_client_path("//DEPOT/PROJECT/Assets/A.ma"), "//ws/project/Assets/A.ma")
+
+    def test_server_case_handling(self):
+        # the mapper for a connection matches the view case-insensitively if the server
+        # isn't case-sensitive:
+        for case_sensitive in [True, False]:
+            p4, _ = self._connect(["//depot/Project/... //ws/project/..."], case_sensitive)
+            capabilities.get_server_capabilities(p4, refresh=True)
+            util.clear_client_path_mappers()
+            mapper = util.get_client_path_mapper(p4)
+            self.assertEqual(mapper.is_local_path_mapped(ROOT + "/Project/a.ma"),
+                             not (util.path_mapping.LOCAL_PATHS_CASE_SENSITIVE and case_sensitive))
+        util.clear_client_path_mappers()
+
+
+if __name__ == "__main__":
+    unittest.main()